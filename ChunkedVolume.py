@@ -0,0 +1,276 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+CHUNK_SHAPE = (32, 64, 64)
+CACHE_BYTES = 256 * 2 ** 20  # budget of the decoded chunks kept in memory
+
+
+class ChunkedVolume:
+    META_FILENAME = 'chunks.json'
+
+    def __init__(self, directory, cache_bytes=CACHE_BYTES):
+        """
+        read-only 3D volume stored on disk as fixed-size chunks, one .npy file each.
+        chunk files are memory mapped and the decoded chunks are kept in a LRU cache with a byte budget,
+        so indexing touches only the chunks covered by the requested region.
+        supports basic indexing (ints and slices) and gathers of columns (volume[:, ys, xs]) or points
+        (volume[zs, ys, xs]) with integer arrays.
+
+        Args:
+            directory (str): directory of the chunks, see ChunkedVolume.create
+            cache_bytes (int): max size of the decoded chunks kept in memory
+        """
+        with open(os.path.join(directory, self.META_FILENAME), "r") as infile:
+            meta = json.load(infile)
+        self.directory = directory
+        self.shape = tuple(meta['shape'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.chunk_shape = tuple(meta['chunk_shape'])
+        self.key = meta.get('key')
+        self.cache_bytes = cache_bytes
+        self.__cache = OrderedDict()
+        self.__cached_bytes = 0
+        self.__lock = threading.Lock()
+
+    @classmethod
+    def create(cls, directory, array, chunk_shape=CHUNK_SHAPE, key=None, cache_bytes=CACHE_BYTES):
+        """
+        split an array in chunks. the array is read one slab of chunks at a time, so it can be a memmap
+        bigger than the available memory
+
+        Args:
+            directory (str): where to store the chunks
+            array (numpy array): (Z, H, W) volume
+            chunk_shape (tuple of int): shape of the chunks, the ones on the borders are smaller
+            key (str): identifier of the content of the volume, see ChunkedVolume.open
+            cache_bytes (int): max size of the decoded chunks kept in memory
+
+        Returns:
+            (ChunkedVolume): the chunked volume
+        """
+        os.makedirs(directory, exist_ok=True)
+        meta_path = os.path.join(directory, cls.META_FILENAME)
+        if os.path.isfile(meta_path):
+            os.remove(meta_path)
+        cz, cy, cx = chunk_shape
+        for k, z in enumerate(range(0, array.shape[0], cz)):
+            slab = np.asarray(array[z:z + cz])
+            for j, y in enumerate(range(0, array.shape[1], cy)):
+                for i, x in enumerate(range(0, array.shape[2], cx)):
+                    np.save(os.path.join(directory, cls.__chunk_filename(k, j, i)), slab[:, y:y + cy, x:x + cx])
+        meta = {'shape': list(array.shape), 'dtype': np.dtype(array.dtype).str,
+                'chunk_shape': list(chunk_shape), 'key': key}
+        with open(meta_path + '.tmp', "w") as outfile:
+            json.dump(meta, outfile)
+        os.replace(meta_path + '.tmp', meta_path)
+        return cls(directory, cache_bytes=cache_bytes)
+
+    @classmethod
+    def open(cls, directory, key=None, cache_bytes=CACHE_BYTES):
+        """
+        Args:
+            directory (str): directory of the chunks
+            key (str): identifier the volume has been created with
+            cache_bytes (int): max size of the decoded chunks kept in memory
+
+        Returns:
+            (ChunkedVolume): the chunked volume, None if it is missing, incomplete or has a different key
+        """
+        try:
+            volume = cls(directory, cache_bytes=cache_bytes)
+        except (OSError, ValueError, KeyError):
+            return None
+        if volume.key != key:
+            return None
+        return volume
+
+    @staticmethod
+    def __chunk_filename(k, j, i):
+        return "{}_{}_{}.npy".format(k, j, i)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        array = self[:, :, :]
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    def chunk(self, k, j, i):
+        """
+        Args:
+            k, j, i (int): position of the chunk along z, y and x
+
+        Returns:
+            (numpy array): the decoded chunk, it must not be modified
+        """
+        with self.__lock:
+            chunk = self.__cache.get((k, j, i))
+            if chunk is not None:
+                self.__cache.move_to_end((k, j, i))
+                return chunk
+        mapped = np.load(os.path.join(self.directory, self.__chunk_filename(k, j, i)), mmap_mode='r')
+        chunk = np.array(mapped)
+        chunk.setflags(write=False)
+        with self.__lock:
+            if (k, j, i) not in self.__cache:
+                self.__cache[(k, j, i)] = chunk
+                self.__cached_bytes += chunk.nbytes
+            while self.__cached_bytes > self.cache_bytes and len(self.__cache) > 1:
+                _, evicted = self.__cache.popitem(last=False)
+                self.__cached_bytes -= evicted.nbytes
+        return chunk
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key) or len(key) > 3:
+            raise IndexError("ChunkedVolume: unsupported index {}".format(key))
+        key = key + (slice(None),) * (3 - len(key))
+        arrays = [not isinstance(k, (slice, int, np.integer)) for k in key]
+        if not any(arrays):
+            return self.__get_region(key)
+        if not arrays[0] and isinstance(key[0], slice) and arrays[1] and arrays[2]:
+            return self.__get_columns(key[0], key[1], key[2])
+        if all(arrays):
+            return self.__get_points(*key)
+        raise IndexError("ChunkedVolume: unsupported index {}".format(key))
+
+    def __normalize_int(self, value, axis):
+        value = int(value)
+        if value < 0:
+            value += self.shape[axis]
+        if not 0 <= value < self.shape[axis]:
+            raise IndexError("index {} is out of bounds for axis {} with size {}".format(value, axis, self.shape[axis]))
+        return value
+
+    def __normalize_array(self, values, axis):
+        values = np.asarray(values)
+        if values.dtype.kind not in 'ui':
+            raise IndexError("ChunkedVolume: only integer arrays are valid indices")
+        values = np.where(values < 0, values + self.shape[axis], values).astype(np.intp)
+        if values.size and (values.min() < 0 or values.max() >= self.shape[axis]):
+            raise IndexError("index out of bounds for axis {} with size {}".format(axis, self.shape[axis]))
+        return values
+
+    def __get_region(self, key):
+        """
+        basic indexing: the region covered by the slices is assembled from its chunks,
+        then steps and integer indices are applied on it
+        """
+        if all(isinstance(k, (int, np.integer)) for k in key):
+            # single voxel, the fast path of the interpolation loops
+            z, y, x = (self.__normalize_int(k, axis) for axis, k in enumerate(key))
+            cz, cy, cx = self.chunk_shape
+            return self.chunk(z // cz, y // cy, x // cx)[z % cz, y % cy, x % cx]
+
+        bounds = []  # covered [start, stop) of each axis
+        local = []  # index to apply on the covered region
+        for axis, k in enumerate(key):
+            if isinstance(k, slice):
+                start, stop, step = k.indices(self.shape[axis])
+                n = len(range(start, stop, step))
+                if not n:
+                    bounds.append((0, 0))
+                    local.append(slice(0, 0))
+                elif step > 0:
+                    bounds.append((start, start + (n - 1) * step + 1))
+                    local.append(slice(None, None, step))
+                else:
+                    last = start + (n - 1) * step  # lowest touched index
+                    bounds.append((last, start + 1))
+                    local.append(slice(start - last, None, step))
+            else:
+                value = self.__normalize_int(k, axis)
+                bounds.append((value, value + 1))
+                local.append(0)
+
+        region = np.empty([stop - start for start, stop in bounds], dtype=self.dtype)
+        if region.size:
+            self.__fill(region, bounds)
+        return region[tuple(local)]
+
+    def __fill(self, region, bounds):
+        """
+        copy into region the data of all the chunks overlapping bounds
+        """
+        ranges = []
+        for (start, stop), c in zip(bounds, self.chunk_shape):
+            ranges.append(range(start // c, (stop - 1) // c + 1))
+        cz, cy, cx = self.chunk_shape
+        (z0, z1), (y0, y1), (x0, x1) = bounds
+        for k in ranges[0]:
+            for j in ranges[1]:
+                for i in ranges[2]:
+                    chunk = self.chunk(k, j, i)
+                    zs, ys, xs = max(z0, k * cz), max(y0, j * cy), max(x0, i * cx)
+                    ze, ye, xe = min(z1, (k + 1) * cz), min(y1, (j + 1) * cy), min(x1, (i + 1) * cx)
+                    region[zs - z0:ze - z0, ys - y0:ye - y0, xs - x0:xe - x0] = \
+                        chunk[zs - k * cz:ze - k * cz, ys - j * cy:ye - j * cy, xs - i * cx:xe - i * cx]
+
+    def __get_columns(self, z_slice, ys, xs):
+        """
+        volume[z_slice, ys, xs]: the z columns at the (y, x) points, grouped by the chunk they fall in
+        """
+        ys, xs = np.broadcast_arrays(self.__normalize_array(ys, 1), self.__normalize_array(xs, 2))
+        z_start, z_stop, z_step = z_slice.indices(self.shape[0])
+        z_range = range(z_start, z_stop, z_step)
+        out_shape = (len(z_range),) + ys.shape
+        if not len(z_range) or not ys.size:
+            return np.empty(out_shape, dtype=self.dtype)
+
+        z0, z1 = min(z_range[0], z_range[-1]), max(z_range[0], z_range[-1]) + 1
+        ys, xs = ys.ravel(), xs.ravel()
+        columns = np.empty((z1 - z0, len(ys)), dtype=self.dtype)
+        cz, cy, cx = self.chunk_shape
+        chunk_ids = (ys // cy) * (-(-self.shape[2] // cx)) + xs // cx
+        order = np.argsort(chunk_ids, kind='stable')
+        _, starts = np.unique(chunk_ids[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        for start, end in zip(starts, ends):
+            points = order[start:end]
+            j, i = int(ys[points[0]] // cy), int(xs[points[0]] // cx)
+            ly, lx = ys[points] - j * cy, xs[points] - i * cx
+            for k in range(z0 // cz, (z1 - 1) // cz + 1):
+                zs, ze = max(z0, k * cz), min(z1, (k + 1) * cz)
+                columns[zs - z0:ze - z0, points] = self.chunk(k, j, i)[zs - k * cz:ze - k * cz, ly, lx]
+        columns = columns[np.asarray(z_range) - z0]
+        return columns.reshape(out_shape)
+
+    def __get_points(self, zs, ys, xs):
+        """
+        volume[zs, ys, xs]: single voxels, grouped by the chunk they fall in
+        """
+        zs, ys, xs = np.broadcast_arrays(
+            self.__normalize_array(zs, 0), self.__normalize_array(ys, 1), self.__normalize_array(xs, 2))
+        shape = zs.shape
+        zs, ys, xs = zs.ravel(), ys.ravel(), xs.ravel()
+        values = np.empty(len(zs), dtype=self.dtype)
+        if not len(zs):
+            return values.reshape(shape)
+        cz, cy, cx = self.chunk_shape
+        n_y, n_x = -(-self.shape[1] // cy), -(-self.shape[2] // cx)
+        chunk_ids = ((zs // cz) * n_y + ys // cy) * n_x + xs // cx
+        order = np.argsort(chunk_ids, kind='stable')
+        _, starts = np.unique(chunk_ids[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        for start, end in zip(starts, ends):
+            points = order[start:end]
+            k, j, i = int(zs[points[0]] // cz), int(ys[points[0]] // cy), int(xs[points[0]] // cx)
+            values[points] = self.chunk(k, j, i)[zs[points] - k * cz, ys[points] - j * cy, xs[points] - i * cx]
+        return values.reshape(shape)
@@ -0,0 +1,78 @@
+import numpy as np
+
+SLAB_SIZE = 16  # rows of the volume transposed at a time
+
+
+class ColumnStore:
+
+    def __init__(self, columns):
+        """
+        (Z, H, W) volume stored as a C-contiguous (H, W, Z) array, so that each z column is contiguous in memory.
+        indexing follows the (Z, H, W) volume (volume[:, ys, xs] gives Z x N columns, volume[:, :, x] a Z x H
+        view and so on), gather reads the columns in their native N x Z layout.
+
+        Args:
+            columns (numpy array): (H, W, Z) array
+        """
+        self.columns = columns
+        H, W, Z = columns.shape
+        self.shape = (Z, H, W)
+        self.dtype = columns.dtype
+
+    @classmethod
+    def from_volume(cls, volume, slab_size=SLAB_SIZE):
+        """
+        transposed copy of a volume, made a few rows at a time so that volume can be a memmap or a ChunkedVolume
+
+        Args:
+            volume (numpy array): (Z, H, W) volume
+            slab_size (int): rows of the volume transposed at a time
+
+        Returns:
+            (ColumnStore): the column store of volume
+        """
+        Z, H, W = volume.shape
+        columns = np.empty((H, W, Z), dtype=volume.dtype)
+        for y in range(0, H, slab_size):
+            columns[y:y + slab_size] = np.asarray(volume[:, y:y + slab_size, :]).transpose(1, 2, 0)
+        return cls(columns)
+
+    @property
+    def ndim(self):
+        return 3
+
+    @property
+    def size(self):
+        return self.columns.size
+
+    @property
+    def nbytes(self):
+        return self.columns.nbytes
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        array = np.ascontiguousarray(self.columns.transpose(2, 0, 1))
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    def gather(self, ys, xs):
+        """
+        Args:
+            ys, xs (int numpy arrays): coordinates of the columns
+
+        Returns:
+            (numpy array): N x Z contiguous columns
+        """
+        return self.columns[ys, xs]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key) or len(key) > 3:
+            raise IndexError("ColumnStore: unsupported index {}".format(key))
+        z, y, x = key + (slice(None),) * (3 - len(key))
+        values = self.columns[y, x, z]
+        if isinstance(z, slice):
+            return np.moveaxis(values, -1, 0)  # the z axis is the last one of the store
+        return values
@@ -1,29 +1,78 @@
 from annotation.utils.image import get_mask_by_label
 from conf import labels as l
-from dicom_loader import dicom_from_dicomdir
+from dicom_loader import dicom_from_dicomdir, dicom_headers_from_dicomdir, overlays_from_datasets, \
+    save_datasets, series_from_dicomdir, volume_from_datasets
 import numpy as np
 from pydicom.filereader import read_dicomdir, dcmread
-from pydicom.pixel_data_handlers.numpy_handler import pack_bits
 from pydicom.multival import MultiValue
 from pydicom.valuerep import DSfloat
 import os
+import hashlib
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from Plane import Plane
+from VolumeCache import VolumeCache
+from ChunkedVolume import ChunkedVolume
+from ColumnStore import ColumnStore
+from VolumePyramid import VolumePyramid
+from ResamplingOperator import ResamplingOperator
 import processing
+import accelerated
+import interpolation
+import parallel
 
 OVERLAY_ADDR = 0x6004
+# overlay planes written by overwrite_annotations: (label, address, description).
+# the first one is the binary marker of the canal, the others have one label each
+OVERLAY_PLANES = [
+    (None, OVERLAY_ADDR, "Marker"),
+    (l.CONTOUR, 0x6006, "Contour"),
+    (l.INSIDE, 0x6008, "Inside"),
+    (l.BG, 0x600A, "Background"),
+    (l.UNLABELED, 0x600C, "Unlabeled"),
+]
+LABEL_OVERLAY_ADDRS = {label: addr for label, addr, _ in OVERLAY_PLANES[1:]}
 MIN_QUANTILE = 0.02
 MAX_QUANTILE = 0.98
+SLAB_SIZE = 16  # slices processed at a time by the slab-wise volume operations
+LINE_SLICE_BLOCK_POINTS = 4096  # points interpolated together by the vectorized line_slice
+PLANE_SLICE_BLOCK_POINTS = 2 ** 18  # points interpolated together by plane_slices
+RESAMPLING_OPERATORS = 4  # geometries whose ResamplingOperator is kept, see Jaw.resampling_operator
+QUANTIZED_DTYPE = np.uint16  # type of the quantized volume, see Jaw.quantized
+PYRAMID_LEVELS = 2  # downsampled levels of volume and gt_volume for the previews (2x and 4x), see Jaw.pyramid
+# labels kept by the downsampling of gt_volume, from the lowest to the highest priority (as get_label_volume)
+LABEL_PRIORITY = [l.UNLABELED, l.BG, l.INSIDE, l.CONTOUR]
 
 
 class Jaw:
 
-    def __init__(self, dicomdir_path):
+    def __init__(self, dicomdir_path, parallel_loading=True, use_cache=False, gt_only=False, chunked=False,
+                 column_store=False, quantized=False):
         """
         initialize a jaw object from a dicomdir path
         Args:
             dicomdir_path (String): path to the dicomdir file, MUST include the final DICOMDIR,
             flip (Bool): initial flip of the volume and dicom file lists?
+            parallel_loading (Bool): decode the DICOM slices on a thread pool, False for the sequential loader
+            use_cache (Bool): map the volumes from the VolumeCache next to the DICOMDIR when it is up to date,
+                and fill the cache after decoding otherwise. the cache is the volume_cache directory next to the
+                DICOMDIR: volume (4 bytes per voxel, 2 if quantized), final_HU (4) and gt_volume (1), plus the
+                pyramid levels when they are built. off by default, the GUI turns it on
+            gt_only (Bool): read just the headers and the overlays of the DICOM files. gt_volume and the geometry
+                are available right away, the pixel data are decoded only when volume (or a value derived
+                from it) is accessed for the first time
+            chunked (Bool): keep volume on disk as a ChunkedVolume stored in the cache (needs use_cache),
+                for scans that do not fit in memory. only the chunks touched by the cuts are loaded
+            column_store (Bool): keep an in-memory (H, W, Z) copy of volume, made at the first column cut,
+                where the z columns read by line_slice, create_panorex and x_slice/y_slice are contiguous.
+                it takes as much memory as volume, get_slice and the axial views keep reading volume
+            quantized (Bool): keep volume as uint16 (the raw values clipped to the quantiles, at the precision
+                of the scanner) instead of float32, with half the memory and half the bandwidth of each gather.
+                the cuts are interpolated from it and divided by max_value only when they are returned (see
+                dequantize). series with negative or non integer values keep the float32 volume
+
+        downsampled copies of volume and gt_volume for the previews are built at their first use, see pyramid
         """
         basename = os.path.basename(dicomdir_path)
         if basename.lower() != 'dicomdir':
@@ -31,47 +80,397 @@ class Jaw:
 
         self.dicomdir_path = dicomdir_path
         self.dicom_dir = dcmread(os.path.join(dicomdir_path), force=True)
-        self.filenames, self.dicom_files, self.volume = dicom_from_dicomdir(self.dicom_dir)
-        self.Z, self.H, self.W = self.volume.shape
-        self.HU_intercept, self.HU_slope = self.__get_HU_rescale_params()
-
-        # ADJUST WINDOW
-        w = self.dicom_files[0].WindowWidth
-        c = self.dicom_files[0].WindowCenter
-
-        if type(w) == MultiValue and type(c) == MultiValue:
-            # ChatGPT suggestion
-            ymax = c[1] + (w[1] / 2)
-            ymin = c[0] - (w[0] / 2)
-            c = c[0]
-            w = w[0]
-        elif type(w) == DSfloat and type(c) == DSfloat:
-            ymax = c + (w / 2)
-            ymin = c - (w / 2)
+        self.parallel_loading = parallel_loading
+        self.chunked = chunked
+        # overlay edits of each slice and, for each export path, the edits already written there
+        self._slice_versions = {}
+        self._exported_versions = {}
+        self._operators = OrderedDict()
+        self.column_store = column_store
+        self._columns = None
+        self._coefficients = {}
+        self._quantize = quantized
+        self._pyramid = None
+        self._gt_pyramid = None
+        self._volume_in_cache = False
+
+        # the values computed at their first use (the pending volume, columns, coefficients and pyramids) are
+        # built once even if they are asked for by different threads (panorex stack, side volume prefetch)
+        self._lazy_lock = threading.RLock()
+        self._loading_volume = False
+        self._cache = None
+        self._pending_volume = False
+        self._dicom_gt_volume = None  # annotations of the DICOM files, kept for the cache if they are overwritten
+        if use_cache:
+            self._cache = VolumeCache(dicomdir_path, *series_from_dicomdir(self.dicom_dir))
+            meta = self._cache.read_meta()
+            if meta is not None and meta.get('quantized', False) == quantized:
+                self.__load_from_cache(self._cache, meta)
+                return
+
+        if gt_only:
+            self.filenames, self.dicom_files = dicom_headers_from_dicomdir(self.dicom_dir)
+            self.Z, self.H, self.W = len(self.dicom_files), int(self.dicom_files[0].Rows), int(self.dicom_files[0].Columns)
+            raw_volume = None
         else:
-            raise Exception("Type of W and C are different or have a unexpected type.")
+            self.filenames, self.dicom_files, raw_volume = dicom_from_dicomdir(self.dicom_dir, parallel=parallel_loading)
+            self.Z, self.H, self.W = raw_volume.shape
+        self.HU_intercept, self.HU_slope = self.__get_HU_rescale_params()
+        self.window = self.__get_window_params()
 
-        tmp = self.volume * self.HU_slope + self.HU_intercept
-        # windowing - no matter how you change data in tool, final_HU is the best input range and will be used when dumping volumes.npy
-        self.final_HU = tmp.copy()
-        self.final_HU = ((self.final_HU - (c - .5)) / (w - 1) + .5) * (ymax - ymin) + ymin
-        self.final_HU[tmp < (c - .5 - (w - 1) / 2)] = ymin
-        self.final_HU[tmp > (c - .5 + (w - 1) / 2)] = ymax
-        print(self.final_HU.min(), print(self.final_HU.max()))
-        # END ADJUST WINDOW
+        self._flipped = False
         try:
             if self.dicom_files[1].ImagePositionPatient[-1] - self.dicom_files[0].ImagePositionPatient[-1] > 0:  # Z-axis has to be flipped
-                self.volume = np.flip(self.volume, 0)
-                self.final_HU = np.flip(self.final_HU, 0)
+                if raw_volume is not None:
+                    raw_volume = np.flip(raw_volume, 0)
                 self.dicom_files.reverse()
                 self.filenames.reverse()
+                self._flipped = True
         except Exception:
             pass
-        self.__remove_quantiles()
+
+        if raw_volume is None:
+            self.gt_volume = self.__build_ann_volume()
+            # volume, max_value, min_HU, max_HU and final_HU are set by __set_volumes at the first access
+            self._volume = None
+            self.max_value = None
+            self._pending_volume = True
+        else:
+            self.__set_volumes(raw_volume)
+            self.gt_volume = self.__build_ann_volume()
+            self.__fill_cache(raw_volume)
+
+    def __set_volumes(self, raw_volume):
+        """
+        compute the normalized volume from the raw one, already flipped
+
+        Args:
+            raw_volume (numpy array): raw (Z, H, W) volume
+        """
         self.max_value = 0
-        self.__normalize()
-        self.gt_volume = self.__build_ann_volume()
-        self.HU_volume = self.convert_01_to_HU(self.volume)
+        self.volume = self.__normalize(*self.__remove_quantiles(raw_volume))
+        # final_HU is not stored: it is mapped from the cache or computed on demand from the raw volume
+        self.raw_volume = raw_volume
+        self._final_HU = None
+
+    def __fill_cache(self, raw_volume, gt_volume=None):
+        """
+        store volume, final_HU and gt_volume in the cache (if enabled) and map final_HU from there
+
+        Args:
+            raw_volume (numpy array): raw (Z, H, W) volume, already flipped
+            gt_volume (numpy array): annotations read from the DICOM files, self.gt_volume if None
+        """
+        if self._cache is None:
+            return
+        try:
+            final_HU = self._cache.create('final_HU', raw_volume.shape, np.float32)
+        except OSError as e:
+            print("WARNING: could not write the volume cache in {}: {}".format(self._cache.dir, e))
+            return
+        self.apply_window(raw_volume, out=final_HU)
+        saved = self._cache.save(
+            {'volume': self.volume, 'final_HU': final_HU,
+             'gt_volume': self.gt_volume if gt_volume is None else gt_volume},
+            flipped=self._flipped, max_value=float(self.max_value),
+            min_HU=float(self.min_HU), max_HU=float(self.max_HU), quantized=self._quantize)
+        if saved:
+            self._final_HU = self._cache.load('final_HU')
+            self.raw_volume = None
+            self.volume = self.to_chunked('volume', self._cache.load('volume'), key=self.__volume_key())
+            self._volume_in_cache = True
+
+    def __load_pending_volume(self):
+        """
+        decode the pixel data of a jaw loaded with gt_only. the other threads asking for volume wait
+        for the decode, the calls made by the decode itself (e.g. convert_01_to_HU) return at once
+        """
+        with self._lazy_lock:
+            if not self._pending_volume or self._loading_volume:
+                return
+            self._loading_volume = True
+            try:
+                raw_volume = volume_from_datasets(self.dicom_files, workers=None if self.parallel_loading else 1)
+                self.__set_volumes(raw_volume)
+                # the cached annotations are the ones of the DICOM files, gt_volume may have been edited in the
+                # meantime and the overlays of the datasets may have been overwritten by overwrite_annotations
+                gt_volume = self._dicom_gt_volume if self._dicom_gt_volume is not None else self.__build_ann_volume()
+                self._dicom_gt_volume = None
+                self.__fill_cache(raw_volume, gt_volume)
+                self._pending_volume = False
+            finally:
+                self._loading_volume = False
+
+    @property
+    def volume(self):
+        """
+        float32 volume normalized in [0, 1], or uint16 volume in [0, max_value] if quantized (see dequantize)
+        """
+        if self._pending_volume:
+            self.__load_pending_volume()
+        return self._volume
+
+    @volume.setter
+    def volume(self, volume):
+        self._volume = volume
+        self._columns = None
+        self._coefficients = {}
+        self._pyramid = None
+        self._volume_in_cache = False  # the levels of its pyramid can be cached only if it comes from the cache
+
+    @property
+    def gt_volume(self):
+        """
+        volume of the annotations: labels (see conf.labels) or a binary mask of the canal
+        """
+        return self._gt_volume
+
+    @gt_volume.setter
+    def gt_volume(self, gt_volume):
+        self._gt_volume = gt_volume
+        self._gt_pyramid = None
+
+    @property
+    def quantized(self):
+        """
+        True if volume is the uint16 quantized volume, whose values are divided by max_value by dequantize
+        """
+        return self.volume.dtype == QUANTIZED_DTYPE
+
+    def __volume_key(self):
+        """key of the chunks of volume, which depend on its type"""
+        return 'quantized' if self.quantized else ''
+
+    def dequantize(self, data):
+        """
+        values of volume, or of cuts interpolated from it, in the [0, 1] range of the normalized volume.
+        to be used at display or export time: a quantized volume is converted with the single factor max_value
+
+        Args:
+            data (numpy array): values in the units of volume
+
+        Returns:
+            (numpy array): float32 values, data itself if volume is not quantized
+        """
+        if not self.quantized:
+            return data
+        return np.divide(data, self.max_value, dtype=np.float32)
+
+    def __volume_cut(self, cut, dequantize, clip=False):
+        """
+        values of a cut interpolated from volume, see dequantize
+
+        Args:
+            cut (float numpy array): cut in the units of volume, modified in place
+            dequantize (bool): cut in [0, 1] if True, uint16 values of the quantized volume (rounded to the
+                nearest one) otherwise. ignored if volume is not quantized
+            clip (bool): clip the cut to the range of volume
+
+        Returns:
+            (numpy array): the cut
+        """
+        if self.quantized:
+            if not dequantize:
+                np.clip(cut, 0, self.max_value, out=cut)
+                return np.rint(cut).astype(QUANTIZED_DTYPE)
+            cut /= self.max_value
+        if clip:
+            np.clip(cut, 0, 1, out=cut)  # fixing possible overflows
+        return cut
+
+    @property
+    def columns(self):
+        """
+        volume as read by the column samplers: its ColumnStore if column_store is set, volume itself otherwise
+        """
+        if not self.column_store:
+            return self.volume
+        with self._lazy_lock:
+            if self._columns is None:
+                self._columns = ColumnStore.from_volume(self.volume)
+            return self._columns
+
+    def kernel_volume(self, kernel, columns=True, level=0):
+        """
+        volume read by an interpolation kernel: columns, or the coefficients of a kernel with a prefilter
+        (the cubic B-spline), computed at the first use and kept until volume changes
+
+        Args:
+            kernel (str or interpolation.Kernel): interpolation kernel
+            columns (bool): the volume is sampled by z columns (side views, panorex) or by points (planes)
+            level (int): level of the pyramid of volume, see pyramid. the downsampled levels are small
+                enough to be read as they are, without a ColumnStore
+
+        Returns:
+            (numpy array or ColumnStore): the volume to sample with the kernel
+        """
+        kernel = interpolation.get_kernel(kernel)
+        if kernel.prefilter is None:
+            return self.get_level(level) if level else self.columns
+        with self._lazy_lock:
+            coefficients = self._coefficients.get((kernel.name, columns, level))
+            if coefficients is None:
+                coefficients = kernel.prefilter(self.get_level(level), (1, 2) if columns else (0, 1, 2))
+                if self.column_store and not level:
+                    coefficients = ColumnStore.from_volume(coefficients)
+                self._coefficients[(kernel.name, columns, level)] = coefficients
+            return coefficients
+
+    def pyramid(self, gt=False):
+        """
+        multi-resolution pyramid of volume or of gt_volume for the previews, with PYRAMID_LEVELS levels
+        downsampled by 2 and 4 along each axis. volume is averaged (the quantized volume stays uint16), labels
+        are never mixed: each voxel of gt_volume takes the label of highest priority of its block (LABEL_PRIORITY),
+        or the max of a binary gt_volume. the levels are computed at their first use; those of volume are stored
+        in the volume cache, those of gt_volume (which is edited) are kept until it changes
+
+        Args:
+            gt (bool): pyramid of gt_volume instead of volume
+
+        Returns:
+            (VolumePyramid): the pyramid
+        """
+        with self._lazy_lock:
+            if gt:
+                if self._gt_pyramid is None:
+                    priority = None if np.max(self.gt_volume) <= 1 else LABEL_PRIORITY
+                    self._gt_pyramid = VolumePyramid(
+                        self.gt_volume, lambda volume: processing.downsample_labels(volume, priority, SLAB_SIZE),
+                        levels=PYRAMID_LEVELS)
+                return self._gt_pyramid
+            if self._pyramid is None:
+                cache = self._cache if self._volume_in_cache else None
+                self._pyramid = VolumePyramid(
+                    self.volume, lambda volume: processing.downsample_mean(volume, SLAB_SIZE), levels=PYRAMID_LEVELS,
+                    cache=cache, name='volume_pyramid', key=self.__volume_key())
+            return self._pyramid
+
+    def get_level(self, level, gt=False):
+        """
+        Args:
+            level (int): level of the pyramid, 0 for the full resolution
+            gt (bool): level of gt_volume instead of volume
+
+        Returns:
+            (numpy array): volume (in the units of volume, see dequantize) or gt_volume downsampled by 2 ** level
+        """
+        if not level:
+            return self.gt_volume if gt else self.volume
+        return self.pyramid(gt).level(level)
+
+    @staticmethod
+    def __level_coords(coords, level):
+        """full resolution coordinates in the voxels of a pyramid level, the centers of the voxels are aligned"""
+        if not level:
+            return coords
+        return (np.asarray(coords, dtype=np.float64) + 0.5) / VolumePyramid.scale(level) - 0.5
+
+    def __upsample_z(self, cut, level, axis, nearest=False):
+        """cut interpolated from a pyramid level back to the Z slices of the full resolution"""
+        if not level:
+            return cut
+        return processing.upsample_axis(cut, self.Z, axis, VolumePyramid.scale(level), nearest=nearest)
+
+    def __load_from_cache(self, cache, meta):
+        """
+        map the volumes from an up to date cache instead of decoding the series.
+        the DICOM datasets are still read, but their pixel data stay on disk until they are accessed.
+
+        Args:
+            cache (VolumeCache): the cache of this DICOMDIR
+            meta (dict): metadata stored in the cache
+        """
+        self.filenames, self.dicom_files = dicom_headers_from_dicomdir(self.dicom_dir)
+        self._flipped = meta['flipped']
+        if self._flipped:
+            self.dicom_files.reverse()
+            self.filenames.reverse()
+        self.volume = cache.load('volume')
+        self.raw_volume = None
+        self._final_HU = cache.load('final_HU')
+        self.gt_volume = cache.load('gt_volume', mmap_mode='c')  # annotations are edited in place, never on disk
+        self.Z, self.H, self.W = self.volume.shape
+        self.HU_intercept, self.HU_slope = self.__get_HU_rescale_params()
+        self.window = self.__get_window_params()
+        self.max_value = meta['max_value']
+        self.min_HU, self.max_HU = meta['min_HU'], meta['max_HU']
+        self.volume = self.to_chunked('volume', self.volume, key=self.__volume_key())
+        self._volume_in_cache = True
+
+    def to_chunked(self, name, array, key=''):
+        """
+        chunked on-disk copy of an array, stored in the volume cache. the copy is made only once,
+        as long as the cache and the key do not change
+
+        Args:
+            name (str): name of the array
+            array (numpy array): (Z, H, W) array, can be a memmap
+            key (str): identifier of the content of the array, if it does not come from the DICOM files
+
+        Returns:
+            (ChunkedVolume or numpy array): the chunked array, array itself if the jaw is not chunked
+        """
+        if not self.chunked or self._cache is None:
+            return array
+        key = self._cache.key + key
+        directory = self._cache.chunks_dir(name)
+        chunked = ChunkedVolume.open(directory, key)
+        if chunked is None:
+            try:
+                chunked = ChunkedVolume.create(directory, array, key=key)
+            except OSError as e:
+                print("WARNING: could not write the chunks of {} in {}: {}".format(name, directory, e))
+                return array
+        return chunked
+
+    def resampling_operator(self, xy_set=None, planes=None, level=0, keep=True):
+        """
+        sparse resampling operator of a set of cuts, built once per geometry and shared by the cuts of volume,
+        gt_volume, real_gt_volume or generated along the same coordinates and by the GT reconstruction.
+        the last RESAMPLING_OPERATORS geometries are kept.
+
+        Args:
+            xy_set (2D or 3D numpy array): one or more sets of xy coordinates, see line_slice
+            planes (4D numpy array or list of Plane objects): N planes of shape 3xZxW, see plane_slices
+            level (int): level of the pyramid the operator is applied to, the coordinates are in its voxels
+            keep (bool): False for a one-off geometry, whose operator is neither looked up nor kept, so that it
+                does not evict the others (and it can be built from any thread)
+
+        Returns:
+            (ResamplingOperator): the operator of the geometry
+        """
+        if xy_set is not None:
+            coords, columns = np.asarray(xy_set, dtype=np.float64), True
+        else:
+            coords = np.asarray([p.get_plane() if type(p) is Plane else p for p in planes], dtype=np.float64)
+            columns = False
+        shape = self.pyramid().shape(level) if level else (self.Z, self.H, self.W)
+        key = keep and (columns, shape, coords.shape, hashlib.sha1(np.ascontiguousarray(coords)).hexdigest())
+        operator = self._operators.get(key) if keep else None
+        if operator is None:
+            if columns:
+                operator = ResamplingOperator.from_side_coords(shape, coords, block_points=LINE_SLICE_BLOCK_POINTS)
+            else:
+                operator = ResamplingOperator.from_planes(shape, coords, block_points=PLANE_SLICE_BLOCK_POINTS)
+            if not keep:
+                return operator
+            self._operators[key] = operator
+            while len(self._operators) > RESAMPLING_OPERATORS:
+                self._operators.popitem(last=False)
+        self._operators.move_to_end(key)
+        return operator
+
+    @property
+    def final_HU(self):
+        """
+        windowed HU volume, the best input range: it is used when dumping volume.npy.
+        it is a view on the cache when available, otherwise it is computed from the raw volume at each access.
+        """
+        if self._pending_volume:
+            self.__load_pending_volume()
+        if self._final_HU is not None:
+            return self._final_HU
+        return self.apply_window(self.raw_volume)
 
     def merge_predictions(self, plane, pred):
         """
@@ -88,6 +487,7 @@ class Jaw:
             plane[1, idx[:, 1], idx[:, 0]].astype(np.int),
             plane[0, idx[:, 1], idx[:, 0]].astype(np.int)
         ] = 1
+        self._gt_pyramid = None  # edited in place
 
     ############
     # DICOM OPS
@@ -107,6 +507,57 @@ class Jaw:
         else:
             return -1000, 1
 
+    def __get_window_params(self):
+        """
+        Retrieves the window of the series from DICOM's DataSet
+
+        Returns:
+            (float, float, float, float): window center, window width, lower and upper output values
+        """
+        w = self.dicom_files[0].WindowWidth
+        c = self.dicom_files[0].WindowCenter
+
+        if type(w) == MultiValue and type(c) == MultiValue:
+            # ChatGPT suggestion
+            ymax = c[1] + (w[1] / 2)
+            ymin = c[0] - (w[0] / 2)
+            c = c[0]
+            w = w[0]
+        elif type(w) == DSfloat and type(c) == DSfloat:
+            ymax = c + (w / 2)
+            ymin = c - (w / 2)
+        else:
+            raise Exception("Type of W and C are different or have a unexpected type.")
+        return float(c), float(w), float(ymin), float(ymax)
+
+    def apply_window(self, raw, out=None):
+        """
+        convert raw data to HU and apply the window of the series.
+        the computation runs in place in float32, a few slices at a time.
+
+        Args:
+            raw (numpy array): raw volume as read from the DICOM files
+            out (numpy array): float32 array where to store the result, allocated if None
+
+        Returns:
+            (numpy array): windowed HU volume
+        """
+        c, w, ymin, ymax = self.window
+        if out is None:
+            out = np.empty(raw.shape, dtype=np.float32)
+        for z in range(0, raw.shape[0], SLAB_SIZE):
+            slab = out[z:z + SLAB_SIZE]
+            np.multiply(raw[z:z + SLAB_SIZE], float(self.HU_slope), out=slab, dtype=np.float32)
+            slab += float(self.HU_intercept)
+            # values below/above the window saturate to ymin/ymax
+            slab -= c - .5
+            slab /= w - 1
+            slab += .5
+            slab *= ymax - ymin
+            slab += ymin
+            np.clip(slab, ymin, ymax, out=slab)
+        return out
+
     def __add_overlay(self, ds, overlay_data, overlay_addr, overlay_desc):
         """
         Add annotation overlay at OVERLAY_ADDR
@@ -126,23 +577,61 @@ class Jaw:
         ds.add_new((overlay_addr, 0x0102), "US", 0)
         ds.add_new((overlay_addr, 0x3000), "OB", overlay_data)
 
-    def __overwrite_address(self, volume, overlay_addr=OVERLAY_ADDR, overlay_desc="Marker"):
+    def __overwrite_address(self, overlay_bytes, overlay_addr=OVERLAY_ADDR, overlay_desc="Marker"):
         """
-        Overwrites a specific overlay address with given volumetric data.
+        Overwrites a specific overlay address with given packed data.
 
         Args:
-            volume (np.ndarray): volumetric data
+            overlay_bytes (list of bytes): packed overlay of each slice
             overlay_addr (int): address
+            overlay_desc (str): description
         """
-        for slice_num in range(len(self.dicom_files)):
-            overlay = volume[slice_num].flatten()
-            packed_bytes = pack_bits(overlay)
-            if len(packed_bytes) % 2:  # padding if needed
-                packed_bytes += b'\x00'
-            if self.dicom_files[slice_num].get((overlay_addr, 0x3000)) is None:
+        for slice_num, packed_bytes in enumerate(overlay_bytes):
+            overlay = self.dicom_files[slice_num].get((overlay_addr, 0x3000))
+            if overlay is None:
                 self.__add_overlay(self.dicom_files[slice_num], packed_bytes, overlay_addr, overlay_desc)
-            else:
+            elif overlay.value != packed_bytes:
                 self.dicom_files[slice_num][overlay_addr, 0x3000].value = packed_bytes
+            else:
+                continue
+            self._slice_versions[slice_num] = self._slice_versions.get(slice_num, 0) + 1
+
+    def __pack_annotations(self):
+        """
+        encode gt_volume as the five overlay planes of the annotated DICOM files in a single pass:
+        a lookup table maps each label to a code with one bit per plane, then each plane is bit-packed
+        for a whole slab of slices at once
+
+        Returns:
+            (list of list of bytes): for each plane of OVERLAY_PLANES, the packed overlay of each slice
+        """
+        # bit 0 is the binary marker (see get_gt_volume), then one bit per label.
+        # index 256 gathers the values that are not labels (negative, too big or not integer)
+        lut = np.zeros(257, dtype=np.uint8)
+        binary = np.max(self.gt_volume) in [0, 1]
+        lut[1 if binary else [l.CONTOUR, l.INSIDE]] = 1
+        for bit, (label, _, _) in enumerate(OVERLAY_PLANES[1:], start=1):
+            lut[label] |= 1 << bit
+
+        n_pixels = self.H * self.W
+        n_bytes = (n_pixels + 7) // 8
+        n_bytes += n_bytes % 2  # overlay data must have even length
+        packed = np.zeros((len(OVERLAY_PLANES), self.Z, n_bytes), dtype=np.uint8)
+        for z in range(0, self.Z, SLAB_SIZE):
+            slab = np.asarray(self.gt_volume[z:z + SLAB_SIZE]).reshape(-1, n_pixels)
+            if slab.dtype == np.uint8:
+                codes = lut[slab]
+            else:
+                idx = slab.astype(np.int64)
+                idx[(idx != slab) | (idx < 0) | (idx > 255)] = 256
+                codes = lut[idx]
+            for bit in range(len(OVERLAY_PLANES)):
+                bits = (codes >> bit) & 1
+                # DICOM overlays store the first pixel in the least significant bit
+                rows = np.packbits(bits, axis=1, bitorder='little')
+                packed[bit, z:z + SLAB_SIZE, :rows.shape[1]] = rows
+        return [[packed[bit, slice_num].tobytes() for slice_num in range(self.Z)]
+                for bit in range(len(OVERLAY_PLANES))]
 
     def overwrite_annotations(self):
 
@@ -153,29 +642,37 @@ class Jaw:
         if len(self.dicom_files) != self.gt_volume.shape[0]:
             raise Exception("ground truth volume has invalid shape with respect to the DICOM files!")
 
-        volume = self.get_gt_volume(labels=[l.CONTOUR, l.INSIDE])
-        contour = get_mask_by_label(self.gt_volume, l.CONTOUR)
-        inside = get_mask_by_label(self.gt_volume, l.INSIDE)
-        bg = get_mask_by_label(self.gt_volume, l.BG)
-        unlabeled = get_mask_by_label(self.gt_volume, l.UNLABELED)
-
-        self.__overwrite_address(volume, OVERLAY_ADDR)
-        self.__overwrite_address(contour, 0x6006, "Contour")
-        self.__overwrite_address(inside, 0x6008, "Inside")
-        self.__overwrite_address(bg, 0x600A, "Background")
-        self.__overwrite_address(unlabeled, 0x600C, "Unlabeled")
+        if self._pending_volume and self._cache is not None and self._dicom_gt_volume is None:
+            # the cache is filled when the pixel data are decoded, with the annotations read before this edit
+            self._dicom_gt_volume = self.__build_ann_volume()
+        for (_, overlay_addr, overlay_desc), overlay_bytes in zip(OVERLAY_PLANES, self.__pack_annotations()):
+            self.__overwrite_address(overlay_bytes, overlay_addr, overlay_desc)
 
     def save_dicom(self, path):
         """
-        export the dicom files and the dicomdir to the path folder
+        export the dicom files and the dicomdir to the path folder.
+        the first export to a folder writes the whole series, the following ones rewrite only the
+        slices whose overlays changed since then (and the files missing from the folder)
 
         Args:
             path (str): path where dicom files are going to be saved
         """
         Path(path).mkdir(parents=True, exist_ok=True)
-        self.dicom_dir.save_as(os.path.join(path, 'DICOMDIR'))
-        for i, dicom in enumerate(self.dicom_files):
-            dicom.save_as(os.path.join(path, self.filenames[i]))
+        key = os.path.abspath(path)
+        exported = self._exported_versions.get(key)
+        dicomdir_path = os.path.join(path, 'DICOMDIR')
+        if exported is None or not os.path.isfile(dicomdir_path):
+            self.dicom_dir.save_as(dicomdir_path)
+
+        to_save = []
+        for i, filename in enumerate(self.filenames):
+            file_path = os.path.join(path, filename)
+            if exported is None or exported.get(i, 0) != self._slice_versions.get(i, 0) \
+                    or not os.path.isfile(file_path):
+                to_save.append(i)
+        save_datasets([self.dicom_files[i] for i in to_save],
+                      [os.path.join(path, self.filenames[i]) for i in to_save])
+        self._exported_versions[key] = dict(self._slice_versions)
 
     ###############
     # CUT FUNCTIONS
@@ -194,7 +691,7 @@ class Jaw:
         if cut_gt:
             return np.squeeze(self.gt_volume[:, :, x_val])
         else:
-            return np.squeeze(self.volume[:, :, x_val])
+            return self.dequantize(np.squeeze(self.columns[:, :, x_val]))
 
     def y_slice(self, y_val, cut_gt=False):
         """
@@ -210,9 +707,10 @@ class Jaw:
         if cut_gt:
             return np.squeeze(self.gt_volume[:, y_val, :])
         else:
-            return np.squeeze(self.volume[:, y_val, :])
+            return self.dequantize(np.squeeze(self.columns[:, y_val, :]))
 
-    def line_slice(self, xy_set, cut_gt=False, interp_fn='bilinear_interpolation', step_fn=None):
+    def line_slice(self, xy_set, cut_gt=False, interp_fn='bilinear_interpolation', step_fn=None, vectorized=True,
+                   workers=None, dequantize=True, level=0, keep_operator=True):
         """
         make a slice using a set of xy coordinates.
         if cut_gt is true the cut is performed on the annotated binary volume and the nearest neighbour interpolation
@@ -223,13 +721,35 @@ class Jaw:
         Args:
             xy_set (2D or 3D numpy array):
             cut_gt (bool): if true cuts the ground truth image, if false cuts the original volume.
-                Possible values are: bilinear_interpolation, bicubic_interpolation
-            interp_fn (str): name of the interpolation function
+            interp_fn (str): name of the interpolation kernel (see interpolation.KERNELS) or of the interpolation
+                function (bilinear_interpolation, bicubic_interpolation)
+            step_fn (function): called with (done, total) cuts to report the progress
+            vectorized (bool): interpolate all the points of a block of cuts at once with the cached
+                ResamplingOperator of xy_set, False for the point by point loop (slower, kept for comparison)
+            workers (int): threads of the vectorized cut, see parallel.run_chunks
+            dequantize (bool): cuts of a quantized volume in [0, 1], False to keep them as uint16 (see dequantize)
+            level (int): preview cuts interpolated from a level of the pyramid (see pyramid), always vectorized.
+                they keep the shape of the full resolution ones
+            keep_operator (bool): keep the ResamplingOperator of xy_set for the next cuts along the same
+                coordinates, False for one-off cuts (see resampling_operator)
 
         Returns:
             a 2D or 3D numpy array with the cuts
         """
 
+        if vectorized or level:
+            kernel = interpolation.get_kernel('nearest' if cut_gt else interp_fn)
+            operator = self.resampling_operator(xy_set=self.__level_coords(xy_set, level), level=level,
+                                                keep=keep_operator)
+            cut = operator.cut(self.get_level(level, gt=True) if cut_gt else self.kernel_volume(kernel, level=level),
+                               kernel=kernel, step_fn=step_fn, workers=workers)
+            cut = self.__upsample_z(cut, level, axis=1, nearest=cut_gt)
+            if cut_gt:
+                np.clip(cut, 0, 1, out=cut)  # fixing possible overflows
+            else:
+                cut = self.__volume_cut(cut, dequantize, clip=True)
+            return np.squeeze(cut)  # clean axis 0 in case of just one cut
+
         if cut_gt:
             interp_fn = lambda x, y: self.gt_volume[:, int(y), int(x)]  # nearest
         else:
@@ -251,13 +771,16 @@ class Jaw:
                 else:
                     cut[num_cut, :, w_id] = interp_fn(x, y)  # interpolation
 
-        # fixing possible overflows
-        cut[cut > 1] = 1
-        cut[cut < 0] = 0
+        if cut_gt:
+            # fixing possible overflows
+            cut[cut > 1] = 1
+            cut[cut < 0] = 0
+        else:
+            cut = self.__volume_cut(cut, dequantize, clip=True)
 
         return np.squeeze(cut)  # clean axis 0 in case of just one cut
 
-    def plane_slice(self, plane, cut_gt=False, interp_fn='trilinear_interpolation'):
+    def plane_slice(self, plane, cut_gt=False, interp_fn='trilinear_interpolation', vectorized=True, dequantize=True):
         """
         cut the volumes according to a plane of coordinates. the resulting image has the shape of the plane.
         each point of the plane contains the set of zxy coordinates where the function perform the interpolation.
@@ -266,7 +789,11 @@ class Jaw:
             plane (3D numpy array): shape is 3xZxW where W is the len of the xy set of coordinates.
                 values are ordered as follow: [0] z coords, [1] x coords, [2] y coords
             cut_gt (bool): if true cuts is performed on the ground truth volume
-            interp_fn (string): name of the interpolation function, if cut_gt is True the interp_fn is nearest.
+            interp_fn (string): name of the interpolation kernel (see interpolation.KERNELS) or of the interpolation
+                function, if cut_gt is True the interp_fn is nearest.
+            vectorized (bool): interpolate all the points of the plane at once,
+                False for the point by point loop (slower, kept for comparison)
+            dequantize (bool): cut of a quantized volume in [0, 1], False to keep it as uint16 (see dequantize)
 
         Returns:
             cut (2D numpy array)
@@ -275,6 +802,9 @@ class Jaw:
         if type(plane) is Plane:  # get numpy array if plane obj is passed
             plane = plane.get_plane()
 
+        if vectorized:
+            return self.__plane_cut(np.asarray(plane)[:, :self.Z], cut_gt, interp_fn, dequantize)
+
         if cut_gt:
             def interp_fn(z,x,y):
                 z, y, x = int(z), int(y), int(x)
@@ -295,86 +825,210 @@ class Jaw:
                     cut[row, col] = 0
                 else:
                     cut[row, col] = interp_fn(z, x, y)  # z, x, y
-        return cut
+        return cut if cut_gt else self.__volume_cut(cut, dequantize)
+
+    def plane_slices(self, planes, cut_gt=False, interp_fn='linear', step_fn=None, workers=None, dequantize=True):
+        """
+        vectorized plane_slice of a stack of planes, blocks of planes are cut on a thread pool
+
+        Args:
+            planes (4D numpy array or list of Plane objects): N planes of shape 3xZxW
+            cut_gt (bool): if true cuts are performed on the ground truth volume (nearest)
+            interp_fn (str): interpolation kernel of the volume cuts, see interpolation.KERNELS
+            step_fn (function): called with (done, total) planes to report the progress
+            workers (int): size of the thread pool, see parallel.run_chunks
+            dequantize (bool): cuts of a quantized volume in [0, 1], False to keep them as uint16 (see dequantize)
+
+        Returns:
+            cuts (3D numpy array): N x Z x W cuts
+        """
+        if len(planes) == 0:
+            return np.zeros((0, self.Z, 0))
+        if type(planes[0]) is Plane:
+            # the coordinates of a block are generated when it is cut, see Plane.grid
+            shape = (len(planes), min(planes[0].Z, self.Z), planes[0].W)
+            block_coords = lambda start, stop: np.stack([plane.grid(stop=self.Z) for plane in planes[start:stop]], 1)
+        else:
+            planes = np.asarray(planes)[:, :, :self.Z]
+            shape = (planes.shape[0],) + planes.shape[2:]
+            block_coords = lambda start, stop: np.moveaxis(planes[start:stop], 1, 0)
+        quantized = not cut_gt and not dequantize and self.quantized
+        cuts = np.zeros(shape, QUANTIZED_DTYPE if quantized else np.float64)
+        # blocks of planes small enough to keep the temporary arrays in a few MB
+        block = max(1, PLANE_SLICE_BLOCK_POINTS // max(1, shape[1] * shape[2]))
+        cut_gt or self.kernel_volume(interp_fn, columns=False)  # prepared once, before the threads start
+
+        def cut_block(start, stop):
+            cuts[start:stop] = self.__plane_cut(block_coords(start, stop), cut_gt, interp_fn, dequantize)
+
+        parallel.run_chunks(cut_block, shape[0], block, workers=workers, step_fn=step_fn)
+        return cuts
+
+    def __plane_cut(self, plane, cut_gt, interp_fn, dequantize=True):
+        """
+        see plane_slice: interpolation of all the points of one or more planes at once
 
-    def create_panorex(self, coords, include_annotations=False):
+        Args:
+            plane (numpy array): 3 x ... coordinates, [0] x, [1] y, [2] z
+            cut_gt (bool): nearest on real_gt_volume if True, interp_fn on volume otherwise
+            interp_fn (str): interpolation kernel
+            dequantize (bool): see plane_slice
+
+        Returns:
+            (numpy array): float64 cut with the shape of the coordinates, uint16 if it is kept quantized
+        """
+        x, y, z = plane[0], plane[1], plane[2]
+        outside = (z < 0) | (x < 0) | (y < 0)
+        x, y, z = np.where(outside, 0, x), np.where(outside, 0, y), np.where(outside, 0, z)
+
+        if cut_gt:
+            cut = interpolation.sample_points(self.real_gt_volume, z, y, x, 'nearest').astype(np.float64)
+        else:
+            # avoid possible overflows, as trilinear_interpolation
+            x = np.where(x + 1 >= self.W, self.W - 2, x)
+            z = np.where(z + 1 >= self.Z, self.Z - 2, z)
+            y = np.where(y + 1 >= self.H, self.H - 2, y)
+            kernel = interpolation.get_kernel(interp_fn)
+            if kernel.name == 'linear':
+                cut = accelerated.trilinear(self.kernel_volume(kernel, columns=False), z, y, x)
+            else:
+                cut = interpolation.sample_points(self.kernel_volume(kernel, columns=False), z, y, x, kernel)
+        cut[outside] = 0
+        return cut if cut_gt else self.__volume_cut(cut, dequantize)
+
+    def create_panorex(self, coords, include_annotations=False, interp_fn='linear', dequantize=True, level=0):
         """
-        Create a 2D panorex image from a set of coordinates on the dental arch
+        Create a 2D panorex image from a set of coordinates on the dental arch.
+        columns whose interpolation would fall outside the volume are left black
 
         Args:
             coords (float numpy array): set of coordinates for the cut
             include_annotations (bool): if this flag is set, the panorex image is returned as an RGB
             image where the labels are marked in red
+            interp_fn (str): interpolation kernel, see interpolation.KERNELS
+            dequantize (bool): panorex of a quantized volume in [0, 1], False to keep it as uint16
+                (see dequantize). the RGB panorex with the annotations is always in [0, 1]
+            level (int): preview panorex interpolated from a level of the pyramid (see pyramid), with the shape
+                of the full resolution one
 
         Returns:
             panorex (numpy array)
         """
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        x, y = coords[:, 0], coords[:, 1]
         panorex = np.zeros((self.Z, len(coords)), np.float32)
-        for idx, (x, y) in enumerate(coords):
-            try:
-                panorex[:, idx] = self.bilinear_interpolation(x, y)
-            except:
-                continue
+
+        # the four neighbours of the bilinear interpolation must be inside the volume (NaN coords are not),
+        # wider kernels repeat the border voxels
+        valid = (x >= 0) & (x < self.W - 1) & (y >= 0) & (y < self.H - 1)
+        if valid.any():
+            kernel = interpolation.get_kernel(interp_fn)
+            columns = interpolation.sample_columns(self.kernel_volume(kernel, level=level),
+                                                   self.__level_coords(x[valid], level),
+                                                   self.__level_coords(y[valid], level), kernel)
+            panorex[:, valid] = self.__upsample_z(columns, level, axis=0)
+        panorex = self.__volume_cut(panorex, dequantize or include_annotations)
 
         if include_annotations:
-            panorex_gt = np.zeros((self.Z, len(coords)), np.float32)
-            for idx, (x, y) in enumerate(coords):
-                try:
-                    panorex_gt[:, idx] = np.max(
-                        self.gt_volume[
-                        :,
-                        int(np.floor(y)):int(np.floor(y) + 1) + 1,
-                        int(np.floor(x)):int(np.floor(x) + 1) + 1
-                        ],
-                        axis=(1, 2)
-                    )
-                except:
-                    continue
+            panorex_gt = np.zeros((self.Z, len(coords)), np.uint8)
+            # max over the 2x2 neighbourhood, cropped to the volume
+            valid = (x >= 0) & (x < self.W) & (y >= 0) & (y < self.H)
+            if valid.any():
+                gt = self.get_level(level, gt=True)
+                _, H, W = gt.shape
+                x1 = np.clip(np.floor(self.__level_coords(x[valid], level)), 0, W - 1).astype(np.intp)
+                y1 = np.clip(np.floor(self.__level_coords(y[valid], level)), 0, H - 1).astype(np.intp)
+                x2, y2 = np.minimum(x1 + 1, W - 1), np.minimum(y1 + 1, H - 1)
+                panorex_gt[:, valid] = self.__upsample_z(np.maximum(
+                    np.maximum(gt[:, y1, x1], gt[:, y1, x2]),
+                    np.maximum(gt[:, y2, x1], gt[:, y2, x2])
+                ), level, axis=0, nearest=True)
             panorex = processing.grey_to_rgb(panorex)
-            idx = np.argwhere(panorex_gt)
-            panorex[idx[:, 0], idx[:, 1]] = (1, 0, 0)
+            panorex[panorex_gt != 0] = (1, 0, 0)
 
         return panorex
 
     def convert_01_to_HU(self, data):
+        self._pending_volume and self.__load_pending_volume()  # max_value comes from the volume
         return data * self.max_value * self.HU_slope + self.HU_intercept
 
     def convert_HU_to_01(self, data):
+        self._pending_volume and self.__load_pending_volume()
         return (data - self.HU_intercept) / (self.HU_slope * self.max_value)
 
     ###################
     # GETTERS | SETTERS
     ###################
 
-    def get_slice(self, slice_num):
-        return self.volume[slice_num]
+    def get_slice(self, slice_num, level=0):
+        """
+        Args:
+            slice_num (int): index of the axial slice
+            level (int): preview slice interpolated from a level of the pyramid (see pyramid), still H x W
+
+        Returns:
+            (numpy array): H x W slice in [0, 1]
+        """
+        if not level:
+            return self.dequantize(self.volume[slice_num])
+        scale = VolumePyramid.scale(level)
+        image = self.get_level(level)[slice_num // scale]
+        image = processing.upsample_axis(processing.upsample_axis(image, self.H, 0, scale), self.W, 1, scale)
+        return self.dequantize(image)
 
     def get_gt_slice(self, slice_num):
         return self.dicom_files[slice_num].overlay_array(OVERLAY_ADDR)
 
-    def get_volume(self, normalized=True):
+    def get_label_volume(self):
+        """
+        rebuild the label volume saved by overwrite_annotations from its per-label overlay planes
+
+        Returns:
+            (numpy array): uint8 (Z, H, W) volume of labels, None if the series has no label planes
+        """
+        labels = None
+        # a voxel belongs to a single plane, the order only matters for corrupted files
+        for label in [l.UNLABELED, l.BG, l.INSIDE, l.CONTOUR]:
+            mask = overlays_from_datasets(self.dicom_files, LABEL_OVERLAY_ADDRS[label], (self.H, self.W))
+            if mask is None:
+                continue
+            if labels is None:
+                labels = np.full(mask.shape, l.UNLABELED, dtype=np.uint8)
+            labels[mask.astype(bool)] = label
+        return labels
+
+    def get_volume(self, normalized=True, level=0):
+        """
+        Args:
+            normalized (bool): volume in [0, 1], final_HU otherwise
+            level (int): level of the pyramid of the normalized volume (see pyramid), downsampled by 2 ** level
+
+        Returns:
+            (numpy array): the volume
+        """
         if normalized:
-            return self.volume
+            return self.dequantize(self.get_level(level))
         else:
             return self.final_HU
             # return np.array(self.volume * self.max_value, dtype=np.uint16)
 
-    def get_gt_volume(self, labels: list = None):
+    def get_gt_volume(self, labels: list = None, level=0):
+        gt_volume = self.get_level(level, gt=True)
         if not labels:
-            return self.gt_volume
-        if np.max(self.gt_volume) in [0, 1]:
-            return self.gt_volume
-        gt = np.zeros_like(self.gt_volume)
+            return gt_volume
+        if np.max(gt_volume) in [0, 1]:
+            return gt_volume
+        gt = np.zeros_like(gt_volume)
         for label in labels:
-            gt += get_mask_by_label(self.gt_volume, label)
+            gt += get_mask_by_label(gt_volume, label)
         return gt
 
     def get_HU_volume(self):
-        return self.HU_volume
+        return self.convert_01_to_HU(self.dequantize(np.asarray(self.volume)))
 
     def get_min_max_HU(self):
-        HU_volume = self.get_HU_volume()
-        return HU_volume.min(), HU_volume.max()
+        self._pending_volume and self.__load_pending_volume()
+        return self.min_HU, self.max_HU
 
     def set_volume(self, volume):
         self.volume = volume
@@ -400,10 +1054,10 @@ class Jaw:
         x1, x2 = int(np.floor(x_func)), int(np.floor(x_func) + 1)
         y1, y2 = int(np.floor(y_func)), int(np.floor(y_func) + 1)
         dx, dy = x_func - x1, y_func - y1
-        P1 = self.volume[:, y1, x1] * (1 - dx) * (1 - dy)
-        P2 = self.volume[:, y2, x1] * (1 - dx) * dy
-        P3 = self.volume[:, y1, x2] * dx * (1 - dy)
-        P4 = self.volume[:, y2, x2] * dx * dy
+        P1 = self.columns[:, y1, x1] * (1 - dx) * (1 - dy)
+        P2 = self.columns[:, y2, x1] * (1 - dx) * dy
+        P3 = self.columns[:, y1, x2] * dx * (1 - dy)
+        P4 = self.columns[:, y2, x2] * dx * dy
         return P1 + P2 + P3 + P4
 
     # WHY Z X Y INSTEAD OF SOME MORE HUMAN ORDER?
@@ -450,8 +1104,10 @@ class Jaw:
         Returns:
             (float) cubic interpolation according to https://www.paulinternet.nl/?page=bicubic
         """
-        if coord == 0:
+        if np.ndim(coord) == 0 and coord == 0:
             return p1  # if we already have an int coord we don't need to interpolate this stripe
+        if np.asarray(p1).dtype.kind == 'u':  # quantized volume, the differences must not wrap around
+            p0, p1, p2, p3 = (np.float32(p) for p in (p0, p1, p2, p3))
         return p1 + 0.5 * coord * (
                 p2 - p0 + coord * (2 * p0 - 5 * p1 + 4 * p2 - p3 + coord * (3. * (p1 - p2) + p3 - p0)))
 
@@ -474,10 +1130,10 @@ class Jaw:
         iy = []
         for y in [y0, y1, y2, y3]:
             i0 = self.cubic_interpolation(
-                self.volume[:, y, x0],
-                self.volume[:, y, x1],
-                self.volume[:, y, x2],
-                self.volume[:, y, x3],
+                self.columns[:, y, x0],
+                self.columns[:, y, x1],
+                self.columns[:, y, x2],
+                self.columns[:, y, x3],
                 x_func - int(x_func)
             )
             iy.append(i0)
@@ -525,38 +1181,66 @@ class Jaw:
     # PRIVATE UTILS
     ###############
 
-    def __remove_quantiles(self, min=MIN_QUANTILE, max=MAX_QUANTILE):
+    def __remove_quantiles(self, volume, min=MIN_QUANTILE, max=MAX_QUANTILE):
         """
-        remove peak values
+        find the thresholds for removing peak values.
+        8 and 16 bit volumes are counted in a single histogram pass (linear time, no sorted copy),
+        np.quantile is used for any other type
         Args:
+            volume (numpy array): raw volume
             min (float): min threshold
             max (float): max threshold
+
+        Returns:
+            (numpy array, scalar, scalar): the volume and the thresholds, in the dtype of the volume
         """
-        min = np.quantile(self.volume, min),
-        max = np.quantile(self.volume, max)
-        self.volume[self.volume > max] = max
-        self.volume[self.volume < min] = min
+        if volume.dtype.kind in 'ui' and volume.dtype.itemsize <= 2:
+            hist, offset = processing.integer_histogram(volume, slab_size=SLAB_SIZE)
+            quantiles = processing.histogram_quantiles(hist, offset, [min, max])
+        else:
+            quantiles = np.quantile(volume, [min, max])
+        min, max = quantiles.astype(volume.dtype)
+        return volume, min, max
 
-    def __normalize(self, type='simple'):
+    def __normalize(self, volume, min, max, type='simple'):
         """
-        perform normalizations on the volume
+        perform normalizations on the volume in a single pass, a few slices at a time
         Args:
+            volume (numpy array): raw volume
+            min (scalar): values below min are set to min
+            max (scalar): values above max are set to max
             type (String): type of normalizations, simple [0-1]
+
+        Returns:
+            (numpy array): float32 normalized volume, or the uint16 clipped volume if the jaw is quantized
         """
         if type == 'simple':
-            self.max_value = self.volume.max()
-            self.volume = self.volume.astype(np.float32) / self.volume.max()
+            # max is a quantile of the data, so it is also the max of the clipped volume
+            self.max_value = np.float32(max)
+            quantize = self._quantize and volume.dtype.kind in 'ui' and \
+                0 <= min and max <= np.iinfo(QUANTIZED_DTYPE).max
+            if self._quantize and not quantize:
+                print("WARNING: the values of the volume do not fit in {}, it is not quantized".format(
+                    np.dtype(QUANTIZED_DTYPE).name))
+            normalized = np.empty(volume.shape, dtype=QUANTIZED_DTYPE if quantize else np.float32)
+            for z in range(0, volume.shape[0], SLAB_SIZE):
+                slab = normalized[z:z + SLAB_SIZE]
+                np.clip(volume[z:z + SLAB_SIZE], min, max, out=slab, casting='unsafe')
+                quantize or np.divide(slab, self.max_value, out=slab)
+            # min and max of the normalized volume are known, so is its range in HU
+            self.min_HU, self.max_HU = sorted([
+                self.convert_01_to_HU(np.float32(min) / self.max_value),
+                self.convert_01_to_HU(np.float32(1))
+            ])
+            return normalized
 
     def __build_ann_volume(self):
         """
         read overlay data from the dicom files and extract them in a numpy array. if
         no annotations are found a 0-volume is created
         """
-        annotations = []
-        try:
-            for slice_num in range(self.Z):
-                annotations.append(self.get_gt_slice(slice_num))
-            return np.stack(annotations).astype(np.uint8)
-        except:
+        annotations = overlays_from_datasets(self.dicom_files, OVERLAY_ADDR, (self.H, self.W))
+        if annotations is None:
             print("INFO: NO ANNOTATION FOUND IN THIS VOLUME! BLACK MASK RETURNED")
-            return np.zeros_like(self.volume)
+            return np.zeros((self.Z, self.H, self.W), dtype=np.uint8)
+        return annotations
@@ -1,17 +1,76 @@
 import numpy as np
 
 
+PARAMS_SIZE = 12  # Z, W, clip, origin, row axis and column axis, see Plane.to_params
+
+
 class Plane:
 
     def __init__(self, plane_z, plane_w):
         """
-        create a new (empty) plane of coords, shape of the plane must be declared here
+        create a new (empty) plane of coords, shape of the plane must be declared here.
+        a plane whose points lie on a regular grid (a straight line moved along Z, then tilted) is stored as the
+        origin of the grid and its row and column axes, and its coordinates are generated when they are asked for
+        (see grid). other planes are stored as a dense 3 x Z x W array of coordinates
         Args:
             plane_z (Int): z shape of the plane (usually the Z len of the volume to cut)
             plane_w (Int): w shape of the plane (usually the len of the xy set of coordinates)
         """
         self.Z, self.W = plane_z, plane_w
-        self.plane = np.empty((3, self.Z, self.W))
+        self.origin = np.zeros(3)  # xyz of the point at row 0, column 0
+        self.axes = np.zeros((3, 2))  # xyz steps from a row to the next one and from a column to the next one
+        self.clip = False  # z coords from Z on are set to Z - 1, as after a tilt
+        self._plane = None  # dense coords of a plane that is not a regular grid
+        self._grid = None  # (origin, axes and clip it was computed for, dense coords) of a regular grid, see plane
+
+    @property
+    def is_parametric(self):
+        """
+        Returns:
+            (bool): the plane is stored as origin and axes
+        """
+        return self._plane is None
+
+    @property
+    def plane(self):
+        """
+        dense 3 x Z x W plane of coordinates, see grid. the coordinates of a regular grid are computed once and kept
+        (read only) until its origin, axes or clip change
+        """
+        if self._plane is not None:
+            return self._plane
+        key = (self.Z, self.W, self.clip, self.origin.tobytes(), self.axes.tobytes())
+        if self._grid is None or self._grid[0] != key:
+            grid = self.grid()
+            grid.setflags(write=False)
+            self._grid = (key, grid)
+        return self._grid[1]
+
+    @plane.setter
+    def plane(self, plane):
+        self.set_plane(plane)
+
+    def grid(self, dtype=np.float64, start=0, stop=None):
+        """
+        coordinates of a block of rows of the plane
+        Args:
+            dtype (numpy dtype): type of the coordinates, they are computed in float64
+            start (Int): first row
+            stop (Int): end of the rows, Z if None
+        Returns:
+            (numpy array): 3 x (stop - start) x W coordinates, [0] X, [1] Y, [2] Z
+        """
+        stop = self.Z if stop is None else min(stop, self.Z)
+        if self._plane is not None:
+            return self._plane[:, start:stop].astype(dtype)
+        rows = np.arange(start, stop, dtype=np.float64)
+        cols = np.arange(self.W, dtype=np.float64)
+        plane = self.origin[:, np.newaxis, np.newaxis] \
+            + self.axes[:, 0, np.newaxis, np.newaxis] * rows[:, np.newaxis] \
+            + self.axes[:, 1, np.newaxis, np.newaxis] * cols
+        if self.clip:
+            plane[2][plane[2] >= self.Z] = self.Z - 1  # threshold for overflows
+        return plane.astype(dtype, copy=False)
 
     def from_line(self, xy_set):
         """
@@ -22,13 +81,98 @@ class Plane:
         if len(xy_set.shape) > 2:
             raise Exception("coords_to_plane: feed this function with just one set of coords per time")
 
+        xy_set = np.asarray(xy_set, dtype=np.float64)
+        step = (xy_set[-1] - xy_set[0]) / max(len(xy_set) - 1, 1)
+        line = xy_set[0] + np.arange(len(xy_set))[:, np.newaxis] * step
+        self.clip = False
+        if np.allclose(line, xy_set, rtol=0, atol=1e-6):  # evenly spaced points of a straight line
+            self._plane = None
+            self.origin = np.array([xy_set[0, 0], xy_set[0, 1], 0.])
+            self.axes = np.array([[0., step[0]], [0., step[1]], [1., 0.]])
+            return
+
         x_set, y_set = xy_set[:, 0], xy_set[:, 1]
-        self.plane = np.stack((
+        self._plane = np.stack((
             np.tile(x_set, (self.Z, 1)),
             np.tile(y_set, (self.Z, 1)),
             np.moveaxis(np.tile(np.arange(0, self.Z, dtype=float), (x_set.size, 1)), 0, 1)
         ))
 
+    def to_params(self):
+        """
+        parameters of a parametric plane, see from_params
+        Returns:
+            (numpy array): PARAMS_SIZE float64 values: Z, W, clip, origin, row axis, column axis
+        """
+        if self._plane is not None:
+            raise ValueError("to_params: the plane is not a regular grid")
+        return np.concatenate([[self.Z, self.W, self.clip], self.origin, self.axes[:, 0], self.axes[:, 1]])
+
+    @staticmethod
+    def from_params(params):
+        """
+        Args:
+            params (numpy array): PARAMS_SIZE values, see to_params
+        Returns:
+            a new Plane object
+        """
+        plane = Plane(int(params[0]), int(params[1]))
+        plane.clip = bool(params[2])
+        plane.origin = np.array(params[3:6], dtype=np.float64)
+        plane.axes = np.stack([params[6:9], params[9:12]], axis=1).astype(np.float64)
+        return plane
+
+    def __row_z(self, row, col):
+        """z coord of the point at row, col"""
+        if self._plane is not None:
+            return self._plane[2, row, col]
+        z = self.origin[2] + row * self.axes[2, 0] + col * self.axes[2, 1]
+        return self.Z - 1 if self.clip and z >= self.Z else z
+
+    def __pivot_row(self, z_level):
+        """
+        row of the plane closest to z_level, where the rotation axis is placed (see tilt_x and tilt_z)
+        """
+        if not z_level:
+            return self.Z // 2  # if we have no clues then let's rotate with respect to the middle of the plane
+        if self._plane is None and self.axes[2, 1] == 0:
+            # z is the same along each row: the search runs over the Z rows instead of the whole grid
+            z = self.origin[2] + np.arange(self.Z) * self.axes[2, 0]
+            if self.clip:
+                z[z >= self.Z] = self.Z - 1
+            return int(np.abs(z - z_level).argmin())
+        return int(np.abs(self.plane[2] - z_level).argmin() // self.W)
+
+    def __point(self, row, col):
+        """xyz coords of the point at row, col"""
+        if self._plane is not None:
+            return self._plane[:, row, col].copy()
+        return np.array([self.origin[0] + row * self.axes[0, 0] + col * self.axes[0, 1],
+                         self.origin[1] + row * self.axes[1, 0] + col * self.axes[1, 1],
+                         self.__row_z(row, col)])
+
+    def __rotate(self, matrix, centre):
+        """
+        rotation of the plane around centre, followed by the threshold for overflows
+        Args:
+            matrix (numpy array): 3 x 3 rotation matrix
+            centre (numpy array): xyz of the centre of the rotation
+        """
+        if self._plane is None and self.clip:
+            corners = [self.__row_z(row, col) for row in (0, self.Z - 1) for col in (0, self.W - 1)]
+            unclipped = self.origin[2] + np.array([0, self.Z - 1])[:, np.newaxis] * self.axes[2, 0] \
+                + np.array([0, self.W - 1]) * self.axes[2, 1]
+            if not np.allclose(np.ravel(unclipped), corners):
+                self._plane = self.grid()  # the threshold has cut the grid, it is no longer regular
+        if self._plane is None:
+            self.origin = matrix @ (self.origin - centre) + centre
+            self.axes = matrix @ self.axes
+            self.clip = True
+            return
+        self._plane = np.einsum('ij,jzw->izw', matrix, self._plane - centre.reshape(3, 1, 1)) \
+            + centre.reshape(3, 1, 1)
+        self._plane[2][self._plane[2] >= self.Z] = self.Z - 1  # threshold for overflows
+
     def get_h_axis(self, z_level):
         """
         create a vector parallel to the Z axis of the plane to be used as reference in the rotation
@@ -39,21 +183,8 @@ class Plane:
         Returns:
         ux, uy, ux (Float): values for each component of the vector
         """
-
-        plane_centre = {
-                'z': z_level,
-                'w': self.W // 2
-            }
-
         # get the axis from the vectors of differences upon the centre of the plane (ux, uy, uz)
-        u = np.array([
-            self.plane[0, plane_centre['z'] + 1, plane_centre['w']] - self.plane[
-                0, plane_centre['z'], plane_centre['w']],
-            self.plane[1, plane_centre['z'] + 1, plane_centre['w']] - self.plane[
-                1, plane_centre['z'], plane_centre['w']],
-            self.plane[2, plane_centre['z'] + 1, plane_centre['w']] - self.plane[
-                2, plane_centre['z'], plane_centre['w']],
-        ])
+        u = self.__point(z_level + 1, self.W // 2) - self.__point(z_level, self.W // 2)
         ux, uy, uz = u / np.linalg.norm(u)  # normalization
         return ux, uy, uz
 
@@ -67,19 +198,8 @@ class Plane:
         Returns:
         ux, uy, ux (Float): values for each component of the vector
         """
-        plane_centre = {
-            'z': z_level,
-            'w': self.W // 2
-        }
         # get the axis from the vectors of differences upon the centre of the plane (ux, uy, uz)
-        u = np.array([
-            self.plane[0, plane_centre['z'], plane_centre['w'] + 1] - self.plane[
-                0, plane_centre['z'], plane_centre['w']],
-            self.plane[1, plane_centre['z'], plane_centre['w'] + 1] - self.plane[
-                1, plane_centre['z'], plane_centre['w']],
-            self.plane[2, plane_centre['z'], plane_centre['w'] + 1] - self.plane[
-                2, plane_centre['z'], plane_centre['w']],
-        ])
+        u = self.__point(z_level, self.W // 2 + 1) - self.__point(z_level, self.W // 2)
         ux, uy, uz = u / np.linalg.norm(u)  # normalization
         return ux, uy, uz
 
@@ -105,52 +225,12 @@ class Plane:
             return
 
         # Z index of the plane should be as close as possible to the avarage canal Z position
-        if not z_level:
-            z_level = self.Z // 2  # if we have no clues then let's rotate with respect to the middle of the plane
-        else:
-            z_level = np.abs(self.plane[2] - z_level).argmin() // self.W
-
-        # shifting to the origin
-        centres = self.plane[:, z_level, self.W // 2]
-        self.plane = np.subtract(self.plane, centres.reshape(3, 1, 1))  # broadcasting is real fancy
-
+        z_level = self.__pivot_row(z_level)
+        centres = self.__point(z_level, self.W // 2)
         ux, uy, uz = self.get_h_axis(z_level)
 
-        # align to Z
-        d = np.sqrt(uy ** 2 + uz ** 2)
-        if d != 0:
-            axis_align_matr = np.array([
-                [1, 0, 0],
-                [0, uz / d, -uy / d],
-                [0, uy / d, uz / d]
-            ])
-            self.plane = np.tensordot(self.plane, axis_align_matr, axes=(0, 1))
-            self.plane = np.moveaxis(self.plane, 2, 0)
-
-        # rotate
-        angle = np.radians(degrees)
-        rotation_matrix = np.array([
-            [np.cos(angle), -np.sin(angle), 0],
-            [np.sin(angle), np.cos(angle), 0],
-            [0, 0, 1]
-        ])
-        self.plane = np.tensordot(self.plane, rotation_matrix, axes=(0, 1))
-        self.plane = np.moveaxis(self.plane, 2, 0)
-
-        if d != 0:
-            axis_align_matr = np.array([
-                [1, 0, 0],
-                [0, uz / d, uy / d],
-                [0, -uy / d, uz / d]
-            ])
-            self.plane = np.tensordot(self.plane, axis_align_matr, axes=(0, 1))
-            self.plane = np.moveaxis(self.plane, 2, 0)
-
-        # shifting to the origin
-        self.plane = np.add(self.plane, centres.reshape(3, 1, 1))
-
-        # threshold for overflows
-        self.plane[2][self.plane[2] >= self.Z] = self.Z - 1
+        matrix = Plane.tilt_matrices(np.array([[ux, uy, uz]]), np.array([degrees]), axis='x')[0]
+        self.__rotate(matrix, centres)
 
     def tilt_z(self, degrees, z_level=None):
         """
@@ -174,68 +254,152 @@ class Plane:
             return
 
         # Z index of the plane should be as close as possible to the avarage canal Z position
-        if not z_level:
-            z_level = self.Z // 2  # if we have no clues then let's rotate with respect to the middle of the plane
-        else:
-            z_level = np.abs(self.plane[2] - z_level).argmin() // self.W
+        z_level = self.__pivot_row(z_level)
+        centres = self.__point(z_level, self.W // 2)
+        ux, uy, uz = self.get_w_axis(z_level)
 
-        # shifting to the origin
-        centres = self.plane[:, z_level, self.W // 2]
-        self.plane = np.subtract(self.plane, centres.reshape(3, 1, 1))
+        matrix = Plane.tilt_matrices(np.array([[ux, uy, uz]]), np.array([degrees]), axis='z')[0]
+        self.__rotate(matrix, centres)
 
-        ux, uy, uz = self.get_w_axis(z_level)
+    @staticmethod
+    def tilt_matrices(u, degrees, axis='z'):
+        """
+        rotation matrices of tilt_x (axis='x') and tilt_z (axis='z') for a stack of planes: the alignment of the
+        rotation axis, the rotation and the reverse of the alignment are composed in a single 3 x 3 matrix
+        Args:
+            u (numpy array): N x 3 normalized rotation axes, see get_h_axis (tilt_x) and get_w_axis (tilt_z)
+            degrees (numpy array): N angles to rotate about in degrees
+            axis (str): 'x' to tilt around the Z axis of the planes, 'z' to tilt around their W axis
+        Returns:
+            (numpy array): N x 3 x 3 matrices, applied to column vectors of xyz coordinates
+        """
+        ux, uy, uz = np.asarray(u, dtype=np.float64).T
+        n = len(ux)
+        angle = np.radians(np.asarray(degrees, dtype=np.float64))
+        cos, sin = np.cos(angle), np.sin(angle)
+        align = np.tile(np.eye(3), (n, 1, 1))
+        rotation = np.tile(np.eye(3), (n, 1, 1))
+        if axis == 'x':
+            # align to Z, rotate around it
+            d = np.sqrt(uy ** 2 + uz ** 2)
+            a, b = np.divide(uz, d, out=np.ones(n), where=d != 0), np.divide(uy, d, out=np.zeros(n), where=d != 0)
+            align[:, 1, 1], align[:, 1, 2], align[:, 2, 1], align[:, 2, 2] = a, -b, b, a
+            rotation[:, 0, 0], rotation[:, 0, 1], rotation[:, 1, 0], rotation[:, 1, 1] = cos, -sin, sin, cos
+        elif axis == 'z':
+            # align to Y axis, rotate on y to tilt
+            d = np.sqrt(uy ** 2 + ux ** 2)
+            a, b = np.divide(uy, d, out=np.ones(n), where=d != 0), np.divide(ux, d, out=np.zeros(n), where=d != 0)
+            align[:, 0, 0], align[:, 0, 1], align[:, 1, 0], align[:, 1, 1] = a, -b, b, a
+            rotation[:, 0, 0], rotation[:, 0, 2], rotation[:, 2, 0], rotation[:, 2, 2] = cos, sin, -sin, cos
+        else:
+            raise ValueError("tilt_matrices: unknown axis {}".format(axis))
+        # the reverse of the alignment is its transpose
+        return np.einsum('nji,njk,nkl->nil', align, rotation, align)
+
+    @staticmethod
+    def from_lines(plane_z, xy_sets):
+        """
+        planes of a stack of lines at once, see from_line
+        Args:
+            plane_z (Int): z shape of the planes
+            xy_sets (numpy array): N x W sets of xy values
+        Returns:
+            (list of Plane objects): one plane for each line
+        """
+        xy_sets = np.asarray(xy_sets, dtype=np.float64)
+        n, w = xy_sets.shape[:2]
+        steps = (xy_sets[:, -1] - xy_sets[:, 0]) / max(w - 1, 1)
+        lines = xy_sets[:, :1] + np.arange(w)[:, np.newaxis] * steps[:, np.newaxis]
+        straight = np.isclose(lines, xy_sets, rtol=0, atol=1e-6).all(axis=(1, 2))
+        planes = []
+        for i in range(n):
+            plane = Plane(plane_z, w)
+            if straight[i]:
+                plane.origin = np.array([xy_sets[i, 0, 0], xy_sets[i, 0, 1], 0.])
+                plane.axes = np.array([[0., steps[i, 0]], [0., steps[i, 1]], [1., 0.]])
+            else:
+                plane.from_line(xy_sets[i])
+            planes.append(plane)
+        return planes
 
-        # align to Y axis
-        d = np.sqrt(uy ** 2 + ux ** 2)
-        if d != 0:
-            axis_align_matr = np.array([
-                [uy / d, -ux / d, 0],
-                [ux / d, uy / d, 0],
-                [0, 0, 1]
-            ])
-            self.plane = np.tensordot(self.plane, axis_align_matr, axes=(0, 1))
-            self.plane = np.moveaxis(self.plane, 2, 0)
-
-        # rotate on y to tilt
-        angle = np.radians(degrees)
-        rotation_matrix = np.array([
-            [np.cos(angle), 0, np.sin(angle)],
-            [0, 1, 0],
-            [-np.sin(angle), 0, np.cos(angle)],
-
-        ])
-        self.plane = np.tensordot(self.plane, rotation_matrix, axes=(0, 1))
-        self.plane = np.moveaxis(self.plane, 2, 0)
-
-        # go back from the y alignment
-        if d != 0:
-            axis_align_matr = np.array([
-                [uy / d, ux / d, 0],
-                [-ux / d, uy / d, 0],
-                [0, 0, 1]
-            ])
-            self.plane = np.tensordot(self.plane, axis_align_matr, axes=(0, 1))
-            self.plane = np.moveaxis(self.plane, 2, 0)
-
-        # shifting to the origin
-        self.plane = np.add(self.plane, centres.reshape(3, 1, 1))
-
-        self.plane[2][self.plane[2] >= self.Z] = self.Z - 1  # threshold for overflows
+    @staticmethod
+    def tilt_planes(planes, degrees, z_levels=None, axis='z'):
+        """
+        tilt_z (axis='z') or tilt_x (axis='x') of a stack of planes. for the planes made from a line (see from_line
+        and from_lines) the pivot row is found from the z of their rows instead of searching the grid, and all the
+        rotations are applied to their origins and axes with a single einsum. the other planes are tilted one by one
+        Args:
+            planes (list of Plane objects): planes to tilt, in place
+            degrees (numpy array): angle to rotate each plane about in degrees
+            z_levels (numpy array): level of the z axis of the rotation axis of each plane, see tilt_z.
+                the middle of the planes if None
+        """
+        n = len(planes)
+        degrees = np.broadcast_to(np.asarray(degrees, dtype=np.float64), (n,))
+        z_levels = np.zeros(n) if z_levels is None else np.broadcast_to(np.asarray(z_levels, dtype=np.float64), (n,))
+        batch = []
+        for i, plane in enumerate(planes):
+            if degrees[i] == 0:
+                continue
+            # rows of constant z, increasing from a row to the next one and never over the threshold
+            if plane.is_parametric and not plane.clip and plane.axes[2, 1] == 0 and plane.axes[2, 0] > 0:
+                batch.append(i)
+            elif axis == 'x':
+                plane.tilt_x(degrees[i], z_levels[i])
+            else:
+                plane.tilt_z(degrees[i], z_levels[i])
+        if not batch:
+            return
+        Z = np.array([planes[i].Z for i in batch])
+        W = np.array([planes[i].W for i in batch])
+        origins = np.stack([planes[i].origin for i in batch])
+        axes = np.stack([planes[i].axes for i in batch])
+        levels = z_levels[batch]
+
+        # pivot row: the closest to z_level (the first one on ties), the middle of the plane if there is no z_level
+        rows = np.ceil((levels - origins[:, 2]) / axes[:, 2, 0] - 0.5)
+        rows = np.where(levels != 0, np.clip(rows, 0, Z - 1), Z // 2)
+        centres = origins + axes[:, :, 0] * rows[:, np.newaxis] + axes[:, :, 1] * (W // 2)[:, np.newaxis]
+        u = axes[:, :, 0] if axis == 'x' else axes[:, :, 1]
+        u = u / np.linalg.norm(u, axis=1, keepdims=True)
+        matrices = Plane.tilt_matrices(u, degrees[batch], axis)
+
+        # origins (as offsets from the centres) and axes of all the planes rotated at once
+        stack = np.concatenate([(origins - centres)[:, :, np.newaxis], axes], axis=2)
+        stack = np.einsum('nij,njk->nik', matrices, stack)
+        for k, i in enumerate(batch):
+            planes[i].origin = stack[k, :, 0] + centres[k]
+            planes[i].axes = stack[k, :, 1:]
+            planes[i].clip = True
 
     def get_plane(self):
         """
         order of coordinates in the plane are [0] X, [1] Y, [2] Z
-        Returns (numpy array): plane of coordinates
+        Returns (numpy array): plane of coordinates, see plane
         """
-        return self.plane.copy()
+        return self.plane
 
     def set_plane(self, plane):
         """
-        load the data from an existing plane
+        load the data from an existing plane, stored as origin and axes if it is a regular grid
         Args:
             plane numpy array: plane of coordinates
         """
-        self.plane = plane
+        plane = np.asarray(plane, dtype=np.float64)
+        self.Z, self.W = plane.shape[1:]
+        self._plane = None
+        self.origin = plane[:, 0, 0].copy()
+        self.axes = np.stack([plane[:, min(1, self.Z - 1), 0] - self.origin,
+                              plane[:, 0, min(1, self.W - 1)] - self.origin], axis=1)
+        self.clip = False
+        unclipped = self.grid()
+        clipped = unclipped.copy()
+        clipped[2][clipped[2] >= self.Z] = self.Z - 1  # as grid with clip
+        for clip, grid in ((False, unclipped), (True, clipped)):
+            if np.allclose(grid, plane, rtol=0, atol=1e-6):
+                self.clip = clip
+                return
+        self._plane = plane
 
     @staticmethod
     def empty_like(plane):
@@ -0,0 +1,285 @@
+import numpy as np
+from scipy import sparse
+
+import accelerated
+import interpolation
+import parallel
+from ColumnStore import ColumnStore
+
+BLOCK_POINTS = 4096  # points resampled together, the gathered samples of a block take a few MB
+
+
+class ResamplingOperator:
+
+    def __init__(self, shape, coords, columns, block_points=BLOCK_POINTS):
+        """
+        geometry of a set of cuts of a (Z, H, W) volume, built once and applied to any volume with that shape.
+
+        the interpolation of the cuts is stored as a scipy.sparse matrix (one row per point of the cuts, one column
+        per voxel or z column it reads), so the forward cut of a volume is a sparse matrix product.
+        the inverse operation (splat) writes the values of the cuts back into a volume at the floor/ceil
+        neighbours of each point: labels are not averaged, every voxel takes the value of the last point
+        that touches it, as the point by point loops of ArchHandler._compute_gt_volume.
+        matrices and splat indices are built the first time they are needed.
+
+        Args:
+            shape (tuple of int): (Z, H, W) shape of the volumes
+            coords (numpy array): N x L x 2 xy coordinates of the points of N cuts (columns=True),
+                or N x 3 x h x w xyz coordinates of N planes (columns=False)
+            columns (bool): each point samples a whole z column (side_coords) or a single voxel (planes)
+            block_points (int): points resampled together
+        """
+        self.shape = tuple(shape)
+        self.columns = columns
+        coords = np.asarray(coords, dtype=np.float64)
+        if columns:
+            self.points_shape = coords.shape[:2]
+            self.coords = coords.reshape(-1, 2).T  # x, y
+        else:
+            self.points_shape = (coords.shape[0],) + coords.shape[2:]
+            self.coords = np.moveaxis(coords, 1, 0).reshape(3, -1)  # x, y, z
+        self.points_per_cut = int(np.prod(self.points_shape[1:], dtype=np.int64))
+        self.cuts_per_block = max(1, block_points // max(1, self.points_per_cut))
+        self.__matrices = {}
+        self.__splat = None
+
+    @classmethod
+    def from_side_coords(cls, shape, xy_set, block_points=BLOCK_POINTS):
+        """
+        Args:
+            shape (tuple of int): (Z, H, W) shape of the volumes
+            xy_set (2D or 3D numpy array): one or more sets of xy coordinates, see Jaw.line_slice
+
+        Returns:
+            (ResamplingOperator): operator cutting Z x L images along the sets of coordinates
+        """
+        xy_set = np.asarray(xy_set, dtype=np.float64)
+        if len(xy_set.shape) == 2:
+            xy_set = xy_set[np.newaxis]
+        return cls(shape, xy_set, columns=True, block_points=block_points)
+
+    @classmethod
+    def from_planes(cls, shape, planes, block_points=BLOCK_POINTS):
+        """
+        Args:
+            shape (tuple of int): (Z, H, W) shape of the volumes
+            planes (4D numpy array or list of Plane objects): N planes of shape 3 x h x w, see Jaw.plane_slice
+
+        Returns:
+            (ResamplingOperator): operator cutting h x w images along the planes
+        """
+        planes = np.asarray([p if isinstance(p, np.ndarray) else p.get_plane() for p in planes], dtype=np.float64)
+        return cls(shape, planes, columns=False, block_points=block_points)
+
+    @property
+    def n_cuts(self):
+        return self.points_shape[0]
+
+    @property
+    def n_points(self):
+        return self.n_cuts * self.points_per_cut
+
+    @property
+    def out_shape(self):
+        """shape of the cuts: N x Z x L for side coords, N x h x w for planes"""
+        if self.columns:
+            return (self.n_cuts, self.shape[0], self.points_shape[1])
+        return self.points_shape
+
+    def __flat(self, z, y, x):
+        Z, H, W = self.shape
+        if self.columns:
+            return y * W + x
+        return (z * H + y) * W + x
+
+    def __taps(self, kernel, start, stop):
+        """
+        flat indices and weights read by the points [start, stop).
+        columns: the border rule of Jaw.line_slice, planes: the clamping of Jaw.plane_slice.
+
+        Returns:
+            (numpy array, numpy array): n x taps indices and weights, the weights of the points left to zero are 0
+        """
+        Z, H, W = self.shape
+        if self.columns:
+            x, y = self.coords[:, start:stop]
+            # points too close to the borders are left to zero
+            valid = ~((x - 2 < 0) | (y - 2 < 0) | (x + 2 >= W) | (y + 2 >= H))
+            x, y = np.where(valid, x, 2), np.where(valid, y, 2)
+            taps = [(self.__flat(None, yi, xi), wx * wy)
+                    for xi, wx in interpolation.tap_indices(kernel, x, W, np.float32)
+                    for yi, wy in interpolation.tap_indices(kernel, y, H, np.float32)]
+        else:
+            x, y, z = self.coords[:, start:stop]
+            outside = (z < 0) | (x < 0) | (y < 0)
+            valid = ~outside
+            x, y, z = np.where(outside, 0, x), np.where(outside, 0, y), np.where(outside, 0, z)
+            if kernel.taps > 1:
+                # avoid possible overflows, as Jaw.trilinear_interpolation
+                x = np.where(x + 1 >= W, W - 2, x)
+                z = np.where(z + 1 >= Z, Z - 2, z)
+                y = np.where(y + 1 >= H, H - 2, y)
+            taps = [(self.__flat(zi, yi, xi), wz * wy * wx)
+                    for zi, wz in interpolation.tap_indices(kernel, z, Z)
+                    for yi, wy in interpolation.tap_indices(kernel, y, H)
+                    for xi, wx in interpolation.tap_indices(kernel, x, W)]
+        indices = np.stack([index for index, _ in taps], axis=1)
+        weights = np.stack([weight for _, weight in taps], axis=1)
+        return indices, weights * valid[:, np.newaxis]
+
+    def matrix_block(self, kernel, c0):
+        """
+        interpolation matrix of the block of cuts starting at c0, built the first time it is asked for.
+        blocks are independent, so different threads can build and apply them at the same time
+
+        Args:
+            kernel (str or interpolation.Kernel): interpolation kernel, see interpolation.KERNELS
+            c0 (int): first cut of the block, a multiple of cuts_per_block
+
+        Returns:
+            (int, numpy array, scipy.sparse.csr_matrix): end of the range of cuts of the block, the flat indices
+                of the voxels (or z columns) it reads and the interpolation matrix over them
+        """
+        kernel = interpolation.get_kernel(kernel)
+        blocks = self.__matrices.setdefault(kernel.name, {})
+        block = blocks.get(c0)
+        if block is None:
+            c1 = min(c0 + self.cuts_per_block, self.n_cuts)
+            indices, weights = self.__taps(kernel, c0 * self.points_per_cut, c1 * self.points_per_cut)
+            keep = weights != 0
+            support, local = np.unique(indices[keep], return_inverse=True)
+            indptr = np.concatenate([[0], np.cumsum(keep.sum(axis=1))])
+            matrix = sparse.csr_matrix((weights[keep], local.ravel(), indptr), shape=(len(indices), len(support)))
+            block = blocks[c0] = (c1, support, matrix)
+        return block
+
+    def matrix_blocks(self, kernel='linear'):
+        """
+        Args:
+            kernel (str or interpolation.Kernel): interpolation kernel, see interpolation.KERNELS
+
+        Returns:
+            (list of (int, int, numpy array, scipy.sparse.csr_matrix)): for each block of cuts, the range of cuts,
+                the flat indices of the voxels (or z columns) it reads and the interpolation matrix over them
+        """
+        return [(c0,) + self.matrix_block(kernel, c0) for c0 in range(0, self.n_cuts, self.cuts_per_block)]
+
+    def __gather(self, volume, support):
+        """values of the z columns (n x Z) or of the voxels (n) of a block"""
+        Z, H, W = self.shape
+        if self.columns:
+            ys, xs = np.divmod(support, W)
+            if isinstance(volume, ColumnStore):
+                return volume.gather(ys, xs)
+            return np.ascontiguousarray(volume[:, ys, xs].T)
+        zs, rest = np.divmod(support, H * W)
+        ys, xs = np.divmod(rest, W)
+        return volume[zs, ys, xs]
+
+    def cut(self, volume, kernel='linear', out=None, step_fn=None, workers=None):
+        """
+        forward resampling: the cuts of a volume along the geometry of the operator.
+        the blocks of cuts are built and applied on a thread pool, see parallel.run_chunks
+
+        Args:
+            volume (numpy array, memmap, ChunkedVolume or ColumnStore): Z x H x W volume
+            kernel (str or interpolation.Kernel): interpolation kernel, volume must hold the coefficients
+                of the kernels with a prefilter (see Jaw.kernel_volume)
+            out (numpy array): where to store the cuts, out_shape float32 by default
+            step_fn (function): called with (done, total) cuts to report the progress
+            workers (int): size of the thread pool, see parallel.run_chunks
+
+        Returns:
+            (numpy array): the cuts, out_shape
+        """
+        if tuple(volume.shape) != self.shape:
+            raise ValueError("volume of shape {} does not match the operator {}".format(volume.shape, self.shape))
+        if out is None:
+            out = np.zeros(self.out_shape, np.float32)
+        kernel = interpolation.get_kernel(kernel)
+
+        def cut_block(c0, _):
+            c1, support, matrix = self.matrix_block(kernel, c0)
+            samples = self.__gather(volume, support)
+            if self.columns:
+                values = matrix @ samples  # points x Z
+                out[c0:c1] = values.reshape(c1 - c0, -1, self.shape[0]).transpose(0, 2, 1)
+            else:
+                out[c0:c1] = (matrix @ samples).reshape((c1 - c0,) + self.points_shape[1:])
+
+        parallel.run_chunks(cut_block, self.n_cuts, self.cuts_per_block, workers=workers, step_fn=step_fn)
+        return out
+
+    def __splat_indices(self):
+        """
+        voxels written by the points, as the loops of ArchHandler._compute_gt_volume: the floor/ceil neighbours
+        of the point clipped into the volume (the whole z columns for side coords, where only the points whose
+        truncated position is inside the volume are written back).
+
+        Returns:
+            (numpy array, numpy array, numpy array): flat voxels (or z columns) and points writing them,
+                grouped by block of cuts (see cuts_per_block) and sorted by voxel and then by point in each
+                block, and the bounds of the blocks in them
+        """
+        if self.__splat is None:
+            Z, H, W = self.shape
+            sizes = (W, H) if self.columns else (W, H, Z)
+            points = np.arange(self.n_points)
+            keep = np.ones(self.n_points, bool)
+            if self.columns:
+                x, y = self.coords
+                keep = (0 <= np.trunc(x)) & (np.trunc(x) < W) & (0 <= np.trunc(y)) & (np.trunc(y) < H)
+            corners = []  # for each axis: floor and ceil, the ceil only where it is a different voxel
+            for c, size in zip(self.coords, sizes):
+                c = np.clip(c[keep], 0, size - 1)
+                lo, hi = np.floor(c).astype(np.intp), np.ceil(c).astype(np.intp)
+                corners.append([(lo, np.ones(len(c), bool)), (hi, hi != lo)])
+            targets, sources = [], []
+            for zc in (corners[2] if not self.columns else [(None, True)]):
+                for yc in corners[1]:
+                    for xc in corners[0]:
+                        mask = xc[1] & yc[1] & zc[1]
+                        targets.append(self.__flat(zc[0], yc[0], xc[0])[mask])
+                        sources.append(points[keep][mask])
+            targets, sources = np.concatenate(targets), np.concatenate(sources)
+            blocks = sources // (self.points_per_cut * self.cuts_per_block)
+            order = np.lexsort((sources, targets, blocks))
+            n_blocks = -(-self.n_cuts // self.cuts_per_block)
+            bounds = np.searchsorted(blocks[order], np.arange(n_blocks + 1))
+            self.__splat = targets[order], sources[order], bounds
+        return self.__splat
+
+    def splat(self, values, fill, active=None, step_fn=None):
+        """
+        inverse resampling: values of the cuts written back into a volume. labels are never mixed, a voxel
+        takes the value of the last point (in the order of the cuts) that touches it.
+        the blocks of cuts are written one after the other (see parallel.run_chunks), so that the later ones
+        overwrite the earlier ones. the scatter runs on the compiled kernel when numba is available,
+        see accelerated.splat
+
+        Args:
+            values (numpy array): out_shape values of the cuts
+            fill: value of the voxels that are not touched by any point
+            active (numpy array of bool): cuts to write back, all of them if None
+            step_fn (function): called with (done, total) cuts to report the progress
+
+        Returns:
+            (numpy array): Z x H x W volume
+        """
+        values = np.asarray(values)
+        if values.shape != self.out_shape:
+            raise ValueError("values of shape {} do not match the cuts {}".format(values.shape, self.out_shape))
+        out = np.full(self.shape, fill, values.dtype)
+        targets, sources, bounds = self.__splat_indices()
+        active = np.ones(self.n_cuts, bool) if active is None else np.asarray(active, bool)
+        if self.columns:
+            out, points = out.reshape(self.shape[0], -1), values.transpose(0, 2, 1).reshape(self.n_points, -1)
+        else:
+            out, points = out.reshape(-1), values.reshape(-1)
+
+        def splat_block(c0, _):
+            b0, b1 = bounds[c0 // self.cuts_per_block], bounds[c0 // self.cuts_per_block + 1]
+            accelerated.splat(out, targets[b0:b1], sources[b0:b1], points, active, self.points_per_cut)
+
+        parallel.run_chunks(splat_block, self.n_cuts, self.cuts_per_block, workers=1, step_fn=step_fn)
+        return out.reshape(self.shape)
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+class VolumeCache:
+    CACHE_DIRNAME = 'volume_cache'
+    META_FILENAME = 'meta.json'
+    VERSION = 2
+
+    def __init__(self, dicomdir_path, dataset_path, filenames):
+        """
+        persistent cache of the volumes computed by Jaw, stored as .npy files next to the DICOMDIR.
+        the cache is keyed by the DICOMDIR path plus the mtime and size of every file of the series,
+        so any change to the DICOM files invalidates it.
+
+        Args:
+            dicomdir_path (str): path of the DICOMDIR file
+            dataset_path (str): directory containing the files of the series
+            filenames (list of str): filenames of the series
+        """
+        self.dir = os.path.join(os.path.dirname(os.path.abspath(dicomdir_path)), self.CACHE_DIRNAME)
+        self.key = self.__compute_key(dicomdir_path, [os.path.join(dataset_path, f) for f in filenames])
+
+    def __compute_key(self, dicomdir_path, paths):
+        """
+        hash of the DICOMDIR path and of the mtime and size of each file
+
+        Returns:
+            (str): hex digest
+        """
+        h = hashlib.sha1()
+        h.update(str(self.VERSION).encode())
+        for path in [os.path.abspath(dicomdir_path)] + paths:
+            st = os.stat(path)
+            h.update("{}|{}|{}\n".format(path, st.st_mtime_ns, st.st_size).encode())
+        return h.hexdigest()
+
+    def path(self, name):
+        """
+        Args:
+            name (str): name of a cached array
+
+        Returns:
+            (str): path of the .npy file of the array
+        """
+        return os.path.join(self.dir, name + '.npy')
+
+    def chunks_dir(self, name):
+        """
+        Args:
+            name (str): name of a chunked array
+
+        Returns:
+            (str): directory of the chunks of the array, see ChunkedVolume
+        """
+        return os.path.join(self.dir, name + '_chunks')
+
+    def read_meta(self):
+        """
+        Returns:
+            (dict): metadata stored with the arrays, None if the cache is missing or outdated
+        """
+        try:
+            with open(os.path.join(self.dir, self.META_FILENAME), "r") as infile:
+                meta = json.load(infile)
+        except (OSError, ValueError):
+            return None
+        if meta.get('key') != self.key:
+            return None
+        if not all(os.path.isfile(self.path(name)) for name in meta.get('arrays', [])):
+            return None
+        return meta
+
+    def is_valid(self):
+        return self.read_meta() is not None
+
+    def load(self, name, mmap_mode='r'):
+        """
+        map a cached array, pages are read from disk only when touched
+
+        Args:
+            name (str): name of the array
+            mmap_mode (str): see numpy.load, 'c' gives a writable copy-on-write map
+
+        Returns:
+            (numpy.memmap): the array
+        """
+        return np.load(self.path(name), mmap_mode=mmap_mode)
+
+    def create(self, name, shape, dtype):
+        """
+        allocate a cached array directly on disk, so that it can be filled a few slices at a time
+        and passed to save() without ever being fully resident
+
+        Args:
+            name (str): name of the array
+            shape (tuple of int): shape of the array
+            dtype (numpy.dtype): type of the array
+
+        Returns:
+            (numpy.memmap): the writable array
+        """
+        os.makedirs(self.dir, exist_ok=True)
+        self.__invalidate()
+        return np.lib.format.open_memmap(self.path(name), mode='w+', dtype=dtype, shape=shape)
+
+    def __invalidate(self):
+        meta_path = os.path.join(self.dir, self.META_FILENAME)
+        if os.path.isfile(meta_path):
+            os.remove(meta_path)
+
+    def save(self, arrays, **meta):
+        """
+        store a set of arrays and their metadata. the metadata file is written last so that a cache
+        interrupted while writing is never considered valid.
+
+        Args:
+            arrays (dict): name -> numpy array
+            meta: json serializable values to store with the arrays
+
+        Returns:
+            (bool): True if the cache has been written
+        """
+        try:
+            os.makedirs(self.dir, exist_ok=True)
+            self.__invalidate()
+            for name, array in arrays.items():
+                if isinstance(array, np.memmap) and os.path.abspath(array.filename) == os.path.abspath(self.path(name)):
+                    array.flush()  # allocated with create(), already in place
+                    continue
+                tmp_path = self.path(name) + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, array)
+                os.replace(tmp_path, self.path(name))
+            meta = dict(meta, key=self.key, arrays=list(arrays.keys()))
+            meta_path = os.path.join(self.dir, self.META_FILENAME)
+            with open(meta_path + '.tmp', "w") as outfile:
+                json.dump(meta, outfile)
+            os.replace(meta_path + '.tmp', meta_path)
+        except OSError as e:
+            print("WARNING: could not write the volume cache in {}: {}".format(self.dir, e))
+            return False
+        return True
+
+    def __derived_meta_path(self, name):
+        return os.path.join(self.dir, name + '.json')
+
+    def load_derived(self, name, key=''):
+        """
+        map an array derived from the cached volumes, see save_derived
+
+        Args:
+            name (str): name of the array
+            key (str): identifier of the content of the array, as passed to save_derived
+
+        Returns:
+            (numpy.memmap): the array, None if it is missing or it was derived from other volumes
+        """
+        try:
+            with open(self.__derived_meta_path(name), "r") as infile:
+                meta = json.load(infile)
+            if meta.get('key') != self.key + key:
+                return None
+            return self.load(name)
+        except (OSError, ValueError):
+            return None
+
+    def save_derived(self, name, array, key=''):
+        """
+        store an array derived from the cached volumes (e.g. the levels of a VolumePyramid). it has its own
+        metadata file, so it can be added to the cache at any time without invalidating the other arrays,
+        and it is valid as long as the cache key and key do not change
+
+        Args:
+            name (str): name of the array
+            array (numpy array): the array
+            key (str): identifier of the content of the array, if it does not only depend on the DICOM files
+
+        Returns:
+            (bool): True if the array has been written
+        """
+        meta_path = self.__derived_meta_path(name)
+        try:
+            os.makedirs(self.dir, exist_ok=True)
+            if os.path.isfile(meta_path):
+                os.remove(meta_path)
+            tmp_path = self.path(name) + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path, self.path(name))
+            with open(meta_path + '.tmp', "w") as outfile:
+                json.dump({'key': self.key + key}, outfile)
+            os.replace(meta_path + '.tmp', meta_path)
+        except OSError as e:
+            print("WARNING: could not write {} in the volume cache {}: {}".format(name, self.dir, e))
+            return False
+        return True
@@ -0,0 +1,73 @@
+import threading
+
+LEVELS = 2  # downsampled levels: 2x and 4x
+
+
+class VolumePyramid:
+
+    def __init__(self, base, downsample_fn, levels=LEVELS, cache=None, name=None, key=''):
+        """
+        multi-resolution pyramid of a (Z, H, W) volume for the previews: level 0 is the volume itself, level k
+        is downsampled by 2 ** k along each axis. each level is computed from the previous one the first time
+        it is asked for, and stored in the volume cache (if any) so that it is computed once per series.
+
+        Args:
+            base (numpy array, memmap or ChunkedVolume): the full resolution volume
+            downsample_fn (function): volume -> volume downsampled by 2 along each axis,
+                see processing.downsample_mean and processing.downsample_labels
+            levels (int): number of downsampled levels
+            cache (VolumeCache): where the levels are stored, None to keep them only in memory
+            name (str): name of the levels in the cache, level k is stored as name_k
+            key (str): identifier of the content of base, if it does not only depend on the DICOM files
+        """
+        self.base = base
+        self.downsample_fn = downsample_fn
+        self.cache = cache
+        self.name = name
+        self.key = key
+        self.__levels = [base] + [None] * levels
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__levels)
+
+    @staticmethod
+    def scale(level):
+        """
+        Returns:
+            (int): downsampling factor of a level
+        """
+        return 2 ** level
+
+    def shape(self, level):
+        """
+        Returns:
+            (tuple of int): shape of a level, without computing it
+        """
+        return tuple(-(-n // self.scale(level)) for n in self.base.shape)
+
+    def level(self, level):
+        """
+        Args:
+            level (int): 0 for the full resolution volume, up to len(self) - 1
+
+        Returns:
+            (numpy array or memmap): the volume at the level
+        """
+        if not 0 <= level < len(self):
+            raise ValueError("pyramid level {} out of range [0, {})".format(level, len(self)))
+        with self.__lock:
+            return self.__level(level)
+
+    def __level(self, level):
+        if self.__levels[level] is None:
+            name = "{}_{}".format(self.name, level)
+            volume = None
+            if self.cache is not None:
+                volume = self.cache.load_derived(name, self.key)
+            if volume is None:
+                volume = self.downsample_fn(self.__level(level - 1))
+                if self.cache is not None and self.cache.save_derived(name, volume, self.key):
+                    volume = self.cache.load(name)  # mapped, its pages can be dropped under memory pressure
+            self.__levels[level] = volume
+        return self.__levels[level]
@@ -0,0 +1,384 @@
+"""
+optional compiled kernels for the loops that are hard to vectorize without large temporaries: the trilinear
+interpolation of the tilted planes (Jaw.plane_slice), the last-writer splatting of the ground truth
+(ResamplingOperator.splat, used by ArchHandler._compute_gt_volume) and the triangle-cube test of voxelize.
+
+the backend is selected at import time: the kernels are compiled with numba when it is installed, the NumPy
+paths are used otherwise. the kernels are written as plain python loops, so without numba they still run
+(slowly) and can be compared with the NumPy paths, see tests/accelerated_equivalence.py.
+every call is timed, see kernel_timings.
+"""
+import math
+import threading
+import time
+
+import numpy as np
+
+import interpolation
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+BACKEND = 'numpy' if numba is None else 'numba'
+BACKENDS = ('numpy', 'numba')  # 'numba' without numba runs the python loops of the kernels
+
+# (kernel, backend) -> [calls, items, seconds]
+TIMINGS = {}
+_timings_lock = threading.Lock()  # kernels are called from the resampling thread pool
+
+
+def record(kernel, backend, items, seconds):
+    """
+    Args:
+        kernel (str): name of the kernel
+        backend (str): implementation that ran
+        items (int): points (or voxels) processed
+        seconds (float): time spent
+    """
+    with _timings_lock:
+        entry = TIMINGS.setdefault((kernel, backend), [0, 0, 0.])
+        entry[0] += 1
+        entry[1] += items
+        entry[2] += seconds
+
+
+def kernel_timings():
+    """
+    Returns:
+        (dict): (kernel, backend) -> {'calls', 'items', 'seconds', 'items_per_second'} since the last reset
+    """
+    with _timings_lock:
+        return {key: {'calls': calls, 'items': items, 'seconds': seconds,
+                      'items_per_second': items / seconds if seconds > 0 else float('nan')}
+                for key, (calls, items, seconds) in TIMINGS.items()}
+
+
+def reset_timings():
+    with _timings_lock:
+        TIMINGS.clear()
+
+
+def _backend(backend):
+    backend = backend or BACKEND
+    if backend not in BACKENDS:
+        raise ValueError("unknown backend {}, expected one of {}".format(backend, BACKENDS))
+    return backend
+
+
+def _jit(fn):
+    """compiled version of a kernel if numba is available, the python function otherwise"""
+    if numba is None:
+        return fn
+    return numba.njit(cache=True, nogil=True, error_model='numpy')(fn)  # no GIL, divisions by zero as NumPy
+
+
+###############
+# TRILINEAR
+###############
+
+@_jit
+def _axis_taps(c, size):
+    """floor/ceil voxels of a coordinate clamped to the axis and their weights, as interpolation.tap_indices"""
+    first = math.floor(c)
+    t = c - first
+    lo = min(max(first, 0), size - 1)
+    hi = min(max(first + 1, 0), size - 1)
+    return lo, hi, 1 - t, t
+
+
+@_jit
+def _trilinear_kernel(volume, z, y, x, out):
+    Z, H, W = volume.shape
+    for i in range(z.shape[0]):
+        z0, z1, wz0, wz1 = _axis_taps(z[i], Z)
+        y0, y1, wy0, wy1 = _axis_taps(y[i], H)
+        x0, x1, wx0, wx1 = _axis_taps(x[i], W)
+        # same order of the products and of the sums of interpolation.sample_points
+        value = 0.
+        value += volume[z0, y0, x0] * (wz0 * wy0 * wx0)
+        value += volume[z0, y0, x1] * (wz0 * wy0 * wx1)
+        value += volume[z0, y1, x0] * (wz0 * wy1 * wx0)
+        value += volume[z0, y1, x1] * (wz0 * wy1 * wx1)
+        value += volume[z1, y0, x0] * (wz1 * wy0 * wx0)
+        value += volume[z1, y0, x1] * (wz1 * wy0 * wx1)
+        value += volume[z1, y1, x0] * (wz1 * wy1 * wx0)
+        value += volume[z1, y1, x1] * (wz1 * wy1 * wx1)
+        out[i] = value
+
+
+def trilinear(volume, z, y, x, backend=None):
+    """
+    trilinear interpolation of many voxels, interpolation.sample_points with the linear kernel.
+    the compiled kernel reads the volume in place, without the eight gathers and weight arrays of the NumPy path
+
+    Args:
+        volume (numpy array, memmap, ChunkedVolume or ColumnStore): (Z, H, W) volume, only numpy arrays
+            and memmaps are read by the compiled kernel
+        z, y, x (float numpy arrays): coordinates of the points, all with the same shape
+        backend (str): 'numpy' or 'numba', BACKEND if None
+
+    Returns:
+        (float64 numpy array): interpolated values with the shape of the coordinates
+    """
+    backend = _backend(backend)
+    if not isinstance(volume, np.ndarray):
+        backend = 'numpy'
+    start = time.perf_counter()
+    shape = np.shape(x)
+    if backend == 'numpy':
+        values = interpolation.sample_points(volume, z, y, x, 'linear')
+    else:
+        z, y, x = (np.ascontiguousarray(c, dtype=np.float64).ravel() for c in (z, y, x))
+        values = np.empty(len(x))
+        _trilinear_kernel(volume, z, y, x, values)
+        values = values.reshape(shape)
+    record('trilinear', backend, int(np.prod(shape)), time.perf_counter() - start)
+    return values
+
+
+###############
+# SPLAT
+###############
+
+@_jit
+def _splat_kernel(out, targets, sources, values, active, points_per_cut):
+    # pairs are sorted by target and then by point, the last point writing a voxel wins
+    for i in range(targets.shape[0]):
+        source = sources[i]
+        if active[source // points_per_cut]:
+            out[targets[i]] = values[source]
+
+
+@_jit
+def _splat_columns_kernel(out, targets, sources, values, active, points_per_cut):
+    for i in range(targets.shape[0]):
+        source = sources[i]
+        if active[source // points_per_cut]:
+            for z in range(out.shape[0]):
+                out[z, targets[i]] = values[source, z]
+
+
+def splat(out, targets, sources, values, active, points_per_cut, backend=None):
+    """
+    last-writer scatter of the values of the points into a volume, see ResamplingOperator.splat
+
+    Args:
+        out (numpy array): (Z, H * W) volume for z columns or (Z * H * W) flat volume for voxels, written in place
+        targets (int numpy array): flat columns or voxels, sorted
+        sources (int numpy array): points writing them, sorted by point for each target
+        values (numpy array): (points, Z) values of the z columns or (points) values of the voxels
+        active (numpy array of bool): cuts whose points are written back
+        points_per_cut (int): points of each cut
+        backend (str): 'numpy' or 'numba', BACKEND if None
+    """
+    backend = _backend(backend)
+    start = time.perf_counter()
+    columns = out.ndim == 2
+    items = len(targets) * (out.shape[0] if columns else 1)
+    if backend == 'numpy':
+        written = active[sources // points_per_cut]
+        targets, sources = targets[written], sources[written]
+        last = np.ones(len(targets), bool)
+        last[:-1] = targets[1:] != targets[:-1]
+        targets, sources = targets[last], sources[last]
+        if columns:
+            out[:, targets] = values[sources].T
+        else:
+            out[targets] = values[sources]
+    else:
+        kernel = _splat_columns_kernel if columns else _splat_kernel
+        kernel(out, targets, sources, values, active, points_per_cut)
+    record('splat', backend, items, time.perf_counter() - start)
+
+
+###############
+# TRIANGLE-CUBE
+###############
+
+# see voxelize/voxelintersect/triangle.py (Graphics Gems III, triangleCube.c) for the commented algorithm
+TC_INSIDE = 0
+TC_OUTSIDE = 1
+TC_EPS = 1e-5
+
+
+@_jit
+def _face_plane(px, py, pz):
+    code = 0
+    if px >= .5:
+        code |= 0x01
+    if px < -.5:
+        code |= 0x02
+    if py >= .5:
+        code |= 0x04
+    if py < -.5:
+        code |= 0x08
+    if pz >= .5:
+        code |= 0x10
+    if pz < -.5:
+        code |= 0x20
+    return code
+
+
+@_jit
+def _bevel_2d(px, py, pz):
+    code = 0
+    if px + py >= 1.0:
+        code |= 0x001
+    if px - py >= 1.0:
+        code |= 0x002
+    if -px + py > 1.0:
+        code |= 0x004
+    if -px - py > 1.0:
+        code |= 0x008
+    if px + pz >= 1.0:
+        code |= 0x010
+    if px - pz >= 1.0:
+        code |= 0x020
+    if -px + pz > 1.0:
+        code |= 0x040
+    if -px - pz > 1.0:
+        code |= 0x080
+    if py + pz >= 1.0:
+        code |= 0x100
+    if py - pz >= 1.0:
+        code |= 0x200
+    if -py + pz > 1.0:
+        code |= 0x400
+    if -py - pz > 1.0:
+        code |= 0x800
+    return code
+
+
+@_jit
+def _bevel_3d(px, py, pz):
+    code = 0
+    if px + py + pz >= 1.5:
+        code |= 0x01
+    if px + py - pz >= 1.5:
+        code |= 0x02
+    if px - py + pz >= 1.5:
+        code |= 0x04
+    if px - py - pz >= 1.5:
+        code |= 0x08
+    if -px + py + pz > 1.5:
+        code |= 0x10
+    if -px + py - pz > 1.5:
+        code |= 0x20
+    if -px - py + pz > 1.5:
+        code |= 0x40
+    if -px - py - pz > 1.5:
+        code |= 0x80
+    return code
+
+
+@_jit
+def _check_line(a, b, outcode_diff):
+    # intersection of the segment a -> b with the face planes in outcode_diff, tested against the cube faces
+    for axis in range(3):
+        for side in range(2):
+            bit = 1 << (2 * axis + side)
+            if (bit & outcode_diff) != 0:
+                alpha = ((0.5 if side == 0 else -0.5) - a[axis]) / (b[axis] - a[axis])
+                px = a[0] + alpha * (b[0] - a[0])
+                py = a[1] + alpha * (b[1] - a[1])
+                pz = a[2] + alpha * (b[2] - a[2])
+                if _face_plane(px, py, pz) & (0x3f & ~bit) == TC_INSIDE:
+                    return TC_INSIDE
+    return TC_OUTSIDE
+
+
+@_jit
+def _sign3(cx, cy, cz):
+    code = 0
+    if cx < TC_EPS:
+        code |= 4
+    if cx > -TC_EPS:
+        code |= 32
+    if cy < TC_EPS:
+        code |= 2
+    if cy > -TC_EPS:
+        code |= 16
+    if cz < TC_EPS:
+        code |= 1
+    if cz > -TC_EPS:
+        code |= 8
+    return code
+
+
+@_jit
+def _side_sign(a, b, px, py, pz):
+    # signs of (a - b) x (a - p)
+    ux, uy, uz = a[0] - b[0], a[1] - b[1], a[2] - b[2]
+    vx, vy, vz = a[0] - px, a[1] - py, a[2] - pz
+    return _sign3(uy * vz - uz * vy, -ux * vz + uz * vx, ux * vy - uy * vx)
+
+
+@_jit
+def _point_triangle(px, py, pz, v1, v2, v3):
+    for axis, p in ((0, px), (1, py), (2, pz)):
+        if p > max(v1[axis], v2[axis], v3[axis]) + TC_EPS:
+            return TC_OUTSIDE
+        if p < min(v1[axis], v2[axis], v3[axis]) - TC_EPS:
+            return TC_OUTSIDE
+    if (_side_sign(v1, v2, px, py, pz) & _side_sign(v2, v3, px, py, pz) & _side_sign(v3, v1, px, py, pz)) == 0:
+        return TC_OUTSIDE
+    return TC_INSIDE
+
+
+@_jit
+def _triangle_cube_kernel(v1, v2, v3):
+    v1_test = _face_plane(v1[0], v1[1], v1[2])
+    v2_test = _face_plane(v2[0], v2[1], v2[2])
+    v3_test = _face_plane(v3[0], v3[1], v3[2])
+    if v1_test == TC_INSIDE or v2_test == TC_INSIDE or v3_test == TC_INSIDE:
+        return TC_INSIDE
+    if (v1_test & v2_test & v3_test) != TC_INSIDE:
+        return TC_OUTSIDE
+
+    v1_test |= _bevel_2d(v1[0], v1[1], v1[2]) << 8
+    v2_test |= _bevel_2d(v2[0], v2[1], v2[2]) << 8
+    v3_test |= _bevel_2d(v3[0], v3[1], v3[2]) << 8
+    if (v1_test & v2_test & v3_test) != TC_INSIDE:
+        return TC_OUTSIDE
+
+    v1_test |= _bevel_3d(v1[0], v1[1], v1[2]) << 24
+    v2_test |= _bevel_3d(v2[0], v2[1], v2[2]) << 24
+    v3_test |= _bevel_3d(v3[0], v3[1], v3[2]) << 24
+    if (v1_test & v2_test & v3_test) != TC_INSIDE:
+        return TC_OUTSIDE
+
+    if (v1_test & v2_test) == 0 and _check_line(v1, v2, v1_test | v2_test) == TC_INSIDE:
+        return TC_INSIDE
+    if (v1_test & v3_test) == 0 and _check_line(v1, v3, v1_test | v3_test) == TC_INSIDE:
+        return TC_INSIDE
+    if (v2_test & v3_test) == 0 and _check_line(v2, v3, v2_test | v3_test) == TC_INSIDE:
+        return TC_INSIDE
+
+    # intersections of the four cube diagonals with the plane of the triangle
+    ux, uy, uz = v1[0] - v2[0], v1[1] - v2[1], v1[2] - v2[2]
+    vx, vy, vz = v1[0] - v3[0], v1[1] - v3[1], v1[2] - v3[2]
+    nx, ny, nz = uy * vz - uz * vy, -ux * vz + uz * vx, ux * vy - uy * vx
+    d = nx * v1[0] + ny * v1[1] + nz * v1[2]
+    for sy, sz in ((1., 1.), (1., -1.), (-1., 1.), (-1., -1.)):
+        denom = nx + sy * ny + sz * nz
+        if abs(denom) > TC_EPS:
+            hit = d / denom
+            if abs(hit) <= 0.5 and _point_triangle(hit, sy * hit, sz * hit, v1, v2, v3) == TC_INSIDE:
+                return TC_INSIDE
+    return TC_OUTSIDE
+
+
+def triangle_cube(v1, v2, v3):
+    """
+    triangle-cube intersection test of the compiled backend (the python loops without numba),
+    voxelize uses the C library or voxelintersect.triangle.t_c_intersection on the NumPy backend
+
+    Args:
+        v1, v2, v3 (float64 numpy arrays): vertexes of the triangle, relative to the center of the unit cube
+
+    Returns:
+        (int): TC_INSIDE (0) if the triangle intersects the cube, TC_OUTSIDE (1) otherwise
+    """
+    return _triangle_cube_kernel(v1, v2, v3)
@@ -3,6 +3,8 @@ from pyface.qt import QtGui
 from annotation.components.MayaviViewer import MayaviViewer
 from annotation.components.message.Messenger import Messenger
 
+REFINE_DELAY = 500  # ms after a preview is plotted before it is replaced by the full resolution volume
+
 
 class Dialog3DPlot(QtGui.QDialog):
 
@@ -21,15 +23,35 @@ class Dialog3DPlot(QtGui.QDialog):
         self.mayavi = MayaviViewer(self)
         self.layout.addWidget(self.mayavi)
         self.messenger = Messenger()
+        self.refine_fn = None
+        self.refine_timer = QtCore.QTimer(self)
+        self.refine_timer.setSingleShot(True)
+        self.refine_timer.timeout.connect(self.refine)
 
-    def show(self, volume=None):
+    def show(self, volume=None, spacing=1, refine_fn=None):
         """
         Shows the plot
 
         Args:
             volume (numpy.ndarray): volume to plot
+            spacing (int): size of a voxel of volume in voxels of the full resolution volume, 2 ** level for
+                a level of Jaw.pyramid
+            refine_fn (function): returns the full resolution volume, plotted instead of volume when the
+                dialog has been idle for REFINE_DELAY ms
         """
         if volume is None or not volume.any():
             return
-        self.messenger.loading_message("Plotting", lambda: self.mayavi.visualization.plot_volume(volume))
+        self.messenger.loading_message("Plotting", lambda: self.mayavi.visualization.plot_volume(volume, spacing))
         super().show()
+        self.refine_fn = refine_fn
+        refine_fn is not None and self.refine_timer.start(REFINE_DELAY)
+
+    def refine(self):
+        """replaces the preview with the full resolution volume, keeping the camera"""
+        if self.refine_fn is None or not self.isVisible():
+            return
+        volume, self.refine_fn = self.refine_fn(), None
+        if volume is None or not volume.any():
+            return
+        self.messenger.loading_message("Refining plot",
+                                       lambda: self.mayavi.visualization.plot_volume(volume, keep_view=True))
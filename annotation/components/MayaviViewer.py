@@ -31,9 +31,20 @@ class Visualization(HasTraits):
         # self.scene.mlab.test_points3d()
         pass  # show empty plot
 
-    def plot_volume(self, volume):
+    def plot_volume(self, volume, spacing=1, keep_view=False):
+        """
+        Args:
+            volume (numpy.ndarray): volume to plot
+            spacing (int): size of a voxel of volume in voxels of the full resolution volume (see Jaw.pyramid),
+                so that the plots of the same volume at different levels overlap
+            keep_view (bool): keep the camera of the current plot
+        """
+        view = self.scene.mlab.view() if keep_view else None
         self.scene.mlab.clf()
-        self.scene.mlab.contour3d(volume, contours=4, opacity=.3)
+        source = self.scene.mlab.pipeline.scalar_field(volume)
+        source.spacing = (spacing, spacing, spacing)
+        self.scene.mlab.pipeline.iso_surface(source, contours=4, opacity=.3)
+        view is not None and self.scene.mlab.view(*view)
 
     # the layout of the dialog created
     view = View(Item('scene', editor=SceneEditor(scene_class=MayaviScene), height=250, width=300, show_label=False),
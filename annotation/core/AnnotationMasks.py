@@ -106,7 +106,7 @@ class AnnotationMasks():
             # (skip self.skip slices and annotate the next one)
             # If the user cannot annotate a slice, then he gets full(UNLABELED).
             # Otherwise, if he had the possibility to annotate, but there is no annotation, then he gets full(BG).
-            if i % (self.skip + 1) == 0 and self.arch_handler.side_volume.get()[i].any():
+            if i % (self.skip + 1) == 0 and self.arch_handler.side_volume.has_data(i):
                 mask_img = self.compute_mask_image(mask, (self.h, self.w),
                                                    resize_scale=self.arch_handler.side_volume_scale)
                 self.mask_volume[i] = mask_img
@@ -210,22 +210,23 @@ class AnnotationMasks():
 
         # prepare imgs dir
         sv = self.arch_handler.side_volume
-        if sv.original is None:
+        original = sv.get_original()
+        if original is None:
             print("Could not extract side volume images")
         else:
             imgs_dirname = "imgs-{}".format(date_str)
             imgs_path = os.path.join(self.EXPORT_PATH, imgs_dirname)
             if not os.path.exists(imgs_path):
                 os.makedirs(imgs_path)
-            np.save(os.path.join(imgs_path, self.EXPORT_SIDE_VOLUME_FILENAME), sv.original)
+            np.save(os.path.join(imgs_path, self.EXPORT_SIDE_VOLUME_FILENAME), original)
 
         for i, img in enumerate(self.mask_volume):
             if not img.any():  # skipping totally black images
                 continue
             export_img(img, os.path.join(masks_path, "{}{}".format(i, self.EXPORT_MASK_FILENAME)),
                        maximum=max(l.values()))
-            if sv.original is not None:
-                export_img(sv.original[i], os.path.join(imgs_path, "{}{}".format(i, self.EXPORT_IMG_FILENAME)))
+            if original is not None:
+                export_img(original[i], os.path.join(imgs_path, "{}{}".format(i, self.EXPORT_IMG_FILENAME)))
 
     def save_mask_splines(self):
         """Saves annotation mask splines on disk, only if there are changes"""
@@ -275,7 +276,7 @@ class AnnotationMasks():
             from_snake = data['from_snake'][i] if 'from_snake' in data.keys() else False
             self.set_mask_spline(i, spline, from_snake)
         self.handle_scaling_mismatch()
-        check_shape and self.check_shape(self.arch_handler.side_volume.get().shape)
+        check_shape and self.check_shape(self.arch_handler.side_volume.shape)
         self._edited = False
 
     def handle_scaling_mismatch(self):
@@ -2,7 +2,7 @@ from annotation.utils.math import get_poly_approx, apply_offset_to_arch
 
 
 class Arch():
-    def __init__(self, arch_handler, arch):
+    def __init__(self, arch_handler, arch, panorex=None):
         """
         Arch not handled as a Spline, but as a list of points.
 
@@ -11,10 +11,11 @@ class Arch():
         Args:
             arch_handler (ArchHandler): ArchHandler parent object
             arch (list of (float, float)): list of coordinates
+            panorex (numpy.ndarray): panorex of arch if already available (e.g. from a PanorexStack)
         """
         self.arch_handler = arch_handler
         self.set_arch(arch)
-        self.set_panorex(self.compute_panorex())
+        self.set_panorex(self.compute_panorex() if panorex is None else panorex)
 
     def compute_panorex(self):
         """
@@ -36,16 +37,17 @@ class Arch():
         """
         return get_poly_approx(self.arch)
 
-    def update(self, arch=None):
+    def update(self, arch=None, panorex=None):
         """
         Updates the arch with a new set of points, then recomputes panorex.
 
         Args:
             arch (list of (float, float)): new list of coordinates
+            panorex (numpy.ndarray): panorex of the new arch if already available, it is not recomputed
         """
         if arch is not None:
             self.set_arch(arch)
-        self.set_panorex(self.compute_panorex())
+        self.set_panorex(self.compute_panorex() if panorex is None else panorex)
 
     def get_offsetted(self, amount):
         """
@@ -79,7 +81,7 @@ class Arch():
             (Arch): copy of this Arch
         """
         arch = self.arch.copy()
-        return Arch(self.arch_handler, arch)
+        return Arch(self.arch_handler, arch, panorex=self.panorex)
 
     ###########
     # GETTERS #
@@ -23,7 +23,7 @@ class ArchDetections():
             if self.arch_handler.from_annotations:
                 self.data[i] = self.arch_handler.get_arch_from_annotation()
             else:
-                self.data[i] = processing.arch_detection(self.arch_handler.volume[i])
+                self.data[i] = processing.arch_detection(self.arch_handler.get_slice(i))
         except Exception as e:
             print(e)
             self.data[i] = None, None, None
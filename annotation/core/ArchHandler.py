@@ -14,10 +14,11 @@ from annotation.components.message.Strategies import QtMessageStrategy
 from annotation.core.AnnotationMasks import AnnotationMasks
 from annotation.core.Arch import Arch
 from annotation.core.ArchDetections import ArchDetections
+from annotation.core.PanorexStack import PanorexStack
 from annotation.core.SideVolume import SideVolume, TiltedSideVolume
 from annotation.spline.Spline import Spline
 from annotation.utils.image import get_coords_by_label_3D, get_mask_by_label, filter_volume_Z_axis, plot
-from annotation.utils.math import clip_range, get_poly_approx_
+from annotation.utils.math import get_poly_approx_
 from annotation.utils.metaclasses import SingletonMeta
 from conf import labels as l
 
@@ -39,7 +40,8 @@ class ArchHandler(Jaw, metaclass=SingletonMeta):
 
     SIDE_VOLUME_SCALE = 4  # desired scale of side_volume
 
-    def __init__(self, dicomdir_path):
+    def __init__(self, dicomdir_path, gt_only=False, chunked=False, column_store=False, quantized=False,
+                 use_cache=False):
         """
         Class that handles the arch and panorex computing on top of the Jaw class.
 
@@ -52,6 +54,7 @@ class ArchHandler(Jaw, metaclass=SingletonMeta):
             - spline (Spline): object that models the arch as a Catmull-Rom spline
             - arch (Arch): object that stores the coordinates of the arch offsetted while using the application
             - LH_pano_arches ((Arch, Arch)): objects that store the coordinates of two arches slightly distant from the arch
+            - panorex_stack (PanorexStack): panorexes of the current arch at every offset of the sliders
             - side_coords (list): coordinates of the points that define "side_volume" perimeter
             - old_side_coords (list): side_coords of the current SideVolume, used in order not to recompute SideVolume if there are no changes
             - side_volume (list): volume of the side views of the jaw volume through the two coords arches
@@ -65,10 +68,19 @@ class ArchHandler(Jaw, metaclass=SingletonMeta):
 
         Args:
             dicomdir_path (str): path of the DICOMDIR file
+            gt_only (bool): read only headers and annotations, the volume is decoded when first accessed (see Jaw)
+            chunked (bool): keep volume and real_gt_volume on disk as chunked volumes (see Jaw)
+            column_store (bool): keep a copy of volume with contiguous z columns for the side views (see Jaw)
+            quantized (bool): keep volume as uint16 and the side volume images as uint16 too (see Jaw)
+            use_cache (bool): store the decoded volumes in the volume_cache directory next to the DICOMDIR
+                and map them from there the next time (see Jaw)
         """
         sup = super()
         self.messenger = Messenger(QtMessageStrategy())
-        self.messenger.loading_message(func=lambda: sup.__init__(dicomdir_path), message="Loading DICOM")
+        self.messenger.loading_message(func=lambda: sup.__init__(dicomdir_path, use_cache=use_cache, gt_only=gt_only,
+                                                                 chunked=chunked, column_store=column_store,
+                                                                 quantized=quantized),
+                                       message="Loading DICOM")
         self.dicomdir_path = dicomdir_path
         self.history = History(self, save_func=self.save_state)
         self.selected_slice = None
@@ -77,6 +89,7 @@ class ArchHandler(Jaw, metaclass=SingletonMeta):
         self.spline = None
         self.arch = None
         self.LH_pano_arches = None
+        self.panorex_stack = None
         self.side_coords = None
         self.old_side_coords = None
         self.side_volume = None
@@ -85,7 +98,7 @@ class ArchHandler(Jaw, metaclass=SingletonMeta):
         self.R_canal_spline = None
         self.annotation_masks: AnnotationMasks = None
         self.canal = None
-        self.gt_delaunay = np.zeros_like(self.gt_volume)
+        self.gt_delaunay = np.zeros(self.gt_volume.shape, dtype=np.uint8)  # np.zeros pages are not resident until written
         self.gt_extracted = False
         self.generated = None
         self.from_annotations = False
@@ -95,10 +108,15 @@ class ArchHandler(Jaw, metaclass=SingletonMeta):
         if not os.path.isfile(gt_or_gen_path):
             gt_or_gen_path = os.path.join(os.path.dirname(self.dicomdir_path), self.GENERATED_FILENAME)
         if not os.path.isfile(gt_or_gen_path):
-            self.real_gt_volume = np.zeros_like(self.gt_volume)
+            self.real_gt_volume = np.zeros(self.gt_volume.shape, dtype=np.uint8)
             self.generated = None
         else:
-            self.real_gt_volume = np.load(gt_or_gen_path)
+            st = os.stat(gt_or_gen_path)
+            self.real_gt_volume = self.to_chunked(
+                'real_gt_volume',
+                np.load(gt_or_gen_path, mmap_mode='r' if self.chunked else None),
+                key="{}|{}|{}".format(os.path.abspath(gt_or_gen_path), st.st_mtime_ns, st.st_size)
+            )
         self.import_gen_volume()
 
     ####################
@@ -132,10 +150,8 @@ class ArchHandler(Jaw, metaclass=SingletonMeta):
             self.R_canal_spline = Spline()
 
         self.update_coords()
-        self.arch = Arch(self, self.coords[1])
-        h_arch = self.arch.get_offsetted(-1)
-        l_arch = self.arch.get_offsetted(1)
-        self.LH_pano_arches = (l_arch, h_arch)
+        self.arch = Arch(self, self.coords[1], panorex=self.get_panorex_stack().get_panorex(0))
+        self.offset_arch()
         self.import_gen_volume()
 
     def compute_initial_state(self, selected_slice=0, data=None, want_side_volume=True):
@@ -170,22 +186,40 @@ class ArchHandler(Jaw, metaclass=SingletonMeta):
         l_offset, coords, h_offset, derivative = self.coords
         self.side_coords = processing.generate_side_coords(h_offset, l_offset, derivative)
 
-    def offset_arch(self, arch_offset=0, pano_offset=1):
+    def get_panorex_stack(self, background=False):
+        """
+        Returns the PanorexStack of the current arch, a new one is computed if the arch has changed.
+
+        Args:
+            background (bool): compute the whole stack in a background thread (see PanorexStack.start),
+                otherwise only the panorexes asked for are computed
+
+        Returns:
+            (PanorexStack): panorexes of the current arch at every offset
+        """
+        if self.panorex_stack is None or not self.panorex_stack.matches(self.coords[1]):
+            if self.panorex_stack is not None:
+                self.panorex_stack.stop()
+            self.panorex_stack = PanorexStack(self, self.coords[1])
+        background and self.panorex_stack.start()
+        return self.panorex_stack
+
+    def offset_arch(self, arch_offset=0, pano_offset=1, background=False):
         """
         Computes/Updates the Arch objects after the offsets.
+        Panorexes are looked up in the PanorexStack of the arch.
 
         Args:
             arch_offset (int): how much to displace the curve from the original coordinates
             pano_offset (int): how much to displace the "parallel" LH offsetted curves
+            background (bool): compute the panorexes of the other offsets in a background thread,
+                for the offset sliders (see get_panorex_stack)
         """
-        # reset to initial position
-        self.arch.set_arch(self.coords[1])
-        if pano_offset != 0:
-            h_arch = self.arch.get_offsetted(arch_offset - pano_offset)
-            l_arch = self.arch.get_offsetted(arch_offset + pano_offset)
-        self.arch.offset(arch_offset)
-        if pano_offset == 0:
-            h_arch = l_arch = self.arch.copy()
+        stack = self.get_panorex_stack(background)
+        self.arch.update(stack.get_arch(arch_offset), panorex=stack.get_panorex(arch_offset))
+        l_offset, h_offset = arch_offset + pano_offset, arch_offset - pano_offset
+        l_arch = Arch(self, stack.get_arch(l_offset), panorex=stack.get_panorex(l_offset))
+        h_arch = Arch(self, stack.get_arch(h_offset), panorex=stack.get_panorex(h_offset))
         self.LH_pano_arches = (l_arch, h_arch)
 
     def tilted(self):
@@ -199,13 +233,15 @@ class ArchHandler(Jaw, metaclass=SingletonMeta):
             return True
         return False
 
-    def compute_side_volume(self, scale=None, tilted=False):
+    def compute_side_volume(self, scale=None, tilted=False, lazy=False):
         """
-        Computes and updates side_volume.
+        Computes and updates side_volume, a SideVolume of the same scale is refreshed (see SideVolume.refresh).
 
         Args:
             scale (float): scale of side volume w.r.t. volume dimensions
             tilted (bool): selects TiltedSideVolume instead of default SideVolume
+            lazy (bool): a new side volume cuts its images when they are shown (see SideVolume.get_slice),
+                and is saved when the annotation ends (see SideVolume.finish). a refreshed one keeps its mode
         """
         # check if needed to recompute side_volume
         if self.old_side_coords is not None \
@@ -216,10 +252,16 @@ class ArchHandler(Jaw, metaclass=SingletonMeta):
             return
 
         self.side_volume_scale = self.SIDE_VOLUME_SCALE if scale is None else scale
-        if tilted:
-            self.side_volume = TiltedSideVolume(self, self.side_volume_scale)
+        if not tilted and self.side_volume is not None and not self.tilted() and self.side_volume.correct \
+                and self.side_volume.scale == self.side_volume_scale:
+            # after an edit of the arch only the cuts that moved are computed again
+            self.side_volume.refresh()
         else:
-            self.side_volume = SideVolume(self, self.side_volume_scale)
+            self.side_volume is not None and self.side_volume.stop()
+            if tilted:
+                self.side_volume = TiltedSideVolume(self, self.side_volume_scale, lazy)
+            else:
+                self.side_volume = SideVolume(self, self.side_volume_scale, lazy)
 
         # configuring annotations_masks
         if not self.side_volume.correct:
@@ -227,7 +269,7 @@ class ArchHandler(Jaw, metaclass=SingletonMeta):
 
         self.old_side_coords = self.side_coords
 
-        shape = self.side_volume.get().shape
+        shape = self.side_volume.shape
         if self.annotation_masks is None:
             self.annotation_masks = AnnotationMasks(shape, self)
         else:
@@ -252,68 +294,24 @@ class ArchHandler(Jaw, metaclass=SingletonMeta):
     def _compute_gt_volume(self, step_fn=None):
         """
         Transfers the canal computed in AnnotationsMasks.compute_mask_volume() in the original volume position,
-        i.e. a curved 3D tube that follows the arch
-        """
+        i.e. a curved 3D tube that follows the arch.
 
-        def assign_to_gt_volume(self, val, x, y, z):
-            x_ = clip_range(x, 0, self.W - 1)
-            y_ = clip_range(y, 0, self.H - 1)
-            z_ = clip_range(z, 0, self.Z - 1)
-            gt_volume[floor(z_), floor(y_), floor(x_)] = val
-            gt_volume[floor(z_), floor(y_), ceil(x_)] = val
-            gt_volume[floor(z_), ceil(y_), floor(x_)] = val
-            gt_volume[floor(z_), ceil(y_), ceil(x_)] = val
-            gt_volume[ceil(z_), floor(y_), floor(x_)] = val
-            gt_volume[ceil(z_), floor(y_), ceil(x_)] = val
-            gt_volume[ceil(z_), ceil(y_), floor(x_)] = val
-            gt_volume[ceil(z_), ceil(y_), ceil(x_)] = val
-
-        from math import floor, ceil
-        gt_volume = np.full_like(self.volume, l.UNLABELED, dtype=np.uint8)
+        The labels are written back by the ResamplingOperator of side_coords (or of the tilted planes) at the
+        floor/ceil neighbours of each point: every voxel takes the label of the last point falling next to it.
+        """
+        step_fn is not None and step_fn(0, 1)
         if not self.tilted():
-            for z_id, points in enumerate(self.side_coords):
-                step_fn is not None and step_fn(z_id, len(self.side_coords))
-                for w_id, (x, y) in enumerate(points):
-                    if 0 <= int(x) < self.W and 0 <= int(y) < self.H:
-
-                        ### less precise method
-                        # gt_volume[:, int(y), int(x)] = self.canal[z_id, :, w_id]
-
-                        # # floor and ceil only CONTOUR and INSIDE labels
-                        # z_column = self.canal[z_id, :, w_id]
-                        # gt_volume[:, int(y), int(x)] = z_column
-                        # for h_id in np.argwhere(np.logical_or(z_column == l.CONTOUR, z_column == l.INSIDE)):
-                        #     val = z_column[h_id]
-                        #     gt_volume[h_id, floor(y), floor(x)] = val
-                        #     gt_volume[h_id, floor(y), ceil(x)] = val
-                        #     gt_volume[h_id, ceil(y), floor(x)] = val
-                        #     gt_volume[h_id, ceil(y), ceil(x)] = val
-
-                        z_column = self.canal[z_id, :, w_id]
-
-                        # floor and ceil for every label
-                        x_ = clip_range(x, 0, self.W - 1)
-                        y_ = clip_range(y, 0, self.H - 1)
-                        gt_volume[:, floor(y_), floor(x_)] = self.canal[z_id, :, w_id]
-                        gt_volume[:, floor(y_), ceil(x_)] = self.canal[z_id, :, w_id]
-                        gt_volume[:, ceil(y_), floor(x_)] = self.canal[z_id, :, w_id]
-                        gt_volume[:, ceil(y_), ceil(x_)] = self.canal[z_id, :, w_id]
-                        for h_id in np.argwhere(z_column == l.INSIDE):
-                            assign_to_gt_volume(self, l.INSIDE, x, y, h_id)
-                        for h_id in np.argwhere(z_column == l.CONTOUR):
-                            assign_to_gt_volume(self, l.CONTOUR, x, y, h_id)
-
+            operator = self.resampling_operator(xy_set=self.side_coords)
+            gt_volume = operator.splat(self.canal, fill=l.UNLABELED, step_fn=step_fn)
         else:
-            for i, (img, plane) in enumerate(zip(self.canal, self.side_volume.planes)):
-                step_fn is not None and step_fn(i, len(self.side_coords))
-                if plane is None:
-                    continue
-                if np.array_equal(img, np.full_like(img, l.UNLABELED, dtype=np.uint8)):
-                    continue
-                X, Y, Z = plane.plane
-                for val, x, y, z in np.nditer([img, X, Y, Z]):
-                    assign_to_gt_volume(self, val, x, y, z)
-                    # gt_volume[z, y, x] = val
+            ids = [i for i, plane in enumerate(self.side_volume.planes) if plane is not None]
+            if not ids:
+                gt_volume = np.full(self.volume.shape, l.UNLABELED, dtype=np.uint8)
+            else:
+                operator = self.resampling_operator(planes=[self.side_volume.planes[i].plane for i in ids])
+                # planes without annotations do not overwrite the others
+                active = [(self.canal[i] != l.UNLABELED).any() for i in ids]
+                gt_volume = operator.splat(self.canal[ids], fill=l.UNLABELED, active=active, step_fn=step_fn)
 
         self.set_gt_volume(gt_volume)
 
@@ -634,15 +632,15 @@ class ArchHandler(Jaw, metaclass=SingletonMeta):
         l_arch, h_arch = self.LH_pano_arches
         return (l_arch.get_panorex(), h_arch.get_panorex())
 
-    def get_jaw_with_gt(self):
-        gt = self.get_gt_volume(labels=[l.CONTOUR, l.INSIDE])
-        return self.volume + gt if gt.any() else None
+    def get_jaw_with_gt(self, level=0):
+        gt = self.get_gt_volume(labels=[l.CONTOUR, l.INSIDE], level=level)
+        return np.asarray(self.get_volume(level=level)) + gt if gt.any() else None
 
     def get_jaw_with_delaunay(self):
-        return self.volume + self.gt_delaunay if self.gt_delaunay.any() else None
+        return np.asarray(self.get_volume()) + self.gt_delaunay if self.gt_delaunay.any() else None
 
     def get_side_volume_slice(self, pos, show_network_prediction=False):
         return self.side_volume.get_slice(pos, show_network_prediction)
 
     def get_gt_volume_slice(self, pos):
-        return self.side_volume.gt[pos]
+        return self.side_volume.get_gt_slice(pos)
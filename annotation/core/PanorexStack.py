@@ -0,0 +1,99 @@
+import threading
+
+import numpy as np
+
+from Jaw import QUANTIZED_DTYPE
+from annotation.utils.math import get_offset_directions, get_poly_approx
+
+
+class PanorexStack():
+    MAX_OFFSET = 60  # arch offset slider (+-50) plus pano offset slider (up to 10)
+    INTERP_FN = 'linear'  # cheap kernel, the panorexes follow the offset sliders (see interpolation.KERNELS)
+
+    def __init__(self, arch_handler, arch, max_offset=MAX_OFFSET, background=False):
+        """
+        Panorexes of an arch displaced by every integer offset in [-max_offset, max_offset] along its normals,
+        stored in a single (n_offsets, Z, L) array.
+
+        Offsetting the arch becomes a lookup. Panorexes are computed from the central offset outwards,
+        in a background thread if requested (see start); the ones not computed yet are computed when asked for.
+        The stack of a quantized jaw is uint16, panorexes are converted to [0, 1] when they are returned.
+
+        Args:
+            arch_handler (ArchHandler): ArchHandler parent object
+            arch (list of (float, float)): list of coordinates of the arch at offset 0
+            max_offset (int): greatest offset, in both directions
+            background (bool): compute the stack in a background thread
+        """
+        self.arch_handler = arch_handler
+        self.arch = np.asarray(arch, dtype=np.float64).reshape(-1, 2)
+        self.directions = get_offset_directions(self.arch, get_poly_approx(arch)[0])
+        self.max_offset = max_offset
+        self.offsets = np.arange(-max_offset, max_offset + 1)
+        self.panorexes = np.zeros((len(self.offsets), arch_handler.Z, len(self.arch)),
+                                  QUANTIZED_DTYPE if arch_handler.quantized else np.float32)
+        self.ready = np.zeros(len(self.offsets), bool)
+        self.lock = threading.Lock()
+        self.stopped = False
+        self.thread = None
+        background and self.start()
+
+    def start(self):
+        """Starts computing the stack in a background thread, if it is not running already"""
+        if self.thread is None and not self.stopped:
+            self.thread = threading.Thread(target=self.compute, daemon=True)
+            self.thread.start()
+
+    def compute(self):
+        """Computes all the panorexes of the stack, nearest offsets first"""
+        for offset in sorted(self.offsets, key=abs):
+            if self.stopped:
+                return
+            self.get_panorex(offset)
+
+    def stop(self):
+        """Stops the background computation, the stack is not going to be used anymore"""
+        self.stopped = True
+
+    def matches(self, arch):
+        """
+        Args:
+            arch (list of (float, float)): list of coordinates
+
+        Returns:
+            (bool): whether this stack has been computed for the given arch
+        """
+        arch = np.asarray(arch, dtype=np.float64).reshape(-1, 2)
+        return np.array_equal(arch, self.arch)
+
+    def get_arch(self, offset):
+        """
+        Args:
+            offset (int): how much to displace the arch from the original position
+
+        Returns:
+            (list of (float, float)): coordinates of the offsetted arch, see apply_offset_to_arch
+        """
+        return [tuple(point) for point in self.arch + offset * self.directions]
+
+    def get_panorex(self, offset):
+        """
+        Args:
+            offset (int): how much to displace the arch from the original position
+
+        Returns:
+            (numpy.ndarray): panorex of the offsetted arch
+        """
+        if not -self.max_offset <= offset <= self.max_offset or offset != int(offset):
+            return self.arch_handler.create_panorex(self.get_arch(offset), interp_fn=self.INTERP_FN)
+        idx = int(offset) + self.max_offset
+        if not self.ready[idx]:
+            panorex = self.arch_handler.create_panorex(self.get_arch(offset), interp_fn=self.INTERP_FN,
+                                                       dequantize=False)
+            with self.lock:
+                if not self.ready[idx]:
+                    self.panorexes[idx] = panorex
+                    self.ready[idx] = True
+        panorex = self.panorexes[idx]
+        panorex.flags.writeable = False  # shared by every arch with this offset
+        return self.arch_handler.dequantize(panorex)
@@ -1,8 +1,12 @@
-from Plane import Plane
+from Plane import Plane, PARAMS_SIZE
+from Jaw import QUANTIZED_DTYPE
 import numpy as np
 import cv2
 import os
 import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from annotation.components.message.Messenger import Messenger
 
@@ -12,24 +16,48 @@ class SideVolume():
     GT_SIDE_VOLUME_FILENAME = "gt_side_volume.npy"
     SIDE_COORDS_FILENAME = "side_coords.npy"
     COORDS_FILENAME = "coords.npy"
-    PLANES_FILENAME = "planes.npy"
+    PLANES_FILENAME = "plane_params.npy"
+    DENSE_PLANES_FILENAME = "planes.npy"  # planes that are not regular grids, and side volumes saved before
+    CUT_RANGE_FILENAME = "cut_range.npy"  # range of a float side volume before the min-max normalization
     SAVE_DIRNAME = "d_side_volume"
     # SAVE_DIRNAME = "side_volume"
-
-    def __init__(self, arch_handler, scale):
+    # max displacement (in voxels) of the points of a cut that refresh reuses instead of cutting it again.
+    # the arch is a polynomial fit of the whole spline, so even a local edit moves every cut by a fraction of voxel
+    REUSE_TOLERANCE = 0.5
+    SCALED_SLICES = 16  # display scale slices kept by get_slice and get_gt_slice
+    PREFETCH_WINDOW = 8  # annotatable positions cut ahead of the one on screen, in the direction of navigation
+    # kernel of the images, which are annotated, saved and exported (see interpolation.KERNELS)
+    INTERP_FN = 'catmull-rom'
+
+    def __init__(self, arch_handler, scale, lazy=False):
         """
         Class that manages side volume
 
         Args:
             arch_handler (annotation.core.ArchHandler.ArchHandler): arch handler that is parent of this object
             scale (float): scale of the desired side_volume wrt the orginal shape
+            lazy (bool): cut each position the first time it is asked for instead of the whole volume,
+                the next positions are cut in background (see get_slice). the side volume is normalized and
+                saved when the annotation ends or it is exported (see finish)
         """
         self.arch_handler = arch_handler
         self.messenger = Messenger()
         self.scale = scale
         self.original = None
+        self.original_gt = None
         self.data = None
         self.gt = None
+        self.original_range = None
+        self.cut_coords = None
+        self._scaled_slices = OrderedDict()
+        self._cut_range = None
+        self.lazy = lazy
+        self.computed = None  # cut positions of a lazy side volume, None if all of them are
+        self._lock = threading.Lock()
+        self._prefetcher = None
+        self._generation = 0  # incremented to abort the running prefetch
+        self._last_pos = None
+        self._direction = 1
         self.correct = True
         self.planes = [None] * len(arch_handler.side_coords)
         self.show_gt_or_generated_volume = False
@@ -45,27 +73,45 @@ class SideVolume():
         return os.path.isfile(sv) and os.path.isfile(sc) and os.path.isfile(co)
 
     def _save_planes(self):
+        """
+        Saves the planes as their origin and axes (see Plane.to_params), a row of zeros where there is no plane.
+        the coordinates of all the planes are saved only if some of them is not a regular grid
+        """
         base = os.path.dirname(self.arch_handler.dicomdir_path)
         dir = os.path.join(base, self.SAVE_DIRNAME)
         p = os.path.join(dir, self.PLANES_FILENAME)
+        dense = os.path.join(dir, self.DENSE_PLANES_FILENAME)
+        if all(plane is None or plane.is_parametric for plane in self.planes):
+            params = np.zeros((len(self.planes), PARAMS_SIZE), dtype=np.float64)
+            for i, plane in enumerate(self.planes):
+                if plane is not None:
+                    params[i] = plane.to_params()
+            np.save(p, params)
+            os.path.isfile(dense) and os.remove(dense)
+            return
         n, h, w = self.original.shape
         empty = np.zeros((3, h, w), dtype=np.float64)
         planes = np.repeat(empty[np.newaxis, :, :, :], n, axis=0)
         for i, plane in enumerate(self.planes):
             if plane is None:
                 continue
-            planes[i] = plane.plane
-        np.save(p, planes)
+            planes[i] = plane.get_plane()
+        np.save(dense, planes)
+        os.path.isfile(p) and os.remove(p)
 
     def _load_planes(self):
         base = os.path.dirname(self.arch_handler.dicomdir_path)
         dir = os.path.join(base, self.SAVE_DIRNAME)
         p = os.path.join(dir, self.PLANES_FILENAME)
-        if not os.path.isfile(p):
+        dense = os.path.join(dir, self.DENSE_PLANES_FILENAME)
+        if os.path.isfile(p):
+            self.planes = [Plane.from_params(params) if params[0] else None for params in np.load(p)]
+            return
+        if not os.path.isfile(dense):
             msg = "Could not load tilted side volume: {} is missing".format(self.PLANES_FILENAME)
             print(msg)
             raise FileNotFoundError(msg)
-        planes = np.load(p)
+        planes = np.load(dense)
         n, _, h, w = planes.shape
         self.planes = []
         for plane in planes:
@@ -73,7 +119,7 @@ class SideVolume():
                 self.planes.append(None)
                 continue
             plane_obj = Plane(h, w)
-            plane_obj.plane = plane
+            plane_obj.set_plane(plane)  # stored as origin and axes if it is a regular grid
             self.planes.append(plane_obj)
 
     def save_(self):
@@ -89,6 +135,11 @@ class SideVolume():
         np.save(os.path.join(dir, self.SIDE_COORDS_FILENAME), self.arch_handler.side_coords)
         np.save(os.path.join(dir, self.COORDS_FILENAME), np.asarray(self.arch_handler.coords))
         self._save_planes()
+        cut_range = os.path.join(dir, self.CUT_RANGE_FILENAME)
+        if self._cut_range is not None:
+            np.save(cut_range, np.asarray(self._cut_range, dtype=np.float64))
+        else:
+            os.path.isfile(cut_range) and os.remove(cut_range)
 
     def load_(self):
         """Loads data and checks for consistency"""
@@ -116,60 +167,385 @@ class SideVolume():
             msg = "Loaded side coords do not match with current side coords"
             print(msg)
             raise ValueError(msg)
+        cut_range = os.path.join(dir, self.CUT_RANGE_FILENAME)
+        if sv_.dtype != QUANTIZED_DTYPE and os.path.isfile(cut_range):
+            low, high = np.load(cut_range)
+            sv_ = np.asarray(sv_, dtype=np.float32) * (high - low) + low  # values of the cuts, as refresh needs
         self.data = sv_
         self.gt = gt_
+        self.cut_coords = np.array(sc_, dtype=np.float64)
         self.arch_handler.side_coords = sc_
         self.arch_handler.coords = (co_[0], co_[1], co_[2], co_[3])
         self._postprocess_data()
+        if sv_.dtype != QUANTIZED_DTYPE and not os.path.isfile(cut_range):
+            self._cut_range = None  # saved without its range: unknown, refresh computes it again (see refresh)
 
     def _postprocess_data(self):
         """
-        Post-process operations on side volume:
-            - rescaling
+        Post-process operations on the cuts in data and gt, which become original and original_gt:
             - normalization
+
+        only the native resolution is stored, the slices at the display scale are computed when they are
+        asked for (see get_slice). the images of a quantized jaw stay uint16 (half the memory of float32):
+        the range of the min-max normalization is stored in original_range and applied when the images are
+        displayed or exported (see get_original)
         """
-        # rescaling the projection volume properly
         self.original = self.data
-        self.original_gt = self.gt
-        width = int(self.data.shape[2] * self.scale)
-        height = int(self.data.shape[1] * self.scale)
-        scaled_side_volume = np.ndarray(shape=(self.data.shape[0], height, width))
-        scaled_gt_volume = np.ndarray(shape=(self.gt.shape[0], height, width))
-
-        for i in range(self.data.shape[0]):
-            scaled_side_volume[i] = cv2.resize(self.data[i, :, :], (width, height), interpolation=cv2.INTER_AREA)
-            scaled_gt_volume[i] = cv2.resize(self.gt[i, :, :], (width, height), interpolation=cv2.INTER_AREA)
-
-        # padding the side volume and rescaling
-        scaled_side_volume = cv2.normalize(scaled_side_volume, scaled_side_volume, 0, 1, cv2.NORM_MINMAX)
-        scaled_gt_volume = cv2.normalize(scaled_gt_volume, scaled_gt_volume, 0, 1, cv2.NORM_MINMAX)
-        self.original = cv2.normalize(self.original, self.original, 0, 1, cv2.NORM_MINMAX)
-        self.data = scaled_side_volume
-        self.gt = scaled_gt_volume
+        self.original_gt = np.asarray(self.gt, dtype=np.float32)
+        if self.original.dtype == QUANTIZED_DTYPE:
+            self.original_range = (int(self.original.min()), int(self.original.max()))
+            self._cut_range = None
+        else:
+            self.original = np.asarray(self.original, dtype=np.float32)
+            self._cut_range = (float(self.original.min()), float(self.original.max()))  # to undo it, see refresh
+            self.original = cv2.normalize(self.original, self.original, 0, 1, cv2.NORM_MINMAX)
+            self.original_range = None
+        self.original_gt = cv2.normalize(self.original_gt, self.original_gt, 0, 1, cv2.NORM_MINMAX)
+        # the cuts are now original and original_gt
+        self.data = self.gt = None
+        self._scaled_slices.clear()
+
+    @property
+    def shape(self):
+        """
+        Returns:
+            ((int, int, int)): number of cuts, height and width of the slices at the display scale
+        """
+        n, h, w = self.original.shape
+        return n, int(h * self.scale), int(w * self.scale)
 
-    def __update(self, step_fn=None):
+    def _scaled_slice(self, pos, gt=False):
         """
-        Computes and updates the side volume.
+        slice of original (normalized in [0, 1]) or of original_gt at the display scale. the last
+        SCALED_SLICES slices are kept, keyed by position and scale
 
         Args:
-            scale (float): scale of side volume w.r.t. volume dimensions
+            pos (int): position
+            gt (bool): slice of original_gt
+
+        Returns:
+            (numpy.ndarray): float32 slice
+        """
+        key = (gt, pos, self.scale)
+        scaled = self._scaled_slices.get(key)
+        if scaled is None:
+            _, height, width = self.shape
+            if gt:
+                native = self.original_gt[pos]
+            elif self.original_range is not None:
+                native = self._normalize(self.original[pos], self.original_range)
+            else:
+                native = self.original[pos]
+            scaled = cv2.resize(native, (width, height), interpolation=cv2.INTER_AREA)
+            scaled.setflags(write=False)  # shared by the callers
+            self._scaled_slices[key] = scaled
+            while len(self._scaled_slices) > self.SCALED_SLICES:
+                self._scaled_slices.popitem(last=False)
+        self._scaled_slices.move_to_end(key)
+        return scaled
+
+    @staticmethod
+    def _normalize(data, value_range):
         """
-        self.data = self.arch_handler.line_slice(self.arch_handler.side_coords, step_fn=step_fn)
-        self.gt = np.zeros_like(self.data)
+        min-max normalization of uint16 images to [0, 1]
+
+        Args:
+            data (numpy.ndarray): images of a quantized side volume
+            value_range ((int, int)): min and max of the side volume
+
+        Returns:
+            (numpy.ndarray): float32 images
+        """
+        low, high = value_range
+        return np.divide(np.subtract(data, low, dtype=np.float32), max(high - low, 1), dtype=np.float32)
+
+    def _build_planes(self):
+        """Builds the planes of the cuts along side_coords"""
         self.planes = [None] * len(self.arch_handler.side_coords)
         for i, side_coord in enumerate(self.arch_handler.side_coords):
             self.planes[i] = Plane(self.arch_handler.Z, len(side_coord))
             self.planes[i].from_line(side_coord)
+
+    def __update(self, step_fn=None):
+        """
+        Computes and updates the side volume.
+
+        Args:
+            scale (float): scale of side volume w.r.t. volume dimensions
+        """
+        self.data = self.arch_handler.line_slice(self.arch_handler.side_coords, interp_fn=self.INTERP_FN,
+                                                 step_fn=step_fn, dequantize=False)
+        self.gt = np.zeros(self.data.shape, np.float32)
+        self.cut_coords = np.array(self.arch_handler.side_coords, dtype=np.float64)
+        self._build_planes()
         self._postprocess_data()
 
     def update(self):
         """Computes and updates the side volume."""
+        if self.lazy:
+            self._start_lazy()
+            return
         self.correct = self.messenger.progress_message(message="Computing side volume",
                                                        func=self.__update,
                                                        func_args={},
                                                        cancelable=False)
         self.messenger.loading_message("Saving views", self.save_)
 
+    def _start_lazy(self):
+        """
+        Prepares a lazy side volume: planes are built and original, original_gt are allocated, but no position
+        is cut. until finish is called the images are not min-max normalized as the ones of the whole volume,
+        their range is the one of the volume (original_range for a quantized jaw, [0, 1] otherwise), and the side
+        volume is not saved. the images on screen keep this range however many positions are cut
+        """
+        side_coords = self.arch_handler.side_coords
+        n, h, w = len(side_coords), self.arch_handler.Z, max([len(points) for points in side_coords])
+        quantized = self.arch_handler.quantized
+        with self._lock:
+            self._generation += 1
+            self._build_planes()
+            self.original = np.zeros((n, h, w), QUANTIZED_DTYPE if quantized else np.float32)
+            self.original_gt = np.zeros((n, h, w), np.float32)
+            self.original_range = (0, int(self.arch_handler.max_value)) if quantized else None
+            self._cut_range = None
+            self.cut_coords = np.array(side_coords, dtype=np.float64)
+            self.computed = np.array([plane is None for plane in self.planes])  # nothing to cut without a plane
+            self._scaled_slices.clear()
+        self.correct = True
+
+    def _cut_positions(self, positions):
+        """
+        Cuts some positions of the side volume
+
+        Args:
+            positions (list of int): positions to cut
+
+        Returns:
+            (numpy.ndarray, numpy.ndarray): images and gt images of the positions, None if the gt is empty
+        """
+        cuts = self.arch_handler.line_slice(self.cut_coords[positions], interp_fn=self.INTERP_FN, dequantize=False,
+                                            keep_operator=False)
+        return cuts.reshape((len(positions),) + self.original.shape[1:]), None
+
+    def _compute_positions(self, positions):
+        """Cuts the positions of a lazy side volume, must be called holding _lock"""
+        positions = [pos for pos in positions if not self.computed[pos]]
+        if not positions:
+            return
+        data, gt = self._cut_positions(positions)
+        self.original[positions] = data
+        if gt is not None:
+            self.original_gt[positions] = gt
+        self.computed[positions] = True
+
+    def _ensure(self, positions):
+        """
+        Cuts the positions of a lazy side volume that have not been cut yet
+
+        Args:
+            positions (list of int): positions needed
+        """
+        if self.computed is None:
+            return
+        with self._lock:
+            if self.computed is None:
+                return
+            self._compute_positions(positions)
+
+    def _prefetch_from(self, pos):
+        """
+        Cuts in background the PREFETCH_WINDOW annotatable positions that follow pos in the direction
+        of navigation. positions skipped by the annotation masks (see AnnotationMasks.skip) are not cut
+
+        Args:
+            pos (int): position on screen
+        """
+        if self.computed is None:
+            return
+        if self._last_pos is not None and pos != self._last_pos:
+            self._direction = 1 if pos > self._last_pos else -1
+        self._last_pos = pos
+        masks = self.arch_handler.annotation_masks
+        step = 1 if masks is None else masks.skip + 1
+        window = [p for p in range(pos + self._direction, len(self.computed) if self._direction > 0 else -1,
+                                   self._direction) if p % step == 0][:self.PREFETCH_WINDOW]
+        positions = [p for p in window if not self.computed[p]]
+        if not positions:
+            return
+        self._generation += 1
+        if self._prefetcher is None:
+            self._prefetcher = ThreadPoolExecutor(max_workers=1)
+        self._prefetcher.submit(self._prefetch, positions, self._generation)
+
+    def _prefetch(self, positions, generation):
+        """Cuts positions one at a time, stops when a newer prefetch (or a refresh) starts"""
+        try:
+            for pos in positions:
+                with self._lock:
+                    if generation != self._generation:
+                        return
+                    self._compute_positions([pos])
+        except Exception as e:
+            print("WARNING: side volume prefetch failed: {}".format(e))
+
+    def __complete(self, step_fn=None):
+        """
+        Cuts the positions of a lazy side volume that have not been cut yet and normalizes the images as the ones
+        of the whole volume (see _postprocess_data), the side volume is not lazy anymore
+
+        Returns:
+            (bool): the side volume has been completed by this call
+        """
+        with self._lock:
+            if self.computed is None:
+                return False
+            self._generation += 1  # the running prefetch stops
+            missing = np.flatnonzero(~self.computed)
+            for start in range(0, len(missing), self.PREFETCH_WINDOW):
+                step_fn is not None and step_fn(start, len(missing))
+                self._compute_positions(missing[start:start + self.PREFETCH_WINDOW].tolist())
+            self.data, self.gt = self.original, self.original_gt
+            self.computed = None
+            self._postprocess_data()
+        return True
+
+    def finish(self, progress=True):
+        """
+        Completes a lazy side volume as if update had computed it whole: the positions that have not been cut yet
+        are cut, the images are min-max normalized and the side volume is saved.
+        called when the annotation ends and by the exports (see get_original), never while browsing the positions
+
+        Args:
+            progress (bool): show the progress, False outside of the GUI thread
+        """
+        if self.computed is None:
+            return
+        if progress:
+            self.messenger.progress_message(message="Computing side volume",
+                                            func=self.__complete,
+                                            func_args={},
+                                            cancelable=False)
+            self.messenger.loading_message("Saving views", self.save_)
+        elif self.__complete():
+            self.save_()
+
+    def stop(self):
+        """Stops the background cuts of a lazy side volume, which is neither completed nor saved (see finish)"""
+        self._generation += 1
+        if self._prefetcher is not None:
+            self._prefetcher.shutdown(wait=False)
+            self._prefetcher = None
+
+    @staticmethod
+    def _match_cuts(old_coords, new_coords, tolerance):
+        """
+        matches the new cuts with the old ones by their position along the arch (the nearest center of a cut),
+        so that the cuts are realigned when some of them are added or removed at the ends of the arch
+
+        Args:
+            old_coords (numpy.ndarray): N x L x 2 coordinates the old cuts were made along
+            new_coords (numpy.ndarray): M x L x 2 coordinates of the new cuts
+            tolerance (float): max displacement of the points of a cut that can be reused
+
+        Returns:
+            (numpy.ndarray): for each new cut, the index of the old cut to reuse, -1 if it has to be cut
+        """
+        center = old_coords.shape[1] // 2
+        old_centers, new_centers = old_coords[:, center], new_coords[:, center]
+        distances = ((new_centers[:, np.newaxis] - old_centers[np.newaxis]) ** 2).sum(axis=-1)
+        nearest = np.argmin(distances, axis=1)
+        displacement = np.abs(new_coords - old_coords[nearest]).max(axis=(1, 2))
+        return np.where(displacement <= tolerance, nearest, -1)
+
+    def __refresh(self, step_fn=None):
+        """
+        Updates the side volume after an edit of the arch: the cuts that moved by more than REUSE_TOLERANCE
+        are cut again, the others are taken from the current original and gt arrays.
+        normalization and rescaling are applied to the whole volume as in __update.
+
+        Returns:
+            (int): number of cuts made
+        """
+        side_coords = np.asarray(self.arch_handler.side_coords, dtype=np.float64)
+        source = self._match_cuts(self.cut_coords, side_coords, self.REUSE_TOLERANCE)
+        reused, changed = source >= 0, np.flatnonzero(source < 0)
+
+        original = self.original
+        if self._cut_range is not None:  # values before the min-max normalization of a float side volume
+            low, high = self._cut_range
+            original = original * (high - low) + low
+        data = np.zeros((len(side_coords),) + self.original.shape[1:], self.original.dtype)
+        gt = np.zeros((len(side_coords),) + self.original_gt.shape[1:], self.original_gt.dtype)
+        data[reused], gt[reused] = original[source[reused]], self.original_gt[source[reused]]
+        if len(changed):
+            cuts = self.arch_handler.line_slice(side_coords[changed], interp_fn=self.INTERP_FN, step_fn=step_fn,
+                                                dequantize=False)
+            data[changed] = cuts.reshape((len(changed),) + data.shape[1:])
+
+        self.cut_coords = np.where(reused[:, np.newaxis, np.newaxis], self.cut_coords[np.maximum(source, 0)],
+                                   side_coords)
+        planes = []
+        for i, j in enumerate(source):
+            if j < 0:
+                planes.append(Plane(self.arch_handler.Z, side_coords.shape[1]))
+                planes[-1].from_line(self.arch_handler.side_coords[i])
+            else:
+                planes.append(self.planes[j])
+        self.planes = planes
+        self.data, self.gt = data, gt
+        self._postprocess_data()
+        return len(changed)
+
+    def __refresh_lazy(self):
+        """
+        refresh of a lazy side volume: the reused cuts keep their images, the others are marked as not cut
+        and are cut when they are asked for
+        """
+        side_coords = np.asarray(self.arch_handler.side_coords, dtype=np.float64)
+        with self._lock:
+            self._generation += 1
+            source = self._match_cuts(self.cut_coords, side_coords, self.REUSE_TOLERANCE)
+            reused = source >= 0
+            shape = (len(side_coords),) + self.original.shape[1:]
+            original, original_gt = np.zeros(shape, self.original.dtype), np.zeros(shape, np.float32)
+            computed = np.zeros(len(side_coords), bool)
+            original[reused], original_gt[reused] = self.original[source[reused]], self.original_gt[source[reused]]
+            computed[reused] = self.computed[source[reused]]
+            self.cut_coords = np.where(reused[:, np.newaxis, np.newaxis], self.cut_coords[np.maximum(source, 0)],
+                                       side_coords)
+            planes = []
+            for i, j in enumerate(source):
+                if j < 0:
+                    planes.append(Plane(self.arch_handler.Z, side_coords.shape[1]))
+                    planes[-1].from_line(self.arch_handler.side_coords[i])
+                else:
+                    planes.append(self.planes[j])
+            self.planes = planes
+            self.original, self.original_gt, self.computed = original, original_gt, computed
+            self._last_pos = None
+            self._scaled_slices.clear()
+        self.correct = True
+
+    def refresh(self):
+        """
+        Updates the side volume after a change of side_coords, cutting again only the cuts whose geometry
+        has changed. the whole volume is recomputed if the cuts have a different length, or if it is a float
+        side volume loaded without the range of its cuts (saved before CUT_RANGE_FILENAME)
+        """
+        if self.cut_coords is None or self.original is None \
+                or np.shape(self.arch_handler.side_coords)[1:] != self.cut_coords.shape[1:] \
+                or self.computed is None and self.original_range is None and self._cut_range is None:
+            self.update()
+            return
+        if self.computed is not None:
+            self.__refresh_lazy()
+            return
+        self.correct = self.messenger.progress_message(message="Updating side volume",
+                                                       func=self.__refresh,
+                                                       func_args={},
+                                                       cancelable=False)
+        self.messenger.loading_message("Saving views", self.save_)
+
     def get_slice(self, pos, show_network_prediction=False):
         """
         Returns a slice of side volume at position pos
@@ -180,42 +556,95 @@ class SideVolume():
         Returns:
             (numpy.ndarray): slice of side volume
         """
-        if self.data is None:
+        if self.original is None:
             return None
-        data_slice = self.data[pos]
-        gt_slice = self.gt[pos]*0.3
+        self._ensure([pos])
+        self._prefetch_from(pos)
+        data_slice = self._scaled_slice(pos)
         if show_network_prediction:
+            gt_slice = self._scaled_slice(pos, gt=True) * 0.3
             return np.dstack([data_slice + gt_slice, data_slice, data_slice])
         else:
             return data_slice
 
+    def get_gt_slice(self, pos):
+        """
+        Returns a slice of the gt side volume at position pos, at the display scale
+
+        Args:
+            pos (int): position
+
+        Returns:
+            (numpy.ndarray): slice of gt side volume
+        """
+        if self.original_gt is None:
+            return None
+        self._ensure([pos])
+        return self._scaled_slice(pos, gt=True)
+
+    def has_data(self, pos):
+        """
+        Args:
+            pos (int): position
+
+        Returns:
+            (bool): the image at position pos is not totally black
+        """
+        self._ensure([pos])
+        return bool(self.original[pos].any())
+
     def get(self):
         """
-        Returns side volume
+        Returns side volume at the original scale, see get_original for the normalized one
 
         Returns:
              (numpy.ndarray): side volume
         """
-        return self.data
+        self.finish(progress=False)
+        return self.original
+
+    def get_original(self):
+        """
+        Returns side volume at the original scale, normalized in [0, 1]
+
+        Returns:
+             (numpy.ndarray): side volume, None if it has not been computed
+        """
+        self.finish(progress=False)  # all the positions of a lazy side volume, normalized
+        if self.original is None or self.original_range is None:
+            return self.original
+        return self._normalize(self.original, self.original_range)
 
 
 class TiltedSideVolume(SideVolume):
     CANAL_SPLINES_FILENAME = "canals.json"
     SAVE_DIRNAME = "side_volume"
 
-    def __init__(self, arch_handler, scale):
-        """Class that manages a tilted planes side volume"""
+    def __init__(self, arch_handler, scale, lazy=False):
+        """Class that manages a tilted planes side volume, a saved one is loaded whole even if lazy"""
         self.messenger = Messenger()
         self.arch_handler = arch_handler
         self.scale = scale
         self.original = None
+        self.original_gt = None
         self.data = None
+        self.original_range = None
+        self.cut_coords = None
+        self._cut_range = None
+        self._scaled_slices = OrderedDict()
+        self.lazy = lazy
+        self.computed = None
+        self._lock = threading.Lock()
+        self._prefetcher = None
+        self._generation = 0
+        self._last_pos = None
+        self._direction = 1
         self.correct = True
         self.planes = [None] * len(arch_handler.side_coords)
         if self.is_there_data_to_load():
             self.try_load()
         else:
-            super().__init__(arch_handler, scale)
+            super().__init__(arch_handler, scale, lazy)
 
     def try_load(self):
         """Tries to load data and checks for consistency errors"""
@@ -223,14 +652,15 @@ class TiltedSideVolume(SideVolume):
             self.load_()
         except Exception as e:
             self.messenger.message("warning", title="Error", message=str(e))
-            super().__init__(self.arch_handler, self.scale)
+            super().__init__(self.arch_handler, self.scale, self.lazy)
 
     def is_there_data_to_load(self):
         base = os.path.dirname(self.arch_handler.dicomdir_path)
         dir = os.path.join(base, self.SAVE_DIRNAME)
         p = os.path.join(dir, self.PLANES_FILENAME)
+        dense = os.path.join(dir, self.DENSE_PLANES_FILENAME)
         cs = os.path.join(dir, self.CANAL_SPLINES_FILENAME)
-        return os.path.isfile(p) and os.path.isfile(cs) and super().is_there_data_to_load()
+        return (os.path.isfile(p) or os.path.isfile(dense)) and os.path.isfile(cs) and super().is_there_data_to_load()
 
     def _save_canal_splines(self):
         base = os.path.dirname(self.arch_handler.dicomdir_path)
@@ -269,33 +699,76 @@ class TiltedSideVolume(SideVolume):
         super().load_()
         self._load_canal_splines()
 
-    def _compute_on_spline(self, spline, step_fn=None, debug=False):
-        """Computes the tilted images on a give spline (left or right)"""
+    def _set_planes(self, spline, step_fn=None):
+        """
+        Builds the planes tilted along a given spline (left or right)
+
+        Returns:
+            (list of int): positions of the planes
+        """
         if spline is None:
-            return
+            return []
         p, start, end = spline.get_poly_spline()
         derivative = np.polyder(p, 1)
-        for x in range(self.data.shape[0]):
-            if x in range(int(start), int(end)):
-                step_fn is not None and step_fn(x, self.data.shape[0])
-                side_coord = self.arch_handler.side_coords[x]
-                plane = Plane(self.arch_handler.Z, len(side_coord))
-                plane.from_line(side_coord)
-                angle = -np.degrees(np.arctan(derivative(x)))
-                plane.tilt_z(angle, p(x))
-                volume_cut = self.arch_handler.plane_slice(plane)
-                gt_cut = self.arch_handler.plane_slice(plane, cut_gt=True)
-                debug and print("{}/{}".format(x, len(self.planes)), end='\r')
-                self.planes[x] = plane
-                self.data[x] = volume_cut
-                self.gt[x] = gt_cut
+        ids = [x for x in range(len(self.planes)) if x in range(int(start), int(end))]
+        if not ids:
+            return ids
+        step_fn is not None and step_fn(0, len(ids))
+        # all the planes are built and tilted at once, see Plane.tilt_planes
+        planes = Plane.from_lines(self.arch_handler.Z, np.asarray(self.arch_handler.side_coords)[ids])
+        angles = -np.degrees(np.arctan(derivative(np.array(ids))))
+        Plane.tilt_planes(planes, angles, p(np.array(ids)))
+        for x, plane in zip(ids, planes):
+            self.planes[x] = plane
+        step_fn is not None and step_fn(len(ids), len(ids))
+        return ids
+
+    def _build_planes(self):
+        self.planes = [None] * len(self.arch_handler.side_coords)
+        self._set_planes(self.arch_handler.L_canal_spline)
+        self._set_planes(self.arch_handler.R_canal_spline)
+
+    def _cut_positions(self, positions):
+        planes = [self.planes[pos] for pos in positions]
+        return self.arch_handler.plane_slices(planes, interp_fn=self.INTERP_FN, dequantize=False), \
+            self.arch_handler.plane_slices(planes, cut_gt=True)
+
+    def _compute_on_spline(self, spline, step_fn=None, debug=False):
+        """
+        Computes the tilted images on a give spline (left or right).
+        The planes are built first, then their image and gt cuts are computed in parallel (see Jaw.plane_slices)
+        """
+        if spline is None:
+            return
+        # progress: planes, image cuts and gt cuts
+        ids = self._set_planes(spline, step_fn=step_fn and (lambda done, n: step_fn(done, 3 * n)))
+        debug and print("{} planes".format(len(ids)))
+        if not ids:
+            return
+        total = 3 * len(ids)
+        planes = [self.planes[x] for x in ids]
+        volume_cuts = self.arch_handler.plane_slices(
+            planes, interp_fn=self.INTERP_FN, step_fn=step_fn and (lambda done, _: step_fn(len(ids) + done, total)),
+            dequantize=False)
+        gt_cuts = self.arch_handler.plane_slices(
+            planes, cut_gt=True, step_fn=step_fn and (lambda done, _: step_fn(2 * len(ids) + done, total)))
+        for i, x in enumerate(ids):
+            self.data[x] = volume_cuts[i]
+            self.gt[x] = gt_cuts[i]
 
     def update(self):
+        if self.lazy:
+            self._start_lazy()
+            return
         n = len(self.arch_handler.side_coords)
         h = self.arch_handler.Z
         w = max([len(points) for points in self.arch_handler.side_coords])
-        self.data = np.zeros((n, h, w))
-        self.gt = np.zeros((n, h, w))
+        if self.arch_handler.quantized:
+            self.data = np.zeros((n, h, w), QUANTIZED_DTYPE)
+            self.gt = np.zeros((n, h, w), np.float32)
+        else:
+            self.data = np.zeros((n, h, w), np.float32)
+            self.gt = np.zeros((n, h, w), np.float32)
         completed = self.messenger.progress_message(func=self._compute_on_spline,
                                                     func_args={'spline': self.arch_handler.L_canal_spline},
                                                     message="Computing tilted views (L)",
@@ -61,14 +61,14 @@ class AnnotationScreen(Screen):
 
     def initialize(self):
         def yes(self):
-            self.arch_handler.compute_side_volume(self.arch_handler.SIDE_VOLUME_SCALE, tilted=True)
+            self.arch_handler.compute_side_volume(self.arch_handler.SIDE_VOLUME_SCALE, tilted=True, lazy=True)
             if not self.arch_handler.side_volume.correct:
                 no(self)
             else:
                 self.arch_handler.history.add(TiltedPlanesAnnotationAction())
 
         def no(self):
-            self.arch_handler.compute_side_volume(self.arch_handler.SIDE_VOLUME_SCALE, tilted=False)
+            self.arch_handler.compute_side_volume(self.arch_handler.SIDE_VOLUME_SCALE, tilted=False, lazy=True)
             self.arch_handler.history.add(DefaultPlanesAnnotationAction())
 
         self.arch_handler.save_state()
@@ -139,6 +139,14 @@ class AnnotationScreen(Screen):
     def next_screen(self):
         pass
 
+    def remove(self):
+        # the lazy side volume is completed and saved before leaving the annotation
+        side_volume = self.arch_handler.side_volume
+        if side_volume is not None:
+            side_volume.finish()
+            side_volume.stop()
+        super().remove()
+
     def zoom_in_(self):
         self.sidevolume.zoom = min(self.sidevolume.zoom + 1, 8)
         self.show_()
@@ -57,8 +57,9 @@ class ArchSplineScreen(Screen):
         self.show_()
 
     def offset_changed_handler(self):
+        # the sliders move through all the offsets: their panorexes are computed in background
         self.arch_handler.offset_arch(arch_offset=self.panel.getArchValue(),
-                                      pano_offset=self.panel.getPanoOffsetValue())
+                                      pano_offset=self.panel.getPanoOffsetValue(), background=True)
         self.show_()
 
     def update_side_volume_handler(self):
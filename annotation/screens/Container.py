@@ -11,6 +11,8 @@ from annotation.screens.SliceSelectionScreen import SliceSelectionScreen
 from annotation.components.Dialog3DPlot import Dialog3DPlot
 from annotation.core.ArchHandler import ArchHandler
 
+PLOT_LEVEL = 1  # pyramid level of the previews of the 3D plots (downsampled by 2 ** PLOT_LEVEL), see Jaw.pyramid
+
 
 class Container(QtGui.QWidget):
     saved = QtCore.pyqtSignal()
@@ -64,18 +66,19 @@ class Container(QtGui.QWidget):
     def connect_to_menubar(self):
         # view
         self.mb.view_volume.connect(
-            lambda: self.show_Dialog3DPlot(self.arch_handler.volume, "Volume"))
+            lambda: self.show_Dialog3DPlot(self.arch_handler.get_volume, "Volume", preview=True))
 
         self.mb.view_gt_volume.connect(
             # lambda: self.show_Dialog3DPlot(self.arch_handler.gt_volume, "Ground truth"))
-            lambda: self.show_Dialog3DPlot(self.arch_handler.get_gt_volume(labels=[l.CONTOUR, l.INSIDE]),
-                                           "Ground truth"))
+            lambda: self.show_Dialog3DPlot(
+                lambda level=0: self.arch_handler.get_gt_volume(labels=[l.CONTOUR, l.INSIDE], level=level),
+                "Ground truth", preview=True))
 
         self.mb.view_gt_volume_delaunay.connect(
             lambda: self.show_Dialog3DPlot(self.arch_handler.gt_delaunay, "Ground truth with Delaunay smoothing"))
 
         self.mb.view_volume_with_gt.connect(
-            lambda: self.show_Dialog3DPlot(self.arch_handler.get_jaw_with_gt(), "Volume + Ground truth"))
+            lambda: self.show_Dialog3DPlot(self.arch_handler.get_jaw_with_gt, "Volume + Ground truth", preview=True))
 
         self.mb.view_volume_with_delaunay.connect(
             lambda: self.show_Dialog3DPlot(self.arch_handler.get_jaw_with_delaunay(),
@@ -121,11 +124,20 @@ class Container(QtGui.QWidget):
     # ADD / REMOVE SCREEN #
     #######################
 
-    def show_Dialog3DPlot(self, volume, title):
+    def show_Dialog3DPlot(self, volume, title, preview=False):
+        """
+        Args:
+            volume (numpy.ndarray or function): volume to plot. with preview, a function of the pyramid level
+                that returns the volume (see Jaw.pyramid)
+            title (str): window header
+            preview (bool): plot the volume at PLOT_LEVEL first, then at full resolution when the dialog is idle
+        """
+        get_volume = volume if preview else None
+        volume = get_volume(level=PLOT_LEVEL) if preview else volume
         if volume is None or not volume.any():
             self.messenger.message(kind="information", title="Plot", message="No volume to show")
         dialog = Dialog3DPlot(self, title)
-        dialog.show(volume)
+        dialog.show(volume, spacing=2 ** PLOT_LEVEL if preview else 1, refine_fn=get_volume)
 
     def clear(self):
         self.mb.enable_save_load(False)
@@ -154,9 +166,9 @@ class Container(QtGui.QWidget):
                 no(self)
 
         if self.arch_handler is not None:
-            self.arch_handler.__init__(dicomdir_path)
+            self.arch_handler.__init__(dicomdir_path, use_cache=True)
         else:
-            self.arch_handler = ArchHandler(dicomdir_path)
+            self.arch_handler = ArchHandler(dicomdir_path, use_cache=True)
             self.connect_to_menubar()
 
         self.clear()
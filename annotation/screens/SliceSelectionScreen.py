@@ -15,7 +15,7 @@ class SliceSelectionScreen(Screen):
 
         # slider
         self.slider = ControlPanel.create_slider("Slice", orientation=QtCore.Qt.Vertical,
-                                                 max_h_w=100, valueChanged=self.show_, inverted=True)
+                                                 max_h_w=100, valueChanged=self.scrub, inverted=True)
         self.layout.addWidget(self.slider, 0, 1)
 
         # arch view
@@ -55,6 +55,10 @@ class SliceSelectionScreen(Screen):
     def show_(self):
         self.archview.show_(slice_idx=self.slider.value(), show_arch=self.arch_line.isChecked())
 
+    def scrub(self):
+        """shows a preview of the slice while the slider moves"""
+        self.archview.show_(slice_idx=self.slider.value(), show_arch=self.arch_line.isChecked(), preview=True)
+
     def connect_signals(self):
         self.slice_selected.connect(self.next_screen)
 
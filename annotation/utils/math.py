@@ -96,6 +96,26 @@ def apply_offset_to_point(point, offset, p):
         return (x - offset * cos, y + offset * sin)
 
 
+def get_offset_directions(coords, p):
+    """
+    Computes, for each point of a curve, the unit direction along which apply_offset_to_point displaces it.
+
+    Args:
+        coords (numpy.ndarray): N x 2 xy coordinates of the points
+        p (np.poly1d): polynomial approximation of the curve
+
+    Returns:
+        (numpy.ndarray): N x 2 directions, the offsetted points are coords + offset * directions
+    """
+    x = coords[:, 0]
+    delta = 0.3
+    alpha = (p(x + delta / 2) - p(x - delta / 2)) / delta  # first derivative
+    alpha = -1 / alpha  # perpendicular coeff
+    cos = np.sqrt(1 / (alpha ** 2 + 1))
+    sin = np.sqrt(alpha ** 2 / (alpha ** 2 + 1))
+    return np.stack([np.where(alpha > 0, cos, -cos), sin], axis=1)
+
+
 def apply_offset_to_arch(coords, offset, p):
     """
     Computes the offsetted position of and arch.
@@ -107,10 +127,9 @@ def apply_offset_to_arch(coords, offset, p):
          offset (int): how much to displace the arch from the original position
          p (np.poly1d): polynomial approximation of the curve
     """
-    new_arch = []
-    for point in coords:
-        new_arch.append(apply_offset_to_point(point, offset, p))
-    return new_arch
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    new_arch = coords + offset * get_offset_directions(coords, p)
+    return [tuple(point) for point in new_arch]
 
 
 def get_square_around_point(center, im_shape, l=20):
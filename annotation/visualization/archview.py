@@ -8,6 +8,9 @@ from annotation.utils.math import clip_range
 from annotation.actions.Action import ArchCpChangedAction, ArchCpRemovedAction, ArchCpAddedAction
 from annotation.core.ArchHandler import ArchHandler
 
+PREVIEW_LEVEL = 1  # pyramid level of the slices shown while scrubbing, see Jaw.pyramid
+REFINE_DELAY = 150  # ms without changes before a preview is replaced by the full resolution slice
+
 
 class ArchView(Canvas):
     def __init__(self, parent, from_annotations=False):
@@ -16,12 +19,20 @@ class ArchView(Canvas):
         self.slice_idx = 0
         self.show_arch = True
         self.arch_handler.from_annotations = from_annotations
+        self.refine_timer = QtCore.QTimer(self)
+        self.refine_timer.setSingleShot(True)
+        self.refine_timer.timeout.connect(self.refine)
 
-    def set_img(self):
-        self.img = self.arch_handler.volume[self.slice_idx]
+    def set_img(self, level=0):
+        self.img = self.arch_handler.get_slice(self.slice_idx, level=level)
         self.pixmap = numpy2pixmap(self.img)
         self.adjust_size()
 
+    def refine(self):
+        """replaces the preview with the full resolution slice"""
+        self.set_img()
+        self.update()
+
     def draw(self, painter):
         self.draw_background(painter)
         if self.show_arch and self.arch_handler.from_annotations and self.arch_handler.generated is None:
@@ -35,10 +46,19 @@ class ArchView(Canvas):
             p, start, end = self.arch_handler.arch_detections.get(self.slice_idx)
             self.draw_poly_approx(painter, p, start, end, col.ARCH_SPLINE)
 
-    def show_(self, slice_idx=0, show_arch=True):
+    def show_(self, slice_idx=0, show_arch=True, preview=False):
+        """
+        Args:
+            slice_idx (int): axial slice to show
+            show_arch (bool): draw the arch detected on the slice
+            preview (bool): show the slice at PREVIEW_LEVEL, refined when it has not changed for REFINE_DELAY ms
+        """
         self.slice_idx = slice_idx
         self.show_arch = show_arch
-        self.set_img()
+        self.refine_timer.stop()
+        self.set_img(PREVIEW_LEVEL if preview else 0)
+        if preview:
+            self.refine_timer.start(REFINE_DELAY)
         self.update()
 
 
@@ -55,7 +75,7 @@ class SplineArchView(SplineCanvas):
 
     def set_img(self):
         self.selected_slice = self.arch_handler.selected_slice
-        self.img = self.arch_handler.volume[self.selected_slice]
+        self.img = self.arch_handler.get_slice(self.selected_slice)
         self.pixmap = numpy2pixmap(self.img)
         self.adjust_size()
 
@@ -5,6 +5,8 @@ from multiprocessing import cpu_count
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 from annotation.core.ArchHandler import ArchHandler
+from annotation.core.SideVolume import SideVolume
+import interpolation
 import sys
 import warnings
 
@@ -25,6 +27,8 @@ def parse_args():
                         help="Force re-computation even if gt_volume.npy already exists")
     parser.add_argument("-w", dest='workers', type=int, required=False, default=1,
                         help="Amount of workers for concurrent extraction")
+    parser.add_argument("-k", dest='kernel', choices=list(interpolation.KERNELS), required=False,
+                        default=SideVolume.INTERP_FN, help="Interpolation kernel of the exported side volume images")
     return parser.parse_args()
 
 
@@ -33,7 +37,8 @@ def delete_file(file_path):
         os.remove(file_path)
 
 
-def export_gt_volume_npy(dicomdir):
+def export_gt_volume_npy(dicomdir, kernel=SideVolume.INTERP_FN):
+    SideVolume.INTERP_FN = kernel  # also of the tilted side volume
     ah = ArchHandler(dicomdir)
     ah.__init__(dicomdir)
     ah.load_state()
@@ -68,7 +73,7 @@ if __name__ == '__main__':
     t_start = time.time()
 
     with ProcessPoolExecutor(max_workers=args.workers) as executor:
-        futures = [executor.submit(export_gt_volume_npy, dicomdir) for dicomdir in dicomdirs]
+        futures = [executor.submit(export_gt_volume_npy, dicomdir, args.kernel) for dicomdir in dicomdirs]
 
         kwargs = {
             'total': len(futures),
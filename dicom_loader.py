@@ -1,12 +1,24 @@
 import pydicom
 from pydicom.filereader import read_dicomdir
+from concurrent.futures import ThreadPoolExecutor
 import re
 import os
 import numpy as np
 
+LOADING_WORKERS = min(8, os.cpu_count() or 1)  # pixel decoding is mostly GIL-free, a few threads are enough
+DEFER_SIZE = '4 KB'  # elements bigger than this are left on disk until accessed
 
-def dicom_from_dicomdir(dicom_dir):
 
+def series_from_dicomdir(dicom_dir):
+    """
+    find the series to load inside a dicomdir
+
+    Args:
+        dicom_dir (pydicom.dicomdir.DicomDir): the dicomdir
+
+    Returns:
+        (str, list of str): directory of the dataset and filenames of the images of the series
+    """
     dataset_path = os.path.dirname(os.path.abspath(dicom_dir.filename))  # abs path without the final dicomdir
     for patient_record in dicom_dir.patient_records:
         studies = patient_record.children
@@ -18,15 +30,173 @@ def dicom_from_dicomdir(dicom_dir):
                 our_version_match = bool(re.match("\w*30{1,2}1[0-9]{2,}\.dcm", image_records[0].ReferencedFileID))
                 nth_version_match = bool(re.match("\d{4}", image_records[0].ReferencedFileID))
                 if our_version_match or nth_version_match:
-
                     image_filenames = [
                         image_rec.ReferencedFileID for image_rec in image_records
                     ]
-                    datasets = [pydicom.dcmread(os.path.join(dataset_path, basename)) for basename in image_filenames]
-                    # raw data stacked together
-                    volume = np.stack([images.pixel_array for images in datasets])
-                    if len(volume.shape) > 3:
-                        volume = volume.squeeze()
-                    return image_filenames, datasets, volume
+                    return dataset_path, image_filenames
             raise Exception('No valid series found, abort!')
-    raise Exception('no valid patient or study found in the path, abort!')
\ No newline at end of file
+    raise Exception('no valid patient or study found in the path, abort!')
+
+
+def dicom_from_dicomdir(dicom_dir, parallel=True, workers=None):
+    """
+    read and decode the series of a dicomdir
+
+    Args:
+        dicom_dir (pydicom.dicomdir.DicomDir): the dicomdir
+        parallel (bool): decode the slices concurrently, each one straight into a preallocated volume.
+            if False the slices are decoded one at a time and stacked (slower, kept for comparison)
+        workers (int): size of the thread pool, LOADING_WORKERS if None
+
+    Returns:
+        (list of str, list of pydicom.dataset.FileDataset, numpy array): filenames, datasets and raw (Z, H, W) volume
+    """
+    dataset_path, image_filenames = series_from_dicomdir(dicom_dir)
+    paths = [os.path.join(dataset_path, basename) for basename in image_filenames]
+
+    if not parallel:
+        datasets = [pydicom.dcmread(path) for path in paths]
+        # raw data stacked together
+        volume = np.stack([images.pixel_array for images in datasets])
+        if len(volume.shape) > 3:
+            volume = volume.squeeze()
+        return image_filenames, datasets, volume
+
+    # the first slice tells us shape and dtype of the volume
+    first = pydicom.dcmread(paths[0])
+    first_pixels = first.pixel_array
+    if first_pixels.ndim > 2:
+        first_pixels = first_pixels.squeeze()
+    volume = np.empty((len(paths),) + first_pixels.shape, dtype=first_pixels.dtype)
+    volume[0] = first_pixels
+    datasets = [first] + [None] * (len(paths) - 1)
+
+    def decode(i):
+        ds = pydicom.dcmread(paths[i])
+        volume[i] = ds.pixel_array.reshape(volume.shape[1:])
+        datasets[i] = ds
+
+    with ThreadPoolExecutor(max_workers=workers or LOADING_WORKERS) as executor:
+        # list() re-raises the first decoding error, if any
+        list(executor.map(decode, range(1, len(paths))))
+    return image_filenames, datasets, volume
+
+
+def dicom_headers_from_dicomdir(dicom_dir, workers=None):
+    """
+    read the datasets of the series without decoding them.
+    big elements such as PixelData are deferred: they are read from disk only when accessed (e.g. by save_as)
+
+    Args:
+        dicom_dir (pydicom.dicomdir.DicomDir): the dicomdir
+        workers (int): size of the thread pool, LOADING_WORKERS if None
+
+    Returns:
+        (list of str, list of pydicom.dataset.FileDataset): filenames and datasets
+    """
+    dataset_path, image_filenames = series_from_dicomdir(dicom_dir)
+
+    def read(basename):
+        return pydicom.dcmread(os.path.join(dataset_path, basename), defer_size=DEFER_SIZE)
+
+    with ThreadPoolExecutor(max_workers=workers or LOADING_WORKERS) as executor:
+        datasets = list(executor.map(read, image_filenames))
+    return image_filenames, datasets
+
+
+def volume_from_datasets(datasets, workers=None):
+    """
+    decode the pixel data of already read datasets into a preallocated volume.
+    datasets read with deferred elements load their pixel data from disk here
+
+    Args:
+        datasets (list of pydicom.dataset.FileDataset): the series, one dataset per slice
+        workers (int): size of the thread pool, LOADING_WORKERS if None
+
+    Returns:
+        (numpy array): raw (Z, H, W) volume, slices in the order of datasets
+    """
+    first_pixels = datasets[0].pixel_array
+    if first_pixels.ndim > 2:
+        first_pixels = first_pixels.squeeze()
+    volume = np.empty((len(datasets),) + first_pixels.shape, dtype=first_pixels.dtype)
+    volume[0] = first_pixels
+
+    def decode(i):
+        volume[i] = datasets[i].pixel_array.reshape(volume.shape[1:])
+
+    with ThreadPoolExecutor(max_workers=workers or LOADING_WORKERS) as executor:
+        list(executor.map(decode, range(1, len(datasets))))
+    return volume
+
+
+def overlays_from_datasets(datasets, overlay_addr, shape, slab_size=16):
+    """
+    decode one overlay plane of a whole series at once: the raw OverlayData bytes of each slice are
+    copied into a single buffer whose bits are unpacked with numpy, a few slices at a time.
+    slices without the overlay are left empty, overlays of another size are padded or cropped to shape.
+
+    Args:
+        datasets (list of pydicom.dataset.FileDataset): the series, one dataset per slice
+        overlay_addr (int): group of the overlay plane (0x6000 - 0x601E)
+        shape (tuple of int): (H, W) of the slices
+        slab_size (int): slices unpacked at a time
+
+    Returns:
+        (numpy array): uint8 (Z, H, W) volume of 0-1 values, None if no slice has this overlay
+    """
+    h, w = shape
+    n_bytes = (h * w + 7) // 8
+    packed = np.zeros((len(datasets), n_bytes), dtype=np.uint8)
+    volume = np.zeros((len(datasets), h, w), dtype=np.uint8)
+    found = False
+    for i, ds in enumerate(datasets):
+        data = ds.get((overlay_addr, 0x3000))
+        if data is None:
+            continue
+        found = True
+        rows, cols = ds.get((overlay_addr, 0x0010)), ds.get((overlay_addr, 0x0011))
+        bit_position = ds.get((overlay_addr, 0x0102))
+        if (rows is not None and rows.value != h) or (cols is not None and cols.value != w) \
+                or (bit_position is not None and bit_position.value != 0):
+            # unusual layout, let pydicom handle it
+            overlay = ds.overlay_array(overlay_addr)
+            if overlay.shape != (h, w):
+                print("WARNING: overlay {:#06x} of slice {} is {}x{} instead of {}x{}, it is padded or cropped".format(
+                    overlay_addr, i, *overlay.shape, h, w))
+                overlay = overlay[:h, :w]
+            volume[i, :overlay.shape[0], :overlay.shape[1]] = overlay
+            continue
+        raw = np.frombuffer(data.value, dtype=np.uint8)[:n_bytes]
+        packed[i, :len(raw)] = raw
+    if not found:
+        return None
+    for z in range(0, len(datasets), slab_size):
+        bits = np.unpackbits(packed[z:z + slab_size], axis=1, count=h * w, bitorder='little')
+        # slices decoded by pydicom have an empty packed row, or-ing keeps them
+        volume[z:z + slab_size] |= bits.reshape(-1, h, w)
+    return volume
+
+
+def save_datasets(datasets, paths, workers=None):
+    """
+    write datasets concurrently. each file is written to a temporary file next to its destination
+    and then renamed, so a failed export never leaves a truncated file behind
+
+    Args:
+        datasets (list of pydicom.dataset.FileDataset): datasets to write
+        paths (list of str): destination of each dataset
+        workers (int): size of the thread pool, LOADING_WORKERS if None
+    """
+    def save(dataset, path):
+        tmp_path = path + '.tmp'
+        try:
+            dataset.save_as(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+
+    with ThreadPoolExecutor(max_workers=workers or LOADING_WORKERS) as executor:
+        # list() re-raises the first writing error, if any
+        list(executor.map(save, datasets, paths))
@@ -0,0 +1,186 @@
+"""
+interpolation kernels shared by the cuts of Jaw and by ResamplingOperator.
+
+every kernel is separable and batched: for an array of coordinates along one axis it gives the first voxel
+of its support and the weights of the support voxels. sample_columns and sample_points combine the axes,
+so the same kernel interpolates z columns (side views, panorex) or single voxels (tilted planes).
+indices outside the volume are clamped to the border voxels.
+"""
+import numpy as np
+from scipy import ndimage
+
+from ColumnStore import ColumnStore
+
+
+class Kernel:
+
+    def __init__(self, name, taps, weights_fn, prefilter=None):
+        """
+        Args:
+            name (str): name of the kernel in the registry
+            taps (int): voxels of the support along each axis
+            weights_fn (function): t (float numpy array) -> taps weights with the shape of t, t is the fractional
+                part of the coordinates and the support starts (taps - 1) // 2 voxels before their floor
+            prefilter (function): (volume, axes) -> coefficient volume the kernel is applied to along axes,
+                None to read the volume
+        """
+        self.name = name
+        self.taps = taps
+        self.weights_fn = weights_fn
+        self.prefilter = prefilter
+
+    def support(self, coords, dtype=np.float64):
+        """
+        Args:
+            coords (float numpy array): coordinates along one axis
+            dtype (numpy.dtype): type of the weights
+
+        Returns:
+            (int numpy array, list of numpy array): first voxel of the support of each coordinate,
+                weights of the taps voxels from there
+        """
+        first = np.floor(coords)
+        t = (coords - first).astype(dtype)
+        first = first.astype(np.intp) - (self.taps - 1) // 2
+        return first, [np.asarray(w, dtype=dtype) for w in self.weights_fn(t)]
+
+
+KERNELS = {}
+
+# names of the interpolation methods of Jaw, still accepted by line_slice, plane_slice and create_panorex
+ALIASES = {
+    'bilinear_interpolation': 'linear',
+    'trilinear_interpolation': 'linear',
+    'bicubic_interpolation': 'catmull-rom',
+    'bicubic_interpolation_3d': 'catmull-rom',
+}
+
+
+def register_kernel(kernel):
+    """
+    Args:
+        kernel (Kernel): kernel to make available by name
+    """
+    KERNELS[kernel.name] = kernel
+
+
+def get_kernel(kernel):
+    """
+    Args:
+        kernel (str or Kernel): name of a registered kernel (or of a Jaw interpolation method), or the kernel
+
+    Returns:
+        (Kernel): the kernel
+    """
+    if isinstance(kernel, Kernel):
+        return kernel
+    name = ALIASES.get(kernel, kernel)
+    if name not in KERNELS:
+        raise ValueError("unknown interpolation kernel {}, expected one of {}".format(kernel, list(KERNELS)))
+    return KERNELS[name]
+
+
+def bspline_prefilter(volume, axes=(0, 1, 2)):
+    """
+    coefficients of the cubic B-spline interpolating volume, with the borders replicated as the sampling does
+
+    Args:
+        volume (numpy array): (Z, H, W) volume
+        axes (tuple of int): interpolated axes, (1, 2) for sample_columns and (0, 1, 2) for sample_points
+
+    Returns:
+        (float32 numpy array): coefficient volume
+    """
+    coefficients = np.array(volume, dtype=np.float32)
+    for axis in axes:
+        ndimage.spline_filter1d(coefficients, order=3, axis=axis, output=coefficients, mode='nearest')
+    return coefficients
+
+
+register_kernel(Kernel('nearest', 1, lambda t: [np.ones_like(t)]))
+register_kernel(Kernel('linear', 2, lambda t: [1 - t, t]))
+# same weights as Jaw.cubic_interpolation, see https://www.paulinternet.nl/?page=bicubic
+register_kernel(Kernel('catmull-rom', 4, lambda t: [
+    0.5 * t * (-1 + t * (2 - t)),
+    1 + t * t * (-2.5 + 1.5 * t),
+    0.5 * t * (1 + t * (4 - 3 * t)),
+    0.5 * t * t * (t - 1),
+]))
+register_kernel(Kernel('bspline', 4, lambda t: [
+    (1 - t) ** 3 / 6,
+    (4 + t * t * (3 * t - 6)) / 6,
+    (1 + 3 * t * (1 + t * (1 - t))) / 6,
+    t ** 3 / 6,
+], prefilter=bspline_prefilter))
+
+
+def tap_indices(kernel, coords, size, dtype=np.float64):
+    """
+    Args:
+        kernel (Kernel): interpolation kernel
+        coords (float numpy array): coordinates along an axis of length size
+        size (int): length of the axis
+        dtype (numpy.dtype): type of the weights
+
+    Returns:
+        (list of (int numpy array, numpy array)): index (clamped to the axis) and weight of each tap
+    """
+    first, weights = kernel.support(coords, dtype)
+    return [(np.clip(first + i, 0, size - 1), w) for i, w in enumerate(weights)]
+
+
+def sample_columns(volume, x, y, kernel='linear'):
+    """
+    interpolation of many z columns at once
+
+    Args:
+        volume (numpy array, memmap, ChunkedVolume or ColumnStore): (Z, H, W) volume, the coefficients
+            along y and x for a kernel with a prefilter
+        x (float numpy array): x coordinates of the columns
+        y (float numpy array): y coordinates of the columns
+        kernel (str or Kernel): interpolation kernel
+
+    Returns:
+        (numpy array): Z x N interpolated columns, float32 (the values of volume for nearest)
+    """
+    kernel = get_kernel(kernel)
+    Z, H, W = volume.shape
+    xs = tap_indices(kernel, np.asarray(x, dtype=np.float64), W, np.float32)
+    ys = tap_indices(kernel, np.asarray(y, dtype=np.float64), H, np.float32)
+    gather = (lambda yi, xi: volume.gather(yi, xi).T) if isinstance(volume, ColumnStore) \
+        else (lambda yi, xi: volume[:, yi, xi])
+    if kernel.taps == 1:
+        return gather(ys[0][0], xs[0][0])
+    columns = np.zeros((Z, len(xs[0][0])), np.float32)
+    for xi, wx in xs:
+        for yi, wy in ys:
+            columns += gather(yi, xi) * (wx * wy)
+    return columns
+
+
+def sample_points(volume, z, y, x, kernel='linear'):
+    """
+    interpolation of many voxels at once
+
+    Args:
+        volume (numpy array, memmap, ChunkedVolume or ColumnStore): (Z, H, W) volume, the coefficients
+            for a kernel with a prefilter
+        z, y, x (float numpy arrays): coordinates of the points, all with the same shape
+        kernel (str or Kernel): interpolation kernel
+
+    Returns:
+        (numpy array): interpolated values with the shape of the coordinates, float64 (the values of volume
+            for nearest)
+    """
+    kernel = get_kernel(kernel)
+    shape = np.shape(x)
+    z, y, x = (np.asarray(c, dtype=np.float64).ravel() for c in (z, y, x))
+    axes = [tap_indices(kernel, c, size) for c, size in zip((z, y, x), volume.shape)]
+    if kernel.taps == 1:
+        return volume[axes[0][0][0], axes[1][0][0], axes[2][0][0]].reshape(shape)
+    values = np.zeros(len(x))
+    for zi, wz in axes[0]:
+        for yi, wy in axes[1]:
+            for xi, wx in axes[2]:
+                values += volume[zi, yi, xi] * (wz * wy * wx)
+    return values.reshape(shape)
@@ -0,0 +1,41 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+
+RESAMPLING_WORKERS = os.cpu_count() or 1  # gathers and sparse products release the GIL
+
+
+def run_chunks(fn, n, chunk_size, workers=None, step_fn=None):
+    """
+    resampling executor: split range(n) (cuts or planes) in chunks and process them on a thread pool.
+    fn(start, stop) must write its results into the region of a preallocated output that belongs to
+    [start, stop), so that the chunks never overlap. step_fn is called only from the calling thread,
+    as the chunks complete.
+
+    Args:
+        fn (function): (start, stop) -> None, processes a chunk
+        n (int): number of items
+        chunk_size (int): items processed by a task
+        workers (int): size of the thread pool, RESAMPLING_WORKERS if None, 1 to process the chunks in order
+            on the calling thread
+        step_fn (function): called with (done, total) items to report the progress
+    """
+    chunks = [(start, min(start + chunk_size, n)) for start in range(0, n, max(1, chunk_size))]
+    workers = min(workers or RESAMPLING_WORKERS, len(chunks))
+    if workers <= 1:
+        for start, stop in chunks:
+            step_fn is not None and step_fn(start, n)
+            fn(start, stop)
+        return
+
+    done = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fn, start, stop): stop - start for start, stop in chunks}
+        try:
+            for future in as_completed(futures):
+                future.result()
+                done += futures[future]
+                step_fn is not None and step_fn(done, n)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
@@ -288,3 +288,140 @@ def angle_from_centroids(pred_0, pred_1, plane_0, plane_1):
         return z_angle, x_angle
     else:
         return 0, 0  # cant compute centroids from black masks
+
+
+def integer_histogram(volume, slab_size=16):
+    """
+    histogram of an integer volume with one bin per representable value, built a few slices at a time
+    so that memory mapped volumes are never loaded as a whole
+    Args:
+        volume (numpy array): 8 or 16 bit integer volume
+        slab_size (int): slices counted at a time
+
+    Returns:
+        hist (numpy array): number of occurrences of each value
+        offset (int): value of the first bin
+    """
+    if volume.dtype.kind not in 'ui' or volume.dtype.itemsize > 2:
+        raise Exception("integer_histogram: only 8 and 16 bit integer volumes are supported")
+    offset = int(np.iinfo(volume.dtype).min)
+    n_bins = int(np.iinfo(volume.dtype).max) - offset + 1
+    hist = np.zeros(n_bins, dtype=np.int64)
+    for z in range(0, volume.shape[0], slab_size):
+        slab = np.asarray(volume[z:z + slab_size]).ravel()
+        if offset:
+            slab = slab.astype(np.int32) - offset
+        hist += np.bincount(slab, minlength=n_bins)
+    return hist, offset
+
+
+def histogram_quantiles(hist, offset, quantiles):
+    """
+    quantiles of the data counted in an histogram, same results of np.quantile with the default linear method
+    Args:
+        hist (numpy array): number of occurrences of each value, see integer_histogram
+        offset (int): value of the first bin
+        quantiles (list of float): quantiles to compute, in [0, 1]
+
+    Returns:
+        (numpy array): float64 quantiles
+    """
+    cumsum = np.cumsum(hist)
+    n = cumsum[-1]
+    virtual = (n - 1) * np.asarray(quantiles, dtype=np.float64)
+    previous = np.floor(virtual)
+    gamma = virtual - previous
+    previous = previous.astype(np.int64)
+    following = np.minimum(previous + 1, n - 1)
+    # the k-th element of the sorted data falls in the first bin whose cumulative count exceeds k
+    a = (np.searchsorted(cumsum, previous, side='right') + offset).astype(np.float64)
+    b = (np.searchsorted(cumsum, following, side='right') + offset).astype(np.float64)
+    # same lerp of np.quantile, so that values truncated to integers match as well
+    diff = b - a
+    return np.where(gamma >= 0.5, b - diff * (1 - gamma), a + diff * gamma)
+
+
+def _downsample(volume, reduce_fn, dtype, slab_size):
+    """
+    2x downsampling along each axis, reduce_fn gets the d x 2 x h x 2 x w x 2 blocks of a slab.
+    odd sizes are padded by repeating the last slice, row or column
+    """
+    Z, H, W = volume.shape
+    out = np.empty(((Z + 1) // 2, (H + 1) // 2, (W + 1) // 2), dtype=dtype)
+    slab_size += slab_size % 2
+    for z in range(0, Z, slab_size):
+        slab = np.asarray(volume[z:z + slab_size])
+        pad = [(0, n % 2) for n in slab.shape]
+        if any(after for _, after in pad):
+            slab = np.pad(slab, pad, mode='edge')
+        d, h, w = (n // 2 for n in slab.shape)
+        out[z // 2:z // 2 + d] = reduce_fn(slab.reshape(d, 2, h, 2, w, 2))
+    return out
+
+
+def downsample_mean(volume, slab_size=16):
+    """
+    2x downsampling of a volume along each axis, each voxel is the mean of a 2x2x2 block.
+    built a few slices at a time so that memory mapped and chunked volumes are never loaded as a whole
+    Args:
+        volume (numpy array, memmap or ChunkedVolume): (Z, H, W) volume
+        slab_size (int): slices read at a time
+
+    Returns:
+        (numpy array): (Z+1)//2 x (H+1)//2 x (W+1)//2 volume, integer volumes keep their type (rounded means)
+    """
+    if volume.dtype.kind in 'ui':
+        return _downsample(volume, lambda b: np.rint(b.mean(axis=(1, 3, 5), dtype=np.float32)),
+                            volume.dtype, slab_size)
+    return _downsample(volume, lambda b: b.mean(axis=(1, 3, 5), dtype=np.float32), np.float32, slab_size)
+
+
+def downsample_labels(volume, priority=None, slab_size=16):
+    """
+    2x downsampling of a label volume along each axis, each voxel takes the label of highest priority
+    of its 2x2x2 block, so that labels are never mixed and thin structures (the canal) are not lost
+    Args:
+        volume (numpy array or memmap): (Z, H, W) integer volume of labels
+        priority (list of int): labels from the lowest to the highest priority, None for the max of the values
+            (binary volumes). labels missing from the list have the lowest priority
+        slab_size (int): slices read at a time
+
+    Returns:
+        (numpy array): (Z+1)//2 x (H+1)//2 x (W+1)//2 volume of labels, same type of volume
+    """
+    if priority is None:
+        return _downsample(volume, lambda b: b.max(axis=(1, 3, 5)), volume.dtype, slab_size)
+    rank = np.zeros(max(priority) + 1, dtype=np.uint8)
+    rank[priority] = np.arange(1, len(priority) + 1)
+    labels = np.asarray([priority[0]] + list(priority), dtype=volume.dtype)
+    return _downsample(
+        volume,
+        lambda b: labels[np.take(rank, b.astype(np.intp), mode='clip').max(axis=(1, 3, 5))],
+        volume.dtype, slab_size)
+
+
+def upsample_axis(data, size, axis, scale, nearest=False):
+    """
+    back to the full resolution along one axis of data downsampled by scale, see downsample_mean.
+    the voxel centers of the two resolutions are aligned
+    Args:
+        data (numpy array): downsampled data
+        size (int): length of the axis at the full resolution
+        axis (int): axis to upsample
+        scale (int): downsampling factor of data
+        nearest (bool): nearest neighbour (labels), linear interpolation otherwise
+
+    Returns:
+        (numpy array): data with size elements along axis, float32 for the linear interpolation
+    """
+    n = data.shape[axis]
+    coords = np.clip((np.arange(size) + 0.5) / scale - 0.5, 0, n - 1)
+    if nearest:
+        return np.take(data, np.minimum(np.floor(coords + 0.5), n - 1).astype(np.intp), axis=axis)
+    first = np.floor(coords).astype(np.intp)
+    shape = [1] * data.ndim
+    shape[axis] = size
+    t = (coords - first).astype(np.float32).reshape(shape)
+    a = np.take(data, first, axis=axis).astype(np.float32)
+    b = np.take(data, np.minimum(first + 1, n - 1), axis=axis).astype(np.float32)
+    return a + (b - a) * t
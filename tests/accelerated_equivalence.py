@@ -0,0 +1,120 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+import accelerated
+from voxelize.voxelintersect.triangle import Triangle, t_c_intersection, triangle_lib, vertexes_to_c_triangle
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", dest='shape', type=int, nargs=3, default=[64, 96, 96], help="Z H W of the test volume")
+    parser.add_argument("-n", dest='points', type=int, default=20000, help="points of the trilinear test")
+    parser.add_argument("-c", dest='cuts', type=int, default=8, help="cuts of the points of the splat test")
+    parser.add_argument("-t", dest='triangles', type=int, default=2000, help="triangles of the triangle-cube test")
+    parser.add_argument("-r", dest='repeat', type=int, default=3, help="runs of each backend")
+    parser.add_argument("-p", dest='python', action='store_true',
+                        help="without numba, compare the python loops of the kernels (not the compiled kernels)")
+    return parser.parse_args()
+
+
+def triangle(v1, v2, v3):
+    t = Triangle()
+    t.set(v1, v2, v3)
+    return t
+
+
+# compiled kernels behind the 'numba' backend
+KERNELS = ['_trilinear_kernel', '_splat_kernel', '_splat_columns_kernel', '_triangle_cube_kernel']
+
+
+def compiled_kernels():
+    """
+    Returns:
+        (dict): name -> whether the kernel has been compiled by numba, i.e. it has at least one signature
+    """
+    return {name: bool(getattr(getattr(accelerated, name), 'signatures', None)) for name in KERNELS}
+
+
+def accelerated_equivalence(shape=(64, 96, 96), n_points=20000, n_cuts=8, n_triangles=2000, repeat=3, python=False):
+    """
+    compare the NumPy and the compiled backends of the kernels in accelerated and print their timings.
+    without numba the test is skipped: the 'numba' backend would run the python loops of the kernels, which
+    checks the algorithms (python=True) but not the compiled kernels
+
+    Returns:
+        (bool): the backends agree and the compiled kernels have been run (or the python loops, if requested)
+    """
+    print("backend selected at import: {}".format(accelerated.BACKEND))
+    if accelerated.numba is None and not python:
+        print("SKIPPED: numba is not installed, the compiled kernels cannot be tested (-p to run the python loops)")
+        return False
+    rng = np.random.default_rng(0)
+    volume = rng.random(shape, dtype=np.float32)
+    Z, H, W = shape
+
+    # trilinear: points inside and around the volume
+    z, y, x = (rng.uniform(-1, size, n_points) for size in shape)
+    results = {backend: [accelerated.trilinear(volume, z, y, x, backend) for _ in range(repeat)][-1]
+               for backend in accelerated.BACKENDS}
+    print("trilinear: max abs difference {:.2e}".format(np.abs(results['numpy'] - results['numba']).max()))
+    agree = {'trilinear': bool(np.allclose(results['numpy'], results['numba'], atol=1e-5))}
+
+    # splat of labels: random voxels (and z columns) written by random points of n_cuts cuts
+    n_pairs = n_points * 8
+    targets, sources = rng.integers(0, Z * H * W, n_pairs), rng.integers(0, n_points, n_pairs)
+    labels = rng.integers(0, 4, n_points).astype(np.uint8)
+    active = rng.random(n_cuts) > 0.2
+    points_per_cut = -(-n_points // n_cuts)
+    equal = []
+    for out_shape, values, targets_ in [((Z * H * W,), labels, targets),
+                                        ((Z, H * W), np.repeat(labels[:, np.newaxis], Z, 1), targets % (H * W))]:
+        order = np.lexsort((sources, targets_))
+        results = {}
+        for backend in accelerated.BACKENDS:
+            for _ in range(repeat):
+                results[backend] = np.full(out_shape, 3, np.uint8)
+                accelerated.splat(results[backend], targets_[order], sources[order], values, active, points_per_cut,
+                                  backend)
+        equal.append(np.array_equal(results['numpy'], results['numba']))
+    print("splat: voxels equal {}, z columns equal {}".format(*equal))
+    agree['splat'] = all(equal)
+
+    # triangle-cube: random triangles around the unit cube centered on the origin
+    triangles = rng.uniform(-1.5, 1.5, (n_triangles, 3, 3))
+    tests = {'python': lambda v1, v2, v3: t_c_intersection(triangle(v1, v2, v3)),
+             'numba': accelerated.triangle_cube}
+    if triangle_lib:
+        tests['c'] = lambda v1, v2, v3: triangle_lib.t_c_intersection(vertexes_to_c_triangle(v1, v2, v3))
+    results = {}
+    for backend, test in tests.items():
+        start = time.perf_counter()
+        results[backend] = np.array([test(v1, v2, v3) for v1, v2, v3 in triangles])
+        accelerated.record('triangle_cube', backend, n_triangles, time.perf_counter() - start)
+    python, jit, c = results['python'], results['numba'], results.get('c')
+    print("triangle-cube: {} of {} intersecting, python and compiled tests differ on {}{}".format(
+        (python == accelerated.TC_INSIDE).sum(), n_triangles, (python != jit).sum(),
+        ", C library on {}".format((python != c).sum()) if triangle_lib else ""))
+    agree['triangle_cube'] = bool((python != jit).sum() == 0)
+
+    for (kernel, backend), timing in sorted(accelerated.kernel_timings().items()):
+        print("{} ({}): {} calls, {:.3f}s, {:.2e} items/s".format(
+            kernel, backend, timing['calls'], timing['seconds'], timing['items_per_second']))
+
+    print("backends agree: {}".format(agree))
+    if not all(agree.values()):
+        print("FAILED: the backends differ on {}".format(", ".join(k for k, ok in agree.items() if not ok)))
+        return False
+    if accelerated.numba is None:
+        print("python loops of the kernels compared, the compiled kernels have not been tested")
+        return True
+    compiled = compiled_kernels()
+    print("compiled kernels: {}".format(compiled))
+    return all(compiled.values())
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    ok = accelerated_equivalence(tuple(args.shape), args.points, args.cuts, args.triangles, args.repeat, args.python)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,69 @@
+import argparse
+import time
+
+import numpy as np
+import processing
+from Jaw import Jaw
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", dest='dicomdir', required=True, help="path of the DICOMDIR file")
+    parser.add_argument("-s", dest='slice', type=int, default=96, help="slice used for the arch detection")
+    parser.add_argument("-n", dest='columns', type=int, default=100000, help="random columns of the gather test")
+    parser.add_argument("-r", dest='repeat', type=int, default=3, help="runs of each test")
+    return parser.parse_args()
+
+
+def best_time(fn, repeat):
+    best = np.inf
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t)
+    return best, result
+
+
+def column_store_benchmark(dicomdir, slice_idx=96, n_columns=100000, repeat=3):
+    """
+    compare the column samplers reading the (Z, H, W) volume with the ones reading its (H, W, Z) ColumnStore:
+    bandwidth of random z column gathers, line_slice on the side coords and create_panorex on the arch
+    """
+    jaw = Jaw(dicomdir)
+    t = time.perf_counter()
+    jaw.column_store = True
+    store = jaw.columns
+    print("volume {}, column store built in {:.3f}s ({:.0f} MB)".format(
+        jaw.volume.shape, time.perf_counter() - t, store.nbytes / 2 ** 20))
+
+    rng = np.random.default_rng(0)
+    ys, xs = rng.integers(0, jaw.H, n_columns), rng.integers(0, jaw.W, n_columns)
+    size = n_columns * jaw.Z * store.dtype.itemsize
+    t_volume, a = best_time(lambda: jaw.volume[:, ys, xs], repeat)
+    t_store, b = best_time(lambda: store.gather(ys, xs), repeat)
+    assert np.array_equal(a, b.T)
+    print("gather of {} columns: volume {:.3f}s ({:.2f} GB/s), column store {:.3f}s ({:.2f} GB/s), x{:.1f}".format(
+        n_columns, t_volume, size / t_volume / 2 ** 30, t_store, size / t_store / 2 ** 30, t_volume / t_store))
+
+    section = jaw.get_slice(slice_idx)
+    p, start, end = processing.arch_detection(section)
+    l_offset, coords, h_offset, derivative = processing.arch_lines(p, start, end)
+    side_coords = processing.generate_side_coords(h_offset, l_offset, derivative)
+    jaw.line_slice(side_coords)  # the resampling operator of side_coords is built once, outside the timings
+    tests = [
+        ('line_slice', lambda: jaw.line_slice(side_coords)),
+        ('line_slice bicubic', lambda: jaw.line_slice(side_coords, interp_fn='bicubic_interpolation')),
+        ('create_panorex', lambda: jaw.create_panorex(coords)),
+    ]
+    for name, fn in tests:
+        jaw.column_store = False
+        t_volume, a = best_time(fn, repeat)
+        jaw.column_store = True
+        t_store, b = best_time(fn, repeat)
+        print("{}: volume {:.3f}s, column store {:.3f}s, x{:.1f}, max abs difference {:.2e}".format(
+            name, t_volume, t_store, t_volume / t_store, np.abs(a - b).max()))
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    column_store_benchmark(args.dicomdir, args.slice, args.columns, args.repeat)
@@ -0,0 +1,46 @@
+import argparse
+import time
+
+import numpy as np
+import processing
+from Jaw import Jaw
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", dest='dicomdir', required=True, help="path of the DICOMDIR file")
+    parser.add_argument("-s", dest='slice', type=int, default=96, help="slice used for the arch detection")
+    parser.add_argument("-r", dest='repeat', type=int, default=3, help="runs of each implementation")
+    return parser.parse_args()
+
+
+def line_slice_benchmark(dicomdir, slice_idx=96, repeat=3):
+    """
+    compare the point by point line_slice with the vectorized one on the side coords of a jaw:
+    best time of each implementation and max difference between the cuts
+    """
+    jaw = Jaw(dicomdir)
+    section = jaw.get_slice(slice_idx)
+    p, start, end = processing.arch_detection(section)
+    l_offset, coords, h_offset, derivative = processing.arch_lines(p, start, end)
+    side_coords = processing.generate_side_coords(h_offset, l_offset, derivative)
+    print("side coords: {} cuts x {} points, volume {}".format(*side_coords.shape[:2], jaw.volume.shape))
+
+    for interp_fn in ['bilinear_interpolation', 'bicubic_interpolation']:
+        times = {}
+        cuts = {}
+        for vectorized in [False, True]:
+            best = np.inf
+            for _ in range(repeat):
+                t = time.perf_counter()
+                cuts[vectorized] = jaw.line_slice(side_coords, interp_fn=interp_fn, vectorized=vectorized)
+                best = min(best, time.perf_counter() - t)
+            times[vectorized] = best
+        print("{}: loop {:.3f}s, vectorized {:.3f}s, speedup x{:.1f}, max abs difference {:.2e}".format(
+            interp_fn, times[False], times[True], times[False] / times[True],
+            np.abs(cuts[False] - cuts[True]).max()))
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    line_slice_benchmark(args.dicomdir, args.slice, args.repeat)
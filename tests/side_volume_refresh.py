@@ -0,0 +1,88 @@
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+import processing
+from Jaw import Jaw
+from annotation.components.message.Messenger import Messenger
+from annotation.components.message.Strategies import TerminalMessageStrategy
+from annotation.core.SideVolume import SideVolume
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", dest='dicomdir', required=True, help="path of the DICOMDIR file")
+    parser.add_argument("-s", dest='slice', type=int, default=96, help="slice used for the arch detection")
+    parser.add_argument("-m", dest='moved', type=int, default=10, help="cuts moved by the edit of the arch")
+    parser.add_argument("-q", dest='quantized', action='store_true', help="quantized volume, see Jaw")
+    return parser.parse_args()
+
+
+def same_side_volume(refreshed, fresh, atol=1e-5):
+    """
+    Returns:
+        (bool): the normalized images and the gt of the two side volumes match
+    """
+    return refreshed.get_original().shape == fresh.get_original().shape \
+        and np.allclose(refreshed.get_original(), fresh.get_original(), atol=atol) \
+        and np.allclose(refreshed.original_gt, fresh.original_gt, atol=atol)
+
+
+def side_volume_refresh(jaw, coords, side_coords, moved=10, scale=1):
+    """
+    compare the side volumes refreshed after an edit of the arch with a side volume computed from scratch:
+    the one in memory, the one loaded from disk and the one loaded from a save without the range of its cuts
+
+    Args:
+        jaw (Jaw): jaw with side_coords, coords and dicomdir_path (the side volume is saved next to it)
+        coords ((list, list, list, list)): l_offset, coords, h_offset and derivative of the arch
+        side_coords (numpy.ndarray): N x L x 2 coordinates of the cuts
+        moved (int): cuts in the middle of the arch moved by the edit
+
+    Returns:
+        (bool): all the refreshed side volumes match the side volume computed by update
+    """
+    jaw.coords, jaw.side_coords, jaw.annotation_masks = coords, np.asarray(side_coords), None
+    side_volume = SideVolume(jaw, scale)  # computed and saved
+    loaded = SideVolume(jaw, scale)
+    loaded.load_()
+
+    edited = np.array(side_coords, dtype=np.float64)
+    start = (len(edited) - moved) // 2
+    edited[start:start + moved] += 3  # more than REUSE_TOLERANCE
+    jaw.side_coords = edited
+    fresh = SideVolume(jaw, scale)
+
+    results = {}
+    for name, refreshed in [('in memory', side_volume), ('loaded', loaded)]:
+        refreshed.refresh()
+        results[name] = same_side_volume(refreshed, fresh)
+
+    # a save without the range of the cuts (before CUT_RANGE_FILENAME): the loaded side volume is cut again
+    jaw.side_coords = np.asarray(side_coords)
+    SideVolume(jaw, scale)
+    cut_range = os.path.join(os.path.dirname(jaw.dicomdir_path), SideVolume.SAVE_DIRNAME, SideVolume.CUT_RANGE_FILENAME)
+    os.path.isfile(cut_range) and os.remove(cut_range)  # a quantized side volume has no range to save
+    old = SideVolume(jaw, scale)
+    old.load_()
+    jaw.side_coords = edited
+    old.refresh()
+    results['loaded without range'] = same_side_volume(old, fresh)
+
+    print("refreshed side volume equal to a new one: {}".format(results))
+    return all(results.values())
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    Messenger(TerminalMessageStrategy())
+    jaw = Jaw(args.dicomdir, quantized=args.quantized)
+    p, start, end = processing.arch_detection(jaw.get_slice(args.slice))
+    l_offset, coords, h_offset, derivative = processing.arch_lines(p, start, end)
+    side_coords = processing.generate_side_coords(h_offset, l_offset, derivative)
+    with tempfile.TemporaryDirectory() as tmp:
+        jaw.dicomdir_path = os.path.join(tmp, "DICOMDIR")  # the side volumes are saved in tmp
+        ok = side_volume_refresh(jaw, (l_offset, coords, h_offset, derivative), side_coords, args.moved)
+    sys.exit(0 if ok else 1)
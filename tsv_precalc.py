@@ -11,7 +11,7 @@ import warnings
 if not sys.warnoptions:
     warnings.simplefilter("ignore")
 
-TOOL_DIRS = ['side_volume', 'annotated_dicom', 'masks']
+TOOL_DIRS = ['side_volume', 'annotated_dicom', 'masks', 'volume_cache']
 TOOL_FILES = ['dump.json', 'history.json', 'gt_volume.npy', 'volume.npy']
 
 
@@ -30,6 +30,8 @@ def parse_args():
                         help="Clean directory from saves and other data")
     parser.add_argument("-w", dest='workers', type=int, required=False, default=cpu_count(),
                         help="Amount of workers for concurrent side volume computation")
+    parser.add_argument("-q", dest='quantized', action='store_true', required=False, default=False,
+                        help="Keep the volumes as uint16, half the memory of each worker")
     return parser.parse_args()
 
 
@@ -55,9 +57,9 @@ def clean(root):
         delete_dir(os.path.join(root, dir))
 
 
-def extract_gt(dicomdir):
-    ah = ArchHandler(dicomdir)
-    ah.__init__(dicomdir)
+def extract_gt(dicomdir, quantized=False):
+    ah = ArchHandler(dicomdir, quantized=quantized)
+    ah.__init__(dicomdir, quantized=quantized)
     ah.compute_initial_state(96, want_side_volume=False)
     ah.extract_data_from_gt(load_annotations=False)
     try:
@@ -87,7 +89,7 @@ if __name__ == '__main__':
     t_start = time.time()
 
     with ProcessPoolExecutor(max_workers=args.workers) as executor:
-        futures = [executor.submit(extract_gt, dicomdir) for dicomdir in dicomdirs]
+        futures = [executor.submit(extract_gt, dicomdir, args.quantized) for dicomdir in dicomdirs]
 
         kwargs = {
             'total': len(futures),
@@ -1,9 +1,12 @@
 import argparse
 import sys
 import math
+import time
 import numpy as np
 from tqdm import tqdm
 
+import accelerated
+
 from .common.progressbar import print_progress_bar
 from .voxelintersect.triangle import Triangle, t_c_intersection, INSIDE, vertexes_to_c_triangle, triangle_lib
 from .mesh import get_scale_and_shift, scale_and_shift_triangle
@@ -77,7 +80,10 @@ def get_intersecting_voxels_depth_first(vertex_1, vertex_2, vertex_3):
 
     @rtype: list[(int, int, int)]
     """
-    c_lib = triangle_lib
+    start = time.perf_counter()
+    # compiled test when numba is available, then the C library and the python implementation
+    jit = accelerated.BACKEND == 'numba'
+    c_lib = None if jit else triangle_lib
     result_positions = []
     tmp_triangle = None
     searched = set()
@@ -95,7 +101,7 @@ def get_intersecting_voxels_depth_first(vertex_1, vertex_2, vertex_3):
     tmp_vertex_1 = np.array([0.0, 0.0, 0.0])
     tmp_vertex_2 = np.array([0.0, 0.0, 0.0])
     tmp_vertex_3 = np.array([0.0, 0.0, 0.0])
-    if not c_lib:
+    if not jit and not c_lib:
         tmp_triangle = Triangle()
         tmp_triangle.set(tmp_vertex_1, tmp_vertex_2, tmp_vertex_3)
     while len(stack) > 0:
@@ -111,12 +117,15 @@ def get_intersecting_voxels_depth_first(vertex_1, vertex_2, vertex_3):
         np.subtract(vertex_3, tmp, tmp_vertex_3)
 
         try:
-            if c_lib:
+            if jit:
+                is_inside = accelerated.triangle_cube(tmp_vertex_1, tmp_vertex_2, tmp_vertex_3) == INSIDE
+            elif c_lib:
                 is_inside = c_lib.t_c_intersection(
                     vertexes_to_c_triangle(tmp_vertex_1, tmp_vertex_2, tmp_vertex_3)) == INSIDE
             else:
                 is_inside = t_c_intersection(tmp_triangle) == INSIDE
         except Exception:
+            jit = False
             c_lib = None
             tmp_triangle = Triangle()
             tmp_triangle.set(tmp_vertex_1, tmp_vertex_2, tmp_vertex_3)
@@ -156,6 +165,8 @@ def get_intersecting_voxels_depth_first(vertex_1, vertex_2, vertex_3):
             for neighbour in neighbours:
                 if neighbour not in searched:
                     stack.add(neighbour)
+    accelerated.record('triangle_cube', 'numba' if jit else 'c' if c_lib else 'python', len(searched),
+                       time.perf_counter() - start)
     del searched, stack
     return result_positions
 